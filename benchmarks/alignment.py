@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the alignment of Function entries, loop headers and memories on the Euler examples.
+Each example is compiled without and with the alignment options and the best run time is compared.
+Usage: python3 benchmarks/alignment.py [torth.py options]
+"""
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+REPOSITORY_DIRECTORY: pathlib.Path = pathlib.Path(__file__).parent.parent
+EXAMPLES: List[pathlib.Path] = sorted(
+    (REPOSITORY_DIRECTORY / "examples" / "euler").glob("*.torth")
+)
+ALIGNMENT_OPTIONS: List[str] = [
+    "--align-functions=16",
+    "--align-loops=64",
+    "--align-memories=64",
+]
+RUN_COUNT: int = 5
+
+
+def compile_example(example: pathlib.Path, executable: pathlib.Path, options: List[str]) -> None:
+    """Compile the example to the executable with the torth.py options."""
+    torth: str = str(REPOSITORY_DIRECTORY / "torth.py")
+    subprocess.run(
+        [sys.executable, torth, *options, "-o", str(executable), str(example)],
+        check=True,
+        cwd=executable.parent,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def measure_run_time(executable: pathlib.Path) -> float:
+    """Return the best wall time of running the executable."""
+    best_time: float = float("inf")
+    for _ in range(RUN_COUNT):
+        start_time: float = time.perf_counter()
+        subprocess.run([str(executable)], check=True, stdout=subprocess.DEVNULL)
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time
+
+
+def main() -> None:
+    """Print the run time of each Euler example without and with the alignment."""
+    options: List[str] = sys.argv[1:]
+    print(f"Alignment options: {' '.join(ALIGNMENT_OPTIONS)}")
+    print(f"{'Example':<10} {'Unaligned s':>12} {'Aligned s':>12} {'Speedup':>8}")
+    with tempfile.TemporaryDirectory(prefix="torth-alignment-") as directory:
+        for example in EXAMPLES:
+            unaligned: pathlib.Path = pathlib.Path(directory) / f"{example.stem}.bin"
+            aligned: pathlib.Path = pathlib.Path(directory) / f"{example.stem}.aligned.bin"
+            compile_example(example, unaligned, options)
+            compile_example(example, aligned, options + ALIGNMENT_OPTIONS)
+            unaligned_time: float = measure_run_time(unaligned)
+            aligned_time: float = measure_run_time(aligned)
+            print(
+                f"{example.stem:<10} {unaligned_time:>12.4f} {aligned_time:>12.4f}"
+                f" {unaligned_time / aligned_time:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
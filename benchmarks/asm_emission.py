@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the assembly generation of programs with many string literals.
+The time per string literal should stay the same when the count of literals grows.
+Usage: python3 benchmarks/asm_emission.py [COUNT ...]
+"""
+import argparse
+import pathlib
+import sys
+import time
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+# pylint: disable=wrong-import-position
+from compiler.asm import generate_asm
+from compiler.defs import Function, Op, OpType, Program, Token, TokenType
+from compiler.utils import get_command_line_arguments
+
+DEFAULT_COUNTS: List[int] = [1000, 10000, 100000]
+
+
+def get_benchmark_program(literal_count: int) -> Program:
+    """
+    Return a MAIN Function pushing and dropping distinct string literals.
+    The Program is built directly to measure the assembly generation without the parser.
+    """
+    main_function: Function = Function("main", ([], []), [], {})
+    program: Program = []
+    for index in range(literal_count):
+        location: Tuple[str, int, int] = ("literals.torth", index + 2, 3)
+        literal: Token = Token(f'"literal {index}"', TokenType.STR, location)
+        drop: Token = Token("drop", TokenType.WORD, location)
+        program.append(Op(len(program), OpType.PUSH_STR, literal, main_function))
+        program.append(Op(len(program), OpType.INTRINSIC, drop, main_function))
+    return program
+
+
+def measure_asm_generation(literal_count: int) -> float:
+    """Return the wall time of generating assembly for the program with the literals."""
+    sub_programs: Dict[str, Program] = {"main": get_benchmark_program(literal_count)}
+    args: argparse.Namespace = get_command_line_arguments(["literals.torth"])
+    start_time: float = time.perf_counter()
+    generate_asm(sub_programs, [], [], args)
+    return time.perf_counter() - start_time
+
+
+def main() -> None:
+    """Print the time spent in the assembly generation for each count of string literals."""
+    counts: List[int] = [int(count) for count in sys.argv[1:]] or DEFAULT_COUNTS
+    print(f"{'Literals':>10} {'Seconds':>10} {'us/literal':>12}")
+    for count in counts:
+        seconds: float = measure_asm_generation(count)
+        print(f"{count:>10} {seconds:>10.3f} {seconds / count * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
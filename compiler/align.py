@@ -0,0 +1,59 @@
+"""
+Alignment of Function entries, loop headers and memories in the generated assembly
+"""
+import re
+from typing import List, Set
+from compiler.defs import Memory
+
+# Memories of at least a page are aligned to the page size
+PAGE_SIZE: int = 4096
+
+LABEL_REGEX = re.compile(r"^([^\s;]+):")
+JUMP_REGEX = re.compile(r"^\s+j[a-z]+\s+([^\s;]+)", re.IGNORECASE)
+
+
+def is_valid_alignment(alignment: int) -> bool:
+    """Check if the alignment is zero for no alignment or a power of two up to the page size."""
+    return alignment == 0 or 0 < alignment <= PAGE_SIZE and alignment & (alignment - 1) == 0
+
+
+def get_memory_alignment(memory: Memory, alignment: int) -> int:
+    """Return the alignment of the memory, which is at least the page size for large memories."""
+    return max(alignment, PAGE_SIZE) if memory.size >= PAGE_SIZE else alignment
+
+
+def get_loop_header_labels(lines: List[str]) -> Set[str]:
+    """Return the labels which are jumped to from below, which start loops."""
+    defined: Set[str] = set()
+    loop_headers: Set[str] = set()
+    for line in lines:
+        label_match = LABEL_REGEX.match(line)
+        if label_match:
+            defined.add(label_match.group(1))
+            continue
+        jump_match = JUMP_REGEX.match(line)
+        if jump_match and jump_match.group(1) in defined:
+            loop_headers.add(jump_match.group(1))
+    return loop_headers
+
+
+def align_code(
+    assembly: str, function_labels: Set[str], function_alignment: int, loop_alignment: int
+) -> str:
+    """
+    Align the Function entries and the loop headers of the assembly.
+    The padding before a loop header is executed only once when the loop is entered from above.
+    """
+    if not function_alignment and not loop_alignment:
+        return assembly
+    lines: List[str] = assembly.split("\n")
+    loop_headers: Set[str] = get_loop_header_labels(lines) if loop_alignment else set()
+    aligned_lines: List[str] = []
+    for line in lines:
+        label_match = LABEL_REGEX.match(line)
+        if label_match and label_match.group(1) in function_labels and function_alignment:
+            aligned_lines.append(f"align {function_alignment}")
+        elif label_match and label_match.group(1) in loop_headers:
+            aligned_lines.append(f"align {loop_alignment}")
+        aligned_lines.append(line)
+    return "\n".join(aligned_lines)
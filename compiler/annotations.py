@@ -0,0 +1,38 @@
+"""
+Comments and line directives which tie the generated assembly to the Torth source
+"""
+from typing import Optional
+from compiler.defs import Location, Op, OpType
+
+
+def get_op_comment_asm(op: Op, op_type: OpType) -> str:
+    """Generate assembly comment for the Op. Return the comment string."""
+    # Function calls and returns should not generate any output
+    op_name: str = op_type.name
+    src_file: str = op.token.location[0]
+    row: int = op.token.location[1]
+    col: int = op.token.location[2]
+    if op_name == "INTRINSIC":
+        op_name = f"{op_name} {op.token.value}"
+    elif op_name == "FUNCTION_CALL":
+        op_name = f"Call {op.token.value}"
+    return get_token_info_comment_asm(
+        op_name, src_file, row, col, function_name=op.func.name
+    )
+
+
+def get_token_info_comment_asm(
+    name: str, file: str, row: int, col: int, function_name: Optional[str] = None
+) -> str:
+    """Return formatted informative string for the current Op"""
+    if function_name:
+        return (
+            f";; [{function_name}] {name} | File: {file}, Row: {row}, Col: {col}" + "\n"
+        )
+    return f";; -- {name} | File: {file}, Row: {row}, Col: {col}" + "\n"
+
+
+def get_line_directive_asm(location: Location) -> str:
+    """Return the NASM directive which attributes the following lines to the source line."""
+    file, row, _col = location
+    return f"%line {row}+0 {file}\n"
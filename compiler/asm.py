@@ -1,31 +1,105 @@
 """
 Functions used for generating assembly code from Torth code
 """
+import argparse
 import base64
 import re
-from typing import Dict, List, Optional
-from compiler.defs import Constant, Function, Memory, OpType, Op, Program, Token
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.defs import (
+    CACHE_REGISTERS,
+    AssemblySections,
+    CallingConvention,
+    CodegenContext,
+    Constant,
+    Function,
+    Memory,
+    OpType,
+    Op,
+    Program,
+    RegisterCache,
+    Token,
+)
+from compiler.align import get_memory_alignment
+from compiler.annotations import (
+    get_line_directive_asm,
+    get_op_comment_asm,
+    get_token_info_comment_asm,
+)
+from compiler.branches import (
+    get_fused_comparison_asm,
+    get_fused_do_asm,
+    get_loop_start_label,
+    is_fused_comparison,
+    is_loop_back_branch,
+)
+from compiler.cache import (
+    CACHE_NEUTRAL_OP_TYPES,
+    get_cache_exit_asm,
+    get_cached_op_asm,
+    get_register_count,
+    get_register_counts,
+)
 from compiler.program import generate_program
+from compiler.shuffle import (
+    StackShuffle,
+    get_cached_shuffle_asm,
+    get_shuffle_asm,
+    get_stack_shuffles,
+)
+from compiler.strength import (
+    get_constant_operand,
+    get_reduced_divmod_asm,
+    get_reduced_mul_asm,
+    is_reduced_operand,
+)
 from compiler.utils import (
     compiler_error,
-    get_parent_op_type_do,
+    get_do_jump_destination,
+    get_frame_address,
     get_parent_while,
+    get_string_label,
     get_end_op_for_while,
     get_related_endif,
     print_if_verbose,
 )
 
 
-def initialize_asm(constants: List[Constant], memories: List[Memory]) -> str:
-    """Initialize assembly code file with some common definitions."""
-    return f"""{get_asm_file_start(constants)}
-section .bss
-  args_ptr: resq 1
-  return_stack: resb 1337*64
-  return_stack_index: resq 1
-{get_memory_definitions_asm(memories)}
-section .text
+# Ops which do not generate code after a Function call in tail position
+TAIL_NO_OP_TYPES: Set[OpType] = {
+    OpType.CAST_BOOL,
+    OpType.CAST_CHAR,
+    OpType.CAST_INT,
+    OpType.CAST_PTR,
+    OpType.CAST_STR,
+    OpType.CAST_UINT8,
+    OpType.ENDIF,
+}
 
+
+def initialize_asm(
+    constants: List[Constant],
+    memories: List[Memory],
+    conventions: Optional[Dict[str, CallingConvention]] = None,
+    comments: bool = True,
+    memory_alignment: int = 0,
+) -> AssemblySections:
+    """
+    Initialize the sections of the assembly file with some common definitions.
+    With comments the memories are annotated with their source locations.
+    The memories are aligned to memory_alignment bytes unless it is zero.
+    """
+    sections: AssemblySections = AssemblySections()
+    sections.header.append(get_asm_file_start(constants))
+    sections.bss.append(
+        """  args_ptr: resq 1
+  return_stack: resb 8*1024*1024  ; Return addresses and frames of bound values
+  return_stack_index: resq 1
+"""
+    )
+    sections.bss.append(get_return_address_definitions_asm(conventions or {}))
+    sections.bss.append(get_memory_definitions_asm(memories, comments, memory_alignment))
+    sections.text.append(
+        """
 ;; Joinked from Porth's print function, thank you Tsoding!
 print:
   mov     r9, -3689348814741910323
@@ -50,22 +124,62 @@ print:
   cmp     rax, 9
   ja      .L2
   lea     rax, [rsp+32]
-  mov     edi, 1
   sub     rdx, rax
-  xor     eax, eax
   lea     rsi, [rsp+32+rdx]
   dec     r8
   mov     rdx, r8
+;; Append the digits to output_buffer, which is flushed first if they might not fit
+  cmp     qword [output_buffer_length], OUTPUT_BUFFER_SIZE-32
+  jbe     .append
+  call    output_flush
+.append:
+  mov     rdi, output_buffer
+  add     rdi, [output_buffer_length]
+  add     [output_buffer_length], rdx
+.copy:
+  mov     cl, [rsi]
+  mov     [rdi], cl
+  inc     rsi
+  inc     rdi
+  dec     rdx
+  jnz     .copy
+  add     rsp, 40
+  ret
+
+;; Write output_buffer to stdout, the syscall argument registers are preserved
+output_flush:
+  push    rax
+  push    rdi
+  push    rsi
+  push    rdx
+  mov     rsi, output_buffer
+  mov     rdx, [output_buffer_length]
+.write:
+  test    rdx, rdx
+  jz      .done
   mov     rax, 1
+  mov     rdi, 1
   syscall
-  add     rsp, 40
+  test    rax, rax
+  jle     .done
+  add     rsi, rax
+  sub     rdx, rax
+  jmp     .write
+.done:
+  mov     qword [output_buffer_length], 0
+  pop     rdx
+  pop     rsi
+  pop     rdi
+  pop     rax
   ret
 
 """
+    )
+    return sections
 
 
 def get_asm_file_start(constants: List[Constant]) -> str:
-    """Return the contents of the beginning of the generated assembly file."""
+    """Return the definitions at the beginning of the generated assembly file."""
     const_defines: str = "".join(
         f"%define {const.name} {const.value}\n" for const in constants
     )
@@ -75,18 +189,35 @@ def get_asm_file_start(constants: List[Constant]) -> str:
 ;; DEFINES
 %define sys_exit 60
 {const_defines}
-section .data
 """
 
 
-def get_memory_definitions_asm(memories: List[Memory]) -> str:
+def get_return_address_definitions_asm(
+    conventions: Dict[str, CallingConvention]
+) -> str:
+    """Reserve memory for the return addresses of Functions with static calling convention"""
+    return "".join(
+        f"  {get_valid_label_for_nasm(name)}.return_address: resq 1\n"
+        for name, convention in conventions.items()
+        if convention == CallingConvention.STATIC
+    )
+
+
+def get_memory_definitions_asm(
+    memories: List[Memory], comments: bool = True, alignment: int = 0
+) -> str:
     """Generates assembly code of memory definitions. Returns the memory definitions."""
-    asm: str = ""
+    definitions: List[str] = []
     for memory in memories:
-        file, row, col = memory.location
-        asm += get_token_info_comment_asm(f"MEMORY {memory.name}", file, row, col)
-        asm += f"  {memory.name}: RESB {memory.size}\n"
-    return asm
+        if comments:
+            file, row, col = memory.location
+            definitions.append(
+                get_token_info_comment_asm(f"MEMORY {memory.name}", file, row, col)
+            )
+        if alignment:
+            definitions.append(f"  alignb {get_memory_alignment(memory, alignment)}\n")
+        definitions.append(f"  {memory.name}: RESB {memory.size}\n")
+    return "".join(definitions)
 
 
 def generate_sub_programs(
@@ -113,54 +244,134 @@ def generate_asm(
     sub_programs: Dict[str, Program],
     constants: List[Constant],
     memories: List[Memory],
-    is_verbose: bool,
+    args: argparse.Namespace,
+    ssa_bodies: Optional[Dict[str, str]] = None,
 ) -> str:
-    """Generate Assembly from Functions."""
-    print_if_verbose("Generating Assembly from Torth code", is_verbose)
+    """
+    Generate Assembly from Functions with the code generation options of the command-line arguments.
+    The ssa_bodies contain the bodies of the Functions generated from the SSA form.
+    """
+    print_if_verbose("Generating Assembly from Torth code", args.verbose)
+    context: CodegenContext = CodegenContext(
+        get_calling_conventions(sub_programs, args.native_calls),
+        {const.name: const.value for const in constants},
+        get_register_counts(sub_programs) if args.register_args else None,
+        {name: program[0].func.signature for name, program in sub_programs.items() if program},
+    )
     # Generate beginning for an Assembly file
-    assembly: str = initialize_asm(constants, memories)
+    sections: AssemblySections = initialize_asm(
+        constants, memories, context.conventions, has_asm_comments(args), args.align_memories
+    )
 
     # Generate Assembly for each Function
     for name, program in sub_programs.items():
-        function_name: str = get_valid_label_for_nasm(name)
-        assembly += get_function_start_asm(function_name)
+        sections.text.append(
+            generate_function_asm(
+                name,
+                program,
+                context,
+                args,
+                None if ssa_bodies is None else ssa_bodies.get(name),
+            )
+        )
+    sections.rodata.append(get_string_pool_asm(sub_programs))
+    return sections.join()
 
-        # The driver code for the Function
-        assembly = generate_program_asm(program, assembly)
 
-        assembly += get_function_end_asm(function_name)
-    return assembly
+def has_asm_comments(args: argparse.Namespace) -> bool:
+    """Check if the Ops are annotated with comments, which is only done for assembly read by people."""
+    return args.asm_comments or args.save_asm or args.debug
 
 
-def get_function_end_asm(function_name: str) -> str:
+def generate_function_asm(
+    name: str,
+    program: Program,
+    context: CodegenContext,
+    args: argparse.Namespace,
+    ssa_body: Optional[str] = None,
+) -> str:
+    """
+    Generate Assembly for a Function from its sub-program or from the body generated from the SSA form.
+    With --debug the Function is mapped to the source lines of its Ops,
+    the body generated from the SSA form is mapped to the first line of the Function.
+    """
+    function_name: str = get_valid_label_for_nasm(name)
+    convention: CallingConvention = context.conventions[name]
+    assembly: str = get_function_start_asm(function_name, convention)
+    if args.debug and program:
+        # The instructions after the label are attributed to the first line of the Function
+        assembly = assembly.replace(
+            ":\n", f":\n{get_line_directive_asm(program[0].token.location)}", 1
+        )
+    if ssa_body is not None:
+        return assembly + ssa_body + get_function_end_asm(function_name, convention)
+    if program:
+        assembly += get_frame_enter_asm(program[0].func)
+
+    # The driver code for the Function
+    assembly += generate_program_asm(program, context, args)
+
+    if program:
+        assembly += get_frame_leave_asm(program[0].func)
+    return assembly + get_function_end_asm(function_name, convention)
+
+
+def get_function_end_asm(
+    function_name: str,
+    convention: CallingConvention = CallingConvention.RETURN_STACK,
+) -> str:
     """Return the end of the Assembly of each Function"""
     assembly: str = ""
     if function_name.upper() != "MAIN":
-        assembly += (
-            f";; [{function_name}] Return to the address found in return_stack\n"
-        )
-        assembly += (
-            "  sub qword [return_stack_index], 8  ; Decrement return_stack_index\n"
-        )
-        assembly += "  mov rax, return_stack\n"
-        assembly += "  add rax, [return_stack_index]\n"
-        assembly += "  push qword [rax]\n"
+        assembly += get_return_address_restore_asm(function_name, convention)
         assembly += "  ret\n\n"
     else:
         assembly += ";; -- exit syscall\n"
         assembly += "  mov rax, sys_exit\n"
         assembly += "  pop rdi\n"
+        assembly += get_output_flush_asm()
         assembly += "  syscall\n\n"
     return assembly
 
 
-def get_function_start_asm(function_name: str) -> str:
+def get_return_address_restore_asm(
+    function_name: str, convention: CallingConvention
+) -> str:
+    """Push the return address of the Function back to the stack"""
+    if convention == CallingConvention.REGISTER:
+        return f";; [{function_name}] Return to the address found in rbp\n  push rbp\n"
+    if convention == CallingConvention.STATIC:
+        assembly: str = f";; [{function_name}] Return to the address found in memory\n"
+        return (
+            assembly
+            + f"  push qword [{get_valid_label_for_nasm(function_name)}.return_address]\n"
+        )
+    assembly = f";; [{function_name}] Return to the address found in return_stack\n"
+    assembly += "  sub qword [return_stack_index], 8  ; Decrement return_stack_index\n"
+    assembly += "  mov rax, return_stack\n"
+    assembly += "  add rax, [return_stack_index]\n"
+    assembly += "  push qword [rax]\n"
+    return assembly
+
+
+def get_function_start_asm(
+    function_name: str,
+    convention: CallingConvention = CallingConvention.RETURN_STACK,
+) -> str:
     """Return the beginning of the Assembly of each Function"""
     assembly = ""
     if function_name.upper() == "MAIN":
         assembly += "global _start\n"
         assembly += "_start:\n"
         assembly += "  mov [args_ptr], rsp   ; Pointer to argc\n"
+    elif convention == CallingConvention.REGISTER:
+        assembly += f"{function_name}:\n"
+        assembly += f";; [{function_name}] Save the return address to rbp\n"
+        assembly += "  pop rbp\n"
+    elif convention == CallingConvention.STATIC:
+        assembly += f"{function_name}:\n"
+        assembly += f";; [{function_name}] Save the return address to memory\n"
+        assembly += f"  pop qword [{function_name}.return_address]\n"
     else:
         assembly += f"{function_name}:\n"
         assembly += f";; [{function_name}] Save the return address to return_stack\n"
@@ -170,21 +381,213 @@ def get_function_start_asm(function_name: str) -> str:
         assembly += (
             "  add qword [return_stack_index], 8  ; Increment return_stack_index\n"
         )
+        # Tail calls jump over the saving of the return address
+        assembly += f"{function_name}.body:\n"
     return assembly
 
 
-def generate_program_asm(program: Program, assembly: str) -> str:
-    """Generate Assembly for a sub-program."""
+def get_calling_conventions(
+    sub_programs: Dict[str, Program], native_calls: bool
+) -> Dict[str, CallingConvention]:
+    """
+    Choose the place for the return address of each Function.
+    Without native_calls every Function uses return_stack.
+    """
+    callees: Dict[str, Set[str]] = {
+        name: {op.token.value for op in program if op.type == OpType.FUNCTION_CALL}
+        for name, program in sub_programs.items()
+    }
+    conventions: Dict[str, CallingConvention] = {}
+    for name in sub_programs:
+        if not native_calls or is_recursive_function(name, callees):
+            conventions[name] = CallingConvention.RETURN_STACK
+        elif not callees[name]:
+            conventions[name] = CallingConvention.REGISTER
+        else:
+            conventions[name] = CallingConvention.STATIC
+    return conventions
+
+
+def is_recursive_function(name: str, callees: Dict[str, Set[str]]) -> bool:
+    """Check if the Function can call itself directly or through other Functions."""
+    visited: Set[str] = set()
+    unvisited: List[str] = list(callees[name])
+    while unvisited:
+        callee: str = unvisited.pop()
+        if callee == name:
+            return True
+        if callee not in visited:
+            visited.add(callee)
+            unvisited += callees.get(callee, set())
+    return False
+
+
+def generate_program_asm(
+    program: Program, context: CodegenContext, args: argparse.Namespace
+) -> str:
+    """
+    Generate Assembly for a sub-program with the code generation options of the command-line arguments.
+    With --tos-cache the topmost stack elements are kept in registers between Ops.
+    With --fuse-branches a comparison directly before DO is lowered to a conditional jump.
+    With --strength-reduce multiplications and divisions by constants are strength reduced.
+    With --tail-calls Function calls in tail position are lowered to jumps.
+    With --register-args parameters and return values are passed in the cache registers.
+    With --combine-shuffles the runs of stack shuffling Ops are generated as a single permutation.
+    With comments every Op is annotated with its source location.
+    With --debug the instructions of each Op are mapped to its source line.
+    """
+    comments: bool = has_asm_comments(args)
+    register_counts: Optional[Dict[str, Tuple[int, int]]] = context.register_counts
+    constant_values: Optional[Dict[str, int]] = (
+        context.constants if args.strength_reduce else None
+    )
+    shuffles: Dict[int, StackShuffle] = (
+        get_stack_shuffles(program, context.constants) if args.combine_shuffles else {}
+    )
+    cache: Optional[RegisterCache] = (
+        RegisterCache() if args.tos_cache or args.register_args else None
+    )
+    if cache is not None and register_counts is not None and program:
+        # The caller has arranged the parameters to the cache registers
+        cache.registers = CACHE_REGISTERS[
+            : get_register_count(program[0].func.name, register_counts, is_return=False) or 0
+        ]
+    assembly: List[str] = []
+    shuffled_until: int = -1
+    source_line: Optional[Tuple[str, int]] = None
     for op in program:
-        assembly += get_op_comment_asm(op, op.type)
-        if op.type == OpType.PUSH_STR:
-            assembly = add_string_variable_asm(assembly, op.token.value, op)
+        if comments:
+            assembly.append(get_op_comment_asm(op, op.type))
+        if args.debug and op.token.location[:2] != source_line:
+            assembly.append(get_line_directive_asm(op.token.location))
+            source_line = op.token.location[:2]
+        if op.id <= shuffled_until:
+            continue
+        if op.id in shuffles:
+            shuffle_asm: Optional[str] = (
+                get_shuffle_asm(shuffles[op.id])
+                if cache is None
+                else get_cached_shuffle_asm(shuffles[op.id], cache)
+            )
+            if shuffle_asm is not None:
+                assembly.append(shuffle_asm)
+                shuffled_until = shuffles[op.id].last_id
+                continue
 
         # Get assembly for the current Op
-        op_asm: str = get_op_asm(op, program=program)
+        operand: Optional[int] = (
+            None
+            if constant_values is None
+            else get_constant_operand(op, program, constant_values)
+        )
+        if constant_values is not None and is_reduced_operand(
+            op, program, constant_values
+        ):
+            op_asm: str = ""
+        elif operand is not None and op.token.value.upper() == "MUL":
+            op_asm = get_reduced_mul_asm(operand, cache)
+        elif operand is not None:
+            op_asm = get_reduced_divmod_asm(operand, cache)
+        elif args.fuse_branches and is_fused_comparison(op, program):
+            op_asm = get_fused_comparison_asm(cache)
+        elif args.fuse_branches and op.type == OpType.DO and op.id > 0 and (
+            is_fused_comparison(program[op.id - 1], program)
+        ):
+            op_asm = get_fused_do_asm(op, program, cache)
+        elif args.tail_calls and is_tail_call(op, program) and returns_like_caller(op, context):
+            op_asm = get_cache_exit_asm(
+                cache,
+                get_register_count(op.token.value, register_counts, is_return=False),
+            )
+            op_asm += get_frame_leave_asm(op.func)
+            op_asm += get_tail_call_asm(op, context.conventions)
+        elif op.type == OpType.RETURN:
+            op_asm = get_cache_exit_asm(
+                cache,
+                get_register_count(op.func.name, register_counts, is_return=True),
+            )
+            op_asm += get_frame_leave_asm(op.func)
+            op_asm += get_return_asm(op.func.name, context.conventions[op.func.name])
+        elif (
+            cache is not None
+            and register_counts is not None
+            and op.type == OpType.FUNCTION_CALL
+        ):
+            op_asm = get_register_call_asm(op, cache, register_counts)
+        elif cache is not None:
+            op_asm = get_op_asm_with_cache(op, program, cache)
+        else:
+            op_asm = get_op_asm(op, program=program)
         if op_asm != "":
-            assembly += op_asm
-    return f"{assembly}"
+            assembly.append(op_asm)
+
+    # Return values are passed to the caller in the stack or in the cache registers
+    if program:
+        assembly.append(
+            get_cache_exit_asm(
+                cache,
+                get_register_count(program[0].func.name, register_counts, is_return=True),
+            )
+        )
+    return "".join(assembly)
+
+
+def get_frame_enter_asm(func: Function, slot_count: Optional[int] = None) -> str:
+    """
+    Reserve a frame for the bound values of the Function from return_stack.
+    The frame pointer r15 points to the frame and the caller's r15 is saved below the frame.
+    The slot_count overrides the count of bound values, like for the spill slots of SSA values.
+    """
+    if slot_count is None:
+        slot_count = len(func.binding)
+    if not slot_count:
+        return ""
+    frame_size: int = 8 * slot_count
+    assembly: str = f";; [{func.name}] Reserve a frame for {slot_count} value(s)\n"
+    assembly += "  mov rax, return_stack\n"
+    assembly += "  add rax, [return_stack_index]\n"
+    assembly += "  mov [rax], r15  ; Caller's frame pointer\n"
+    assembly += "  lea r15, [rax+8]\n"
+    assembly += f"  add qword [return_stack_index], {frame_size + 8}\n"
+    return assembly
+
+
+def get_frame_leave_asm(func: Function, slot_count: Optional[int] = None) -> str:
+    """Release the frame of the Function and restore the caller's frame pointer"""
+    if slot_count is None:
+        slot_count = len(func.binding)
+    if not slot_count or func.name.upper() == "MAIN":
+        return ""
+    frame_size: int = 8 * slot_count
+    assembly: str = f";; [{func.name}] Release the frame\n"
+    assembly += f"  sub qword [return_stack_index], {frame_size + 8}\n"
+    assembly += "  mov r15, [r15-8]\n"
+    return assembly
+
+
+def get_op_asm_with_cache(op: Op, program: Program, cache: RegisterCache) -> str:
+    """
+    Generate assembly code for certain Op while keeping the topmost stack elements in registers.
+    The cache is spilled to the stack at calls, syscalls, block boundaries and NTH.
+    """
+    if op.type in CACHE_NEUTRAL_OP_TYPES:
+        return get_op_asm(op, program)
+    op_asm: Optional[str] = get_cached_op_asm(op, program, cache)
+    if op_asm is None:
+        # The Op either jumps, is jumped to or uses the stack in memory
+        return cache.spill() + get_op_asm(op, program)
+    return op_asm
+
+
+def get_register_call_asm(
+    op: Op, cache: RegisterCache, register_counts: Dict[str, Tuple[int, int]]
+) -> str:
+    """Call a Function with the topmost parameters and return values in the cache registers."""
+    param_count, return_count = register_counts[op.token.value]
+    op_asm: str = cache.arrange(param_count)
+    op_asm += get_function_call_asm(op)
+    cache.registers = CACHE_REGISTERS[:return_count]
+    return op_asm
 
 
 def get_op_asm(op: Op, program: Program) -> str:
@@ -198,6 +601,7 @@ def get_op_asm(op: Op, program: Program) -> str:
         OpType.CAST_UINT8,
         OpType.IF,  # If is just a keyword which starts an IF-block
         OpType.IN,
+        OpType.PEEK,  # PEEK_BIND reads the values relative to the stack pointer
         OpType.TAKE,
     }:
         return ""
@@ -219,10 +623,8 @@ def get_op_asm(op: Op, program: Program) -> str:
         return get_endif_asm(op)
     if op.type == OpType.FUNCTION_CALL:
         return get_function_call_asm(op)
-    if op.type == OpType.PEEK:
-        return get_peek_asm()
     if op.type == OpType.PEEK_BIND:
-        return get_peek_bind_asm(op)
+        return get_peek_bind_asm(op, program)
     if op.type == OpType.POP_BIND:
         return get_pop_bind_asm(op)
     if op.type == OpType.PUSH_BIND:
@@ -325,33 +727,6 @@ def get_intrinsic_asm(token: Token) -> str:
     )
 
 
-def get_op_comment_asm(op: Op, op_type: OpType) -> str:
-    """Generate assembly comment for the Op. Return the comment string."""
-    # Function calls and returns should not generate any output
-    op_name: str = op_type.name
-    src_file: str = op.token.location[0]
-    row: int = op.token.location[1]
-    col: int = op.token.location[2]
-    if op_name == "INTRINSIC":
-        op_name = f"{op_name} {op.token.value}"
-    elif op_name == "FUNCTION_CALL":
-        op_name = f"Call {op.token.value}"
-    return get_token_info_comment_asm(
-        op_name, src_file, row, col, function_name=op.func.name
-    )
-
-
-def get_token_info_comment_asm(
-    name: str, file: str, row: int, col: int, function_name: Optional[str] = None
-) -> str:
-    """Return formatted informative string for the current Op"""
-    if function_name:
-        return (
-            f";; [{function_name}] {name} | File: {file}, Row: {row}, Col: {col}" + "\n"
-        )
-    return f";; -- {name} | File: {file}, Row: {row}, Col: {col}" + "\n"
-
-
 def get_comparison_asm(cmov_operand: str) -> str:
     """
     Generate assembly code for different comparison Intrinsics, like EQ.
@@ -393,72 +768,47 @@ def format_escape_sequence_characters_for_nasm(string: str) -> str:
     return string
 
 
-def add_string_variable_asm(assembly: str, string: str, op: Op) -> str:
-    """Writes a new string variable to assembly file in the .rodata section."""
-    data_section: str = "section .data\n"
-    string_index = assembly.find(data_section) + len(data_section)
-
-    # Replace \n with nasm approved 10s for newline
-    escaped_string: str = format_escape_sequence_characters_for_nasm(string)
-    return f"{assembly[:string_index]}  {op.func.name}_s{op.id} db {escaped_string},0\n{assembly[string_index:]}"
+def get_string_pool_asm(
+    sub_programs: Dict[str, Program], defined_labels: Optional[Set[str]] = None
+) -> str:
+    """
+    Writes every unique string literal of the Program once to the read-only .rodata section.
+    The strings with defined_labels are skipped and the labels of the written strings are added.
+    """
+    if defined_labels is None:
+        defined_labels = set()
+    definitions: List[str] = []
+    for program in sub_programs.values():
+        for op in program:
+            if op.type != OpType.PUSH_STR:
+                continue
+            label: str = get_string_label(op.token.value)
+            if label in defined_labels:
+                continue
+            # Replace \n with nasm approved 10s for newline
+            escaped_string: str = format_escape_sequence_characters_for_nasm(op.token.value)
+            definitions.append(f"  {label} db {escaped_string},0\n")
+            defined_labels.add(label)
+    return "".join(definitions)
 
 
 def get_do_asm(op: Op, program: Program) -> str:
     """DO is conditional jump to operand after ELIF, ELSE, END or ENDIF."""
-    parent_op_type: OpType = get_parent_op_type_do(op, program)
-
-    # Keeping the count of duplicate parent Ops allows for nested IF or WHILE blocks
-    parent_op_count: int = 0
-    op_asm: str = ""
-    for i in range(op.id + 1, len(program)):
-        op_type: OpType = program[i].type
-
-        # Keep count on the nested IF's or WHILE's
-        if (parent_op_type in [OpType.IF, OpType.ELIF] and op_type == OpType.IF) or (
-            parent_op_type == OpType.WHILE and op_type == OpType.WHILE
-        ):
-            parent_op_count += 1
-            continue
-
-        if parent_op_count == 0 and (
-            (
-                parent_op_type == OpType.IF
-                and op_type in (OpType.ELIF, OpType.ELSE, OpType.ENDIF)
-            )
-            or (
-                parent_op_type == OpType.ELIF
-                and op_type in (OpType.ELIF, OpType.ELSE, OpType.ENDIF)
-            )
-            or (parent_op_type == OpType.WHILE and op_type == OpType.DONE)
-        ):
-            jump_destination: str = f"{op.func.name}_{program[i].type.name}{i}"
-            op_asm = generate_do_asm(jump_destination)
-            break
-
-        # Decrement counter when passing another block's ENDIF / DONE
-        if (parent_op_type in [OpType.IF, OpType.ELIF] and op_type == OpType.ENDIF) or (
-            parent_op_type == OpType.WHILE and op_type == OpType.DONE
-        ):
-            parent_op_count -= 1
-
-    if not op_asm:
-        block_type: str = "WHILE" if parent_op_type == OpType.WHILE else "IF"
-        block_end: str = "DONE" if parent_op_type == OpType.WHILE else "ENDIF"
-        compiler_error(
-            "UNCLOSED_BLOCK",
-            f"The current {block_type} block is missing {block_end} keyword.",
-            op.token,
-        )
-    return op_asm
+    if is_loop_back_branch(op, program):
+        op_asm: str = "  pop rax\n"
+        op_asm += "  test rax, rax\n"
+        return op_asm + f"  jnz {get_loop_start_label(op, program)}\n"
+    destination: Op = get_do_jump_destination(op, program)
+    jump_destination: str = f"{op.func.name}_{destination.type.name}{destination.id}"
+    return generate_do_asm(jump_destination)
 
 
 def get_assign_bind_asm(op: Op, program: Program) -> str:
-    """Assign a value to the named bound Memory"""
-    memory_name: str = program[op.id - 1].token.value
-    bound_memory: str = f"{op.func.name}_{memory_name}"
+    """Assign a value to the named bound value in the frame"""
+    bound_value: str = get_frame_address(op.func, program[op.id - 1].token.value)
     op_asm: str = "  pop rax  ; Old value\n"
     op_asm += "  pop rbx  ; New value\n"
-    op_asm += f"  mov [{bound_memory}], rbx\n"
+    op_asm += f"  mov {bound_value}, rbx\n"
     return op_asm
 
 
@@ -487,6 +837,8 @@ def generate_do_asm(jump_destination: str) -> str:
 
 def get_done_asm(op: Op, program: Program) -> str:
     """DONE is an unconditional jump to current loop's WHILE."""
+    if program[op.id - 1].type == OpType.DO:
+        return f"{op.func.name}_DONE{op.id}:\n"
     parent_while: Op = get_parent_while(op, program)
     op_asm: str = f"  jmp {op.func.name}_WHILE{parent_while.id}\n"
     op_asm += f"{op.func.name}_DONE{op.id}:\n"
@@ -519,33 +871,79 @@ def get_function_call_asm(op: Op) -> str:
     return f"  call {get_valid_label_for_nasm(op.token.value)}\n"
 
 
-def get_peek_asm() -> str:
-    """Save current stack pointer to r15"""
-    return "  mov r15, rsp\n"
+def is_tail_call(op: Op, program: Program) -> bool:
+    """
+    Check if the Op is a Function call after which the current Function returns
+    without executing any other code. MAIN is not returned from, so it has no tail calls.
+    """
+    if op.type != OpType.FUNCTION_CALL or op.func.name.upper() == "MAIN":
+        return False
+    op_id: int = op.id + 1
+    while op_id < len(program):
+        next_op: Op = program[op_id]
+        if next_op.type == OpType.RETURN:
+            return True
+        if next_op.type in {OpType.ELIF, OpType.ELSE}:
+            # The other branches are skipped to the related ENDIF
+            op_id = get_related_endif(next_op, program).id
+        elif next_op.type not in TAIL_NO_OP_TYPES:
+            return False
+        op_id += 1
+    return True
+
+
+def returns_like_caller(op: Op, context: CodegenContext) -> bool:
+    """
+    Check if the Function called in tail position returns its values like the current Function.
+    With the register calling convention the callee arranges the return values of its own Signature
+    to the registers, which is only correct for the caller if the Signatures have the same shape.
+    """
+    if context.register_counts is None:
+        return True
+    callee: str = op.token.value
+    if callee not in context.signatures:
+        return False
+    caller_params, caller_returns = op.func.signature
+    callee_params, callee_returns = context.signatures[callee]
+    return (
+        context.register_counts[op.func.name] == context.register_counts[callee]
+        and len(caller_params) == len(callee_params)
+        and len(caller_returns) == len(callee_returns)
+    )
 
 
-def get_peek_bind_asm(op: Op) -> str:
-    """Copy a value from the stack to a bound Memory"""
-    memory_name: str = op.token.value
-    bound_memory: str = f"{op.func.name}_{memory_name}"
-    op_asm: str = "  mov rax, [r15]\n"
-    op_asm += f"  mov [{bound_memory}], rax\n"
-    op_asm += "  add r15, 8\n"
+def get_tail_call_asm(op: Op, conventions: Dict[str, CallingConvention]) -> str:
+    """
+    Jump to a Function in tail position so that it returns directly to the caller
+    of the current Function. Between Functions using return_stack the return address
+    is left in place, otherwise it is pushed back to the stack before the jump.
+    """
+    function_name: str = get_valid_label_for_nasm(op.token.value)
+    caller_convention: CallingConvention = conventions[op.func.name]
+    if caller_convention == conventions[op.token.value] == CallingConvention.RETURN_STACK:
+        return f"  jmp {function_name}.body  ; Tail call\n"
+    op_asm: str = get_return_address_restore_asm(op.func.name, caller_convention)
+    return op_asm + f"  jmp {function_name}  ; Tail call\n"
+
+
+def get_peek_bind_asm(op: Op, program: Program) -> str:
+    """Copy a value from the stack to the frame, the first PEEK_BIND after PEEK copies the top element"""
+    peek_index: int = 0
+    while program[op.id - 1 - peek_index].type == OpType.PEEK_BIND:
+        peek_index += 1
+    op_asm: str = f"  mov rax, [rsp+{8 * peek_index}]\n"
+    op_asm += f"  mov {get_frame_address(op.func, op.token.value)}, rax\n"
     return op_asm
 
 
 def get_pop_bind_asm(op: Op) -> str:
-    """Pop a value from the stack to a bound Memory"""
-    memory_name: str = op.token.value
-    bound_memory: str = f"{op.func.name}_{memory_name}"
-    return f"  pop qword [{bound_memory}]\n"
+    """Pop a value from the stack to the frame"""
+    return f"  pop qword {get_frame_address(op.func, op.token.value)}\n"
 
 
 def get_push_bind_asm(op: Op) -> str:
-    """Push the value from bound Memory to the stack"""
-    memory_name: str = op.token.value
-    bound_memory: str = f"{op.func.name}_{memory_name}"
-    return f"  push qword [{bound_memory}]\n"
+    """Push a bound value from the frame to the stack"""
+    return f"  push qword {get_frame_address(op.func, op.token.value)}\n"
 
 
 def get_push_bool_asm(boolean: str) -> str:
@@ -579,16 +977,19 @@ def get_push_ptr_asm(memory_name: str) -> str:
 
 def get_push_str_asm(op: Op) -> str:
     """Pushes a pointer to the string variable to the stack."""
-    op_asm: str = f"  mov rsi, {op.func.name}_s{op.id} ; Pointer to string\n"
+    op_asm: str = f"  mov rsi, {get_string_label(op.token.value)} ; Pointer to string\n"
     op_asm += "  push rsi\n"
     return op_asm
 
 
-def get_return_asm(function_name: str) -> str:
+def get_return_asm(
+    function_name: str,
+    convention: CallingConvention = CallingConvention.RETURN_STACK,
+) -> str:
     """Return from the current Function."""
     if function_name.upper() == "MAIN":
         return get_push_int_asm("0") + get_function_end_asm(function_name)
-    return get_function_end_asm(function_name)
+    return get_function_end_asm(function_name, convention)
 
 
 def get_while_asm(op: Op) -> str:
@@ -749,14 +1150,7 @@ def get_nth_asm() -> str:
     Example: 30 20 10 3 NTH print  // Output: 30 (because 30 is 3rd element without the popped 3).
     """
     op_asm: str = "  pop rax\n"
-    op_asm += "  sub rax, 1\n"
-    op_asm += "  mov rbx, 8\n"
-    op_asm += "  mul rbx\n"
-    op_asm += "  add rsp, rax ; Stack pointer to the Nth element\n"
-    op_asm += "  pop rbx      ; Get Nth element to rax\n"
-    op_asm += "  add rax, 8\n"
-    op_asm += "  sub rsp, rax ; Return stack pointer\n"
-    op_asm += "  push rbx\n"
+    op_asm += "  push qword [rsp+rax*8-8] ; Nth element\n"
     return op_asm
 
 
@@ -839,6 +1233,14 @@ def get_swap_asm() -> str:
     return op_asm
 
 
+def get_output_flush_asm() -> str:
+    """
+    Return the call which writes the output buffered by print and the standard library before a syscall.
+    Every syscall flushes the buffer so the output stays in order with other I/O and exit.
+    """
+    return "  call output_flush\n"
+
+
 def get_syscall_asm(param_count: int) -> str:
     """
     SYSCALL intrinsic variants call a Linux syscall.
@@ -857,6 +1259,7 @@ def get_syscall_asm(param_count: int) -> str:
         op_asm += f"  pop {argument_registers[i]} ; {i+1}. arg\n"
 
     # Call the syscall and push return code to RAX
+    op_asm += get_output_flush_asm()
     op_asm += "  syscall\n"
     op_asm += "  push rax ; return code\n"
     return op_asm
@@ -0,0 +1,78 @@
+"""
+Conditional branches fused with the preceding comparison and the back branches of loops
+"""
+from typing import Dict, Optional
+from compiler.defs import Op, OpType, Program, RegisterCache
+from compiler.utils import get_do_jump_destination, get_parent_while
+
+# Conditional jumps taken when the comparison Intrinsic results in False
+FALSE_CONDITION_JUMPS: Dict[str, str] = {
+    "EQ": "jne",
+    "GE": "jl",
+    "GT": "jle",
+    "LE": "jg",
+    "LT": "jge",
+    "NE": "je",
+}
+
+# Conditional jumps taken when the comparison is true
+TRUE_CONDITION_JUMPS: Dict[str, str] = {
+    "EQ": "je",
+    "GE": "jge",
+    "GT": "jg",
+    "LE": "jle",
+    "LT": "jl",
+    "NE": "jne",
+}
+
+
+def is_fused_comparison(op: Op, program: Program) -> bool:
+    """Check if the Op is a comparison Intrinsic whose result is only used by the next DO."""
+    return (
+        op.type == OpType.INTRINSIC
+        and op.token.value.upper() in FALSE_CONDITION_JUMPS
+        and op.id + 1 < len(program)
+        and program[op.id + 1].type == OpType.DO
+    )
+
+
+def get_fused_comparison_asm(cache: Optional[RegisterCache]) -> str:
+    """Compare the two topmost elements of the stack for the following DO without pushing the result."""
+    if cache is None:
+        op_asm: str = "  pop rax\n"
+        op_asm += "  pop rbx\n"
+        op_asm += "  cmp rbx, rax\n"
+        return op_asm
+    op_asm = cache.fill(2)
+    operand: str = cache.pop()
+    return op_asm + f"  cmp {cache.pop()}, {operand}\n"
+
+
+def get_fused_do_asm(op: Op, program: Program, cache: Optional[RegisterCache]) -> str:
+    """DO after a comparison jumps with the inverted condition of the comparison."""
+    comparison: str = program[op.id - 1].token.value.upper()
+    # Spilling the cache does not alter the flags set by the comparison
+    op_asm: str = cache.spill() if cache is not None else ""
+    if is_loop_back_branch(op, program):
+        return op_asm + f"  {TRUE_CONDITION_JUMPS[comparison]} {get_loop_start_label(op, program)}\n"
+    destination: Op = get_do_jump_destination(op, program)
+    op_asm += f"  {FALSE_CONDITION_JUMPS[comparison]} {op.func.name}_{destination.type.name}{destination.id}\n"
+    return op_asm
+
+
+def is_loop_back_branch(op: Op, program: Program) -> bool:
+    """
+    Check if the DO is directly followed by DONE, like in the rotated loops.
+    Then DO jumps back to WHILE when the condition is true and DONE does not jump at all.
+    """
+    return (
+        op.type == OpType.DO
+        and op.id + 1 < len(program)
+        and program[op.id + 1].type == OpType.DONE
+    )
+
+
+def get_loop_start_label(op: Op, program: Program) -> str:
+    """Return the label of the WHILE of the loop which the back branch DO belongs to."""
+    parent_while: Op = get_parent_while(program[op.id + 1], program)
+    return f"{op.func.name}_WHILE{parent_while.id}"
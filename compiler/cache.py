@@ -0,0 +1,220 @@
+"""
+Code generation which keeps the topmost stack elements in the cache registers
+"""
+from typing import Dict, Optional, Set, Tuple
+from compiler.branches import get_loop_start_label, is_loop_back_branch
+from compiler.defs import CACHE_REGISTERS, Op, OpType, Program, RegisterCache
+from compiler.utils import get_do_jump_destination, get_frame_address, get_string_label
+
+# Ops which generate the same code with or without the cache
+CACHE_NEUTRAL_OP_TYPES: Set[OpType] = {
+    OpType.CAST_BOOL,
+    OpType.CAST_CHAR,
+    OpType.CAST_INT,
+    OpType.CAST_PTR,
+    OpType.CAST_STR,
+    OpType.CAST_UINT8,
+    OpType.IF,
+    OpType.IN,
+    OpType.TAKE,
+    OpType.PEEK_BIND,
+}
+
+# Instructions of the arithmetic Intrinsics operating on two cache registers
+ARITHMETIC_INSTRUCTIONS: Dict[str, str] = {
+    "AND": "and",
+    "MINUS": "sub",
+    "MUL": "imul",
+    "OR": "or",
+    "PLUS": "add",
+}
+
+# Condition codes of the comparison Intrinsics for the SETcc instruction
+COMPARISON_CONDITIONS: Dict[str, str] = {
+    "EQ": "e",
+    "GE": "ge",
+    "GT": "g",
+    "LE": "le",
+    "LT": "l",
+    "NE": "ne",
+}
+
+
+def get_register_counts(sub_programs: Dict[str, Program]) -> Dict[str, Tuple[int, int]]:
+    """
+    Return the number of topmost parameters and return values of each Function
+    which are passed in the cache registers. The counts are derived from the Signatures.
+    """
+    register_counts: Dict[str, Tuple[int, int]] = {}
+    for name, program in sub_programs.items():
+        # Functions without Ops leave the stack as is
+        if not program:
+            register_counts[name] = (0, 0)
+            continue
+        param_types, return_types = program[0].func.signature
+        register_counts[name] = (
+            min(len(param_types), len(CACHE_REGISTERS)),
+            min(len(return_types), len(CACHE_REGISTERS)),
+        )
+    return register_counts
+
+
+def get_register_count(
+    function_name: str,
+    register_counts: Optional[Dict[str, Tuple[int, int]]],
+    is_return: bool,
+) -> Optional[int]:
+    """
+    Return the number of parameters or return values of a Function passed in registers.
+    Return None if every value is passed in the stack.
+    """
+    if register_counts is None or function_name.upper() == "MAIN":
+        return None
+    return register_counts[function_name][1 if is_return else 0]
+
+
+def get_cache_exit_asm(cache: Optional[RegisterCache], count: Optional[int]) -> str:
+    """
+    Prepare the cache for leaving the current Function: spill every cached element
+    or arrange count topmost elements to the registers of the register calling convention.
+    """
+    if cache is None:
+        return ""
+    if count is None:
+        return cache.spill()
+    return cache.arrange(count)
+
+
+def get_cached_op_asm(op: Op, program: Program, cache: RegisterCache) -> Optional[str]:
+    """
+    Generate assembly code for certain Op while keeping the topmost stack elements in registers.
+    Return None if the Op uses the stack in memory, then the cache is spilled before the Op.
+    The Ops in CACHE_NEUTRAL_OP_TYPES are not handled here.
+    """
+    if op.type in {
+        OpType.PUSH_BOOL,
+        OpType.PUSH_CHAR,
+        OpType.PUSH_INT,
+        OpType.PUSH_PTR,
+        OpType.PUSH_STR,
+        OpType.PUSH_UINT8,
+    }:
+        op_asm, register = cache.push()
+        return op_asm + f"  mov {register}, {get_push_value(op)}\n"
+    if op.type == OpType.PUSH_BIND:
+        op_asm, register = cache.push()
+        return op_asm + f"  mov {register}, {get_frame_address(op.func, op.token.value)}\n"
+    if op.type == OpType.POP_BIND:
+        op_asm = cache.fill(1)
+        return op_asm + f"  mov {get_frame_address(op.func, op.token.value)}, {cache.pop()}\n"
+    if op.type == OpType.ASSIGN_BIND:
+        op_asm = cache.fill(2)
+        cache.pop()  # Old value
+        bound_value: str = get_frame_address(op.func, program[op.id - 1].token.value)
+        return op_asm + f"  mov {bound_value}, {cache.pop()}  ; New value\n"
+    if op.type == OpType.DO:
+        op_asm = cache.fill(1)
+        condition: str = cache.pop()
+        op_asm += cache.spill()
+        op_asm += f"  test {condition}, {condition}\n"
+        if is_loop_back_branch(op, program):
+            return op_asm + f"  jnz {get_loop_start_label(op, program)}\n"
+        destination: Op = get_do_jump_destination(op, program)
+        return op_asm + f"  jz {op.func.name}_{destination.type.name}{destination.id}\n"
+    if op.type == OpType.INTRINSIC:
+        return get_cached_intrinsic_asm(op, cache)
+
+    # Every other Op either jumps, is jumped to or uses the stack in memory
+    return None
+
+
+def get_push_value(op: Op) -> str:
+    """Return the immediate value pushed to the stack by a push Op."""
+    if op.type == OpType.PUSH_BOOL:
+        return "1" if op.token.value.upper() == "TRUE" else "0"
+    if op.type == OpType.PUSH_CHAR:
+        return str(ord(op.token.value[1]))
+    if op.type == OpType.PUSH_STR:
+        return get_string_label(op.token.value)
+    return op.token.value
+
+
+def get_cached_intrinsic_asm(op: Op, cache: RegisterCache) -> Optional[str]:
+    # sourcery skip: low-code-quality
+    """
+    Generate assembly code for certain Intrinsic with the topmost stack elements in registers.
+    Return None if the Intrinsic uses the stack in memory.
+    """
+    intrinsic: str = op.token.value.upper()
+    if intrinsic in ARITHMETIC_INSTRUCTIONS:
+        op_asm: str = cache.fill(2)
+        operand: str = cache.pop()
+        return op_asm + f"  {ARITHMETIC_INSTRUCTIONS[intrinsic]} {cache.top()}, {operand}\n"
+    if intrinsic in COMPARISON_CONDITIONS:
+        op_asm = cache.fill(2)
+        operand = cache.pop()
+        result: str = cache.top()
+        op_asm += f"  cmp {result}, {operand}\n"
+        op_asm += f"  set{COMPARISON_CONDITIONS[intrinsic]} {result}b\n"
+        op_asm += f"  movzx {result}, {result}b\n"
+        return op_asm
+    if intrinsic in {"ARGC", "ARGV", "ENVP"}:
+        op_asm, register = cache.push()
+        op_asm += f"  mov {register}, [args_ptr]\n"
+        if intrinsic == "ARGC":
+            return op_asm + f"  mov {register}, [{register}]\n"
+        return op_asm + f"  add {register}, {8 if intrinsic == 'ARGV' else 24}\n"
+    if intrinsic == "DIVMOD":
+        op_asm = cache.fill(2)
+        op_asm += f"  mov rax, {cache.top(2)}\n"
+        op_asm += "  xor edx, edx\n"
+        op_asm += f"  div {cache.top()}\n"
+        op_asm += f"  mov {cache.top(2)}, rdx ; Remainder\n"
+        op_asm += f"  mov {cache.top()}, rax ; Quotient\n"
+        return op_asm
+    if intrinsic == "DROP" and cache.registers:
+        cache.pop()
+        return ""
+    if intrinsic in {"DUP", "OVER"}:
+        nth: int = 1 if intrinsic == "DUP" else 2
+        op_asm = cache.fill(nth)
+        copied: str = cache.top(nth)
+        spill_asm, register = cache.push()
+        return op_asm + spill_asm + f"  mov {register}, {copied}\n"
+    if intrinsic.startswith("LOAD_"):
+        op_asm = cache.fill(1)
+        pointer: str = cache.top()
+        load_instructions: Dict[str, str] = {
+            "LOAD_BYTE": f"movzx {pointer}, byte [{pointer}]",
+            "LOAD_WORD": f"movzx {pointer}, word [{pointer}]",
+            "LOAD_DWORD": f"mov {pointer}d, dword [{pointer}]",
+            "LOAD_QWORD": f"mov {pointer}, [{pointer}]",
+        }
+        return op_asm + f"  {load_instructions[intrinsic]}\n"
+    if intrinsic == "PRINT":
+        # The print routine does not use the cache registers
+        op_asm = cache.fill(1)
+        op_asm += f"  mov rdi, {cache.pop()}\n"
+        return op_asm + "  call print\n"
+    if intrinsic == "ROT":
+        op_asm = cache.fill(3)
+        cache.registers.append(cache.registers.pop(0))
+        return op_asm
+    if intrinsic.startswith("STORE_"):
+        op_asm = cache.fill(2)
+        pointer = cache.pop()
+        value: str = cache.pop()
+        value_registers: Dict[str, str] = {
+            "STORE_BYTE": f"{value}b",
+            "STORE_WORD": f"{value}w",
+            "STORE_DWORD": f"{value}d",
+            "STORE_QWORD": value,
+        }
+        return op_asm + f"  mov [{pointer}], {value_registers[intrinsic]}\n"
+    if intrinsic == "SWAP":
+        op_asm = cache.fill(2)
+        cache.registers[-2:] = cache.registers[:-3:-1]
+        return op_asm
+
+    # DROP of an uncached element, NTH and syscalls access the stack in memory
+    return None
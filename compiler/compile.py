@@ -2,22 +2,188 @@
 Functions required for compiling a Torth program
 """
 import argparse
+import hashlib
+import os
+import pathlib
+import shutil
 import subprocess
-from typing import Dict, List
-from compiler.asm import generate_asm
-from compiler.defs import Constant, Memory, Program
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.align import align_code
+from compiler.asm import (
+    generate_asm,
+    generate_function_asm,
+    get_string_pool_asm,
+    get_valid_label_for_nasm,
+    has_asm_comments,
+    initialize_asm,
+)
+from compiler.defs import (
+    AssemblySections,
+    CallingConvention,
+    CodegenContext,
+    Constant,
+    Function,
+    Location,
+    Memory,
+    OpType,
+    Program,
+    Signature,
+)
+from compiler.passes import PassMetrics, run_ir_passes
+from compiler.program import (
+    generate_program,
+    get_called_function_names,
+    type_check_program,
+)
+from compiler.elf import write_executable
+from compiler.shards import split_assembly
+from compiler.ssa_asm import generate_ssa_asm
+from compiler.peephole import optimize_assembly
 from compiler.utils import print_if_verbose
+from compiler.x86 import assemble
 
+# Memory backed file system preferred for the intermediate files
+TMPFS_DIRECTORY: str = "/dev/shm"
 
-def compile_asm(asm_file: str, object_file: str) -> None:
-    """Compile the generated assembly source code with NASM."""
-    subprocess.run(["nasm", "-felf64", f"-o{object_file}", asm_file], check=True)
+# Optimizations which need every sub-program at once and are not available when streaming
+WHOLE_PROGRAM_OPTIMIZATIONS: List[str] = ["ctfe", "native-calls", "register-args"]
 
+# Ops which define a label named after the Function, the Op type and the Op id
+LABELED_OP_TYPES: List[OpType] = [
+    OpType.DONE,
+    OpType.ELIF,
+    OpType.ELSE,
+    OpType.ENDIF,
+    OpType.WHILE,
+]
 
-def link_object_file(object_file: str, executable_file: str) -> None:
-    """Link the compiled object file with LD."""
+
+def get_build_directory() -> tempfile.TemporaryDirectory:
+    """
+    Return a private directory for the intermediate files of a compilation, which is removed
+    when its context exits. The directory is on tmpfs if it is available and TMPDIR is not set.
+    """
+    root: Optional[str] = None
+    if "TMPDIR" not in os.environ and os.access(TMPFS_DIRECTORY, os.W_OK):
+        root = TMPFS_DIRECTORY
+    return tempfile.TemporaryDirectory(prefix="torth-", dir=root)
+
+
+def get_asm_file(input_file: str, build_directory: str) -> str:
+    """Return the name of the assembly file in the build directory."""
+    return os.path.join(build_directory, pathlib.Path(input_file).name.replace(".torth", ".asm"))
+
+
+def compile_asm(asm_file: str, object_file: str, debug: bool = False) -> None:
+    """Compile the generated assembly source code with NASM. With debug DWARF debug information is included."""
+    debug_flags: List[str] = ["-g", "-Fdwarf"] if debug else []
+    subprocess.run(
+        ["nasm", "-felf64", *debug_flags, f"-o{object_file}", asm_file], check=True
+    )
+
+
+def assemble_executable(assembly: str, executable_file: str, is_verbose: bool) -> None:
+    """Assemble and link the generated assembly in-process without NASM and LD."""
+    print_if_verbose(
+        f"Assembling executable file {executable_file} with the built-in assembler",
+        is_verbose,
+    )
+    write_executable(assemble(assembly), executable_file)
+
+
+def get_executable_file(input_file: str, args: argparse.Namespace) -> str:
+    """Return the name of the compiled executable file."""
+    return args.out or input_file.replace(".torth", ".bin")
+
+
+def get_shard_cache_directory() -> pathlib.Path:
+    """Return the directory of the assembled shards, which is created if it does not exist."""
+    cache_home: str = os.environ.get("XDG_CACHE_HOME") or str(pathlib.Path.home() / ".cache")
+    cache_directory: pathlib.Path = pathlib.Path(cache_home) / "torth" / "shards"
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    return cache_directory
+
+
+def compile_shard(
+    shard: str, cache_directory: pathlib.Path, build_directory: str, debug: bool
+) -> Tuple[str, bool]:
+    """
+    Compile a shard of the assembly with NASM to an object file named after the hash of its contents.
+    Return the name of the object file and whether it was reused from an earlier compilation.
+    """
+    digest: str = hashlib.sha256(f"{debug}\n{shard}".encode("utf-8")).hexdigest()
+    object_file: pathlib.Path = cache_directory / f"{digest}.o"
+    if object_file.exists():
+        return str(object_file), True
+
+    # The object file is renamed when it is complete so concurrent compilations never use a partial one
+    asm_file: pathlib.Path = pathlib.Path(build_directory) / f"{digest}.asm"
+    partial_file: pathlib.Path = cache_directory / f"{digest}.{os.getpid()}.o"
+    asm_file.write_text(shard, encoding="utf-8")
+    compile_asm(str(asm_file), str(partial_file), debug)
+    os.replace(partial_file, object_file)
+    return str(object_file), False
+
+
+def compile_shards(
+    assembly: str,
+    function_labels: Set[str],
+    build_directory: str,
+    args: argparse.Namespace,
+) -> List[str]:
+    """
+    Split the assembly to shards and compile the changed shards with concurrent NASM processes.
+    Return the object files of every shard.
+    """
+    shards: List[str] = split_assembly(assembly, function_labels, args.shards)
+    cache_directory: pathlib.Path = get_shard_cache_directory()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        compiled: List[Tuple[str, bool]] = list(
+            executor.map(
+                lambda shard: compile_shard(shard, cache_directory, build_directory, args.debug),
+                shards,
+            )
+        )
+    reused_count: int = sum(is_reused for _object_file, is_reused in compiled)
+    print_if_verbose(
+        f"Compiled {len(shards) - reused_count} shards with NASM and reused {reused_count} shards",
+        args.verbose,
+    )
+    return [object_file for object_file, _is_reused in compiled]
+
+
+def assemble_code(
+    assembly: str,
+    function_labels: Set[str],
+    input_file: str,
+    build_directory: str,
+    args: argparse.Namespace,
+) -> List[str]:
+    """
+    Assemble the assembly, which NASM reads from the assembly file in the build directory.
+    Return the object files to link, which is none if the built-in assembler wrote the executable.
+    """
+    if args.builtin_assembler:
+        assemble_executable(assembly, get_executable_file(input_file, args), args.verbose)
+        return []
+    if args.shards > 1:
+        return compile_shards(assembly, function_labels, build_directory, args)
+
+    # Compile the assembly code with NASM
+    asm_file: str = get_asm_file(input_file, build_directory)
+    object_file: str = asm_file.replace(".asm", ".o")
+    print_if_verbose(f"Compiling {asm_file} to {object_file} with NASM", args.verbose)
+    compile_asm(asm_file, object_file, args.debug)
+    return [object_file]
+
+
+def link_object_files(object_files: List[str], executable_file: str) -> None:
+    """Link the compiled object files with LD."""
     subprocess.run(
-        ["ld", "-m", "elf_x86_64", f"-o{executable_file}", object_file], check=True
+        ["ld", "-m", "elf_x86_64", f"-o{executable_file}", *object_files], check=True
     )
 
 
@@ -26,26 +192,205 @@ def compile_code(
     constants: List[Constant],
     sub_programs: Dict[str, Program],
     memories: List[Memory],
-    is_verbose: bool,
-) -> None:
-    """Generate assembly and compile it to statically linked ELF 64-bit executable."""
+    *,
+    build_directory: str,
+    args: argparse.Namespace,
+) -> List[str]:
+    """
+    Generate assembly and compile it to statically linked ELF 64-bit executable.
+    The intermediate files are written to the build directory. Return the object files to link.
+    """
+    # Generate the Functions which can be lowered to SSA with the register allocating backend
+    ssa_bodies: Optional[Dict[str, str]] = None
+    if args.ssa_backend and not args.register_args:
+        ssa_bodies = generate_ssa_asm(sub_programs, args.tail_calls, args.verbose)
+
     # Generate assembly from Program
-    assembly: str = generate_asm(sub_programs, constants, memories, is_verbose)
+    assembly: str = generate_asm(sub_programs, constants, memories, args, ssa_bodies)
+
+    # Optimize the generated instructions before assembling them
+    if args.peephole:
+        lines_before: int = assembly.count("\n")
+        start_time: float = time.perf_counter()
+        assembly = run_peephole_optimizer(assembly, sub_programs, args.verbose)
+        metrics: PassMetrics = PassMetrics(
+            "peephole",
+            time.perf_counter() - start_time,
+            lines_before,
+            assembly.count("\n"),
+            "lines",
+        )
+        if args.report_passes:
+            print(metrics)
+        else:
+            print_if_verbose(str(metrics), args.verbose)
+    function_labels: Set[str] = {get_function_label(name) for name in sub_programs}
+    assembly = align_code(assembly, function_labels, args.align_functions, args.align_loops)
+
+    # Write assembly to a file, the built-in assembler and the shards do not need it
+    if not (args.builtin_assembler or args.shards > 1):
+        with open(get_asm_file(input_file, build_directory), "w", encoding="utf-8") as f:
+            f.write(assembly)
+    if args.save_asm:
+        with open(input_file.replace(".torth", ".asm"), "w", encoding="utf-8") as f:
+            f.write(assembly)
+
+    if args.source_map:
+        write_source_map(get_source_map(sub_programs), get_executable_file(input_file, args))
+    return assemble_code(assembly, function_labels, input_file, build_directory, args)
+
+
+def compile_code_streaming(
+    input_file: str,
+    functions: Dict[str, Function],
+    constants: List[Constant],
+    memories: List[Memory],
+    *,
+    build_directory: str,
+    args: argparse.Namespace,
+) -> List[str]:
+    # pylint: disable=too-many-locals
+    """
+    Lower, type check, optimize and generate assembly for one Function at a time and write it
+    to the assembly file right away. The sub-program and the Tokens of each Function are released
+    after its assembly is written, so the memory use is bounded by the largest Function.
+    The intermediate files are written to the build directory. Return the object files to link.
+    """
+    for name in WHOLE_PROGRAM_OPTIMIZATIONS:
+        attribute: str = name.replace("-", "_")
+        if getattr(args, attribute):
+            print_if_verbose(
+                f"Optimization '{name}' is not available when streaming", args.verbose
+            )
+            setattr(args, attribute, False)
+
+    called_functions: Set[str] = get_called_function_names(functions)
+    conventions: Dict[str, CallingConvention] = {
+        name: CallingConvention.RETURN_STACK for name in called_functions
+    }
+    signatures: Dict[str, Signature] = {
+        name: func.signature for name, func in functions.items()
+    }
+    context: CodegenContext = CodegenContext(
+        conventions, {const.name: const.value for const in constants}
+    )
+    function_labels: Dict[str, str] = {
+        get_function_label(name): name for name in called_functions
+    }
+    string_labels: Set[str] = set()
+    source_map: Dict[str, Location] = {}
+    eliminated_count: int = 0
 
-    # Write assembly to a file
-    asm_file: str = input_file.replace(".torth", ".asm")
+    asm_file: str = get_asm_file(input_file, build_directory)
     with open(asm_file, "w", encoding="utf-8") as f:
-        f.write(assembly)
+        sections: AssemblySections = initialize_asm(
+            constants, memories, conventions, has_asm_comments(args), args.align_memories
+        )
+        f.write(align_code(sections.join_code(), set(), 0, args.align_loops))
+        for func in functions.values():
+            if func.name not in called_functions:
+                continue
+            print_if_verbose(f"Compiling Function '{func.name}'", args.verbose)
+            program: Program = generate_program(func.tokens, constants, functions, memories)
+            type_check_program(func, program, functions)
+            sub_programs: Dict[str, Program] = run_ir_passes(
+                {func.name: program}, functions, constants, args
+            )
+            ssa_bodies: Dict[str, str] = (
+                generate_ssa_asm(sub_programs, args.tail_calls, args.verbose, signatures)
+                if args.ssa_backend
+                else {}
+            )
+            assembly: str = generate_function_asm(
+                func.name, sub_programs[func.name], context, args, ssa_bodies.get(func.name)
+            )
+            if args.peephole:
+                assembly, eliminated = optimize_assembly(
+                    assembly, function_labels, is_text=True
+                )
+                eliminated_count += sum(eliminated.values())
+            f.write(
+                align_code(
+                    assembly, set(function_labels), args.align_functions, args.align_loops
+                )
+            )
+
+            # The string literals are placed to .rodata right after the Function using them
+            strings_asm: str = get_string_pool_asm(sub_programs, string_labels)
+            if strings_asm:
+                f.write(f"section .rodata\n{strings_asm}section .text\n\n")
+
+            # Release the Function's Tokens and sub-program before compiling the next one
+            if args.source_map:
+                source_map.update(get_source_map(sub_programs))
+            func.tokens = []
+            del program, sub_programs, ssa_bodies, assembly
+
+    if args.peephole:
+        print_if_verbose(
+            f"Peephole optimizer eliminated {eliminated_count} instructions in total",
+            args.verbose,
+        )
+    if args.source_map:
+        write_source_map(source_map, get_executable_file(input_file, args))
+    if args.save_asm:
+        shutil.copyfile(asm_file, input_file.replace(".torth", ".asm"))
+
+    # NASM reads the assembly file itself, the others assemble it in-process
+    assembly = ""
+    if args.builtin_assembler or args.shards > 1:
+        with open(asm_file, "r", encoding="utf-8") as f:
+            assembly = f.read()
+    return assemble_code(
+        assembly, set(function_labels), input_file, build_directory, args
+    )
 
-    # Compile the assembly code with NASM
-    object_file: str = asm_file.replace(".asm", ".o")
-    print_if_verbose(f"Compiling {asm_file} to {object_file} with NASM", is_verbose)
-    compile_asm(asm_file, object_file)
 
+def get_source_map(sub_programs: Dict[str, Program]) -> Dict[str, Location]:
+    """
+    Return the source locations of the labels in the assembly, the side table of the Op comments.
+    Functions are mapped to their first Op and the labels of the control flow Ops to the Ops.
+    """
+    source_map: Dict[str, Location] = {}
+    for name, program in sub_programs.items():
+        if program:
+            source_map[get_function_label(name)] = program[0].token.location
+        for op in program:
+            if op.type in LABELED_OP_TYPES:
+                source_map[f"{op.func.name}_{op.type.name}{op.id}"] = op.token.location
+    return source_map
 
-def remove_compilation_files(input_file: str, args: argparse.Namespace) -> None:
-    """Clean the current directory from compilation files."""
-    input_file_extensionless: str = input_file.split(".")[0]
-    subprocess.run(["rm", "-f", f"{input_file_extensionless}.o"], check=True)
-    if not args.save_asm:
-        subprocess.run(["rm", "-f", f"{input_file_extensionless}.asm"], check=True)
+
+def write_source_map(source_map: Dict[str, Location], executable_file: str) -> None:
+    """Write the source locations of the labels to a file named after the executable."""
+    with open(f"{executable_file}.map", "w", encoding="utf-8") as f:
+        f.writelines(
+            f"{label} {file}:{row}:{col}\n" for label, (file, row, col) in source_map.items()
+        )
+
+
+def get_function_label(function_name: str) -> str:
+    """Return the label of the Function in the assembly."""
+    return "_start" if function_name.upper() == "MAIN" else get_valid_label_for_nasm(function_name)
+
+
+def run_peephole_optimizer(
+    assembly: str, sub_programs: Dict[str, Program], is_verbose: bool
+) -> str:
+    """Run the peephole optimizer and report the eliminated instructions per Function."""
+    print_if_verbose("Running peephole optimizer", is_verbose)
+    function_labels: Dict[str, str] = {
+        get_function_label(name): name
+        for name in sub_programs
+    }
+    assembly, eliminated = optimize_assembly(assembly, function_labels)
+    for function_name, eliminated_count in eliminated.items():
+        print_if_verbose(
+            f"Eliminated {eliminated_count} instructions from '{function_name}'",
+            is_verbose,
+        )
+    print_if_verbose(
+        f"Peephole optimizer eliminated {sum(eliminated.values())} instructions in total",
+        is_verbose,
+    )
+    return assembly
@@ -0,0 +1,360 @@
+"""
+Compile-time evaluation of pure Functions called with constant arguments
+"""
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from compiler.defs import Constant, Op, OpType, Program, Signature, Token, TokenType
+from compiler.program import renumber_program
+from compiler.utils import (
+    get_do_jump_destination,
+    get_end_op_for_while,
+    get_parent_while,
+    get_related_endif,
+    print_if_verbose,
+)
+
+WORD_SIZE: int = 2**64
+
+# Ops that do not alter the stack at runtime
+NO_OP_TYPES: List[OpType] = [
+    OpType.CAST_BOOL,
+    OpType.CAST_CHAR,
+    OpType.CAST_INT,
+    OpType.CAST_PTR,
+    OpType.CAST_STR,
+    OpType.CAST_UINT8,
+    OpType.ENDIF,
+    OpType.IF,
+    OpType.IN,
+    OpType.TAKE,
+    OpType.WHILE,
+]
+
+CONSTANT_PUSH_TYPES: List[OpType] = [
+    OpType.PUSH_BOOL,
+    OpType.PUSH_CHAR,
+    OpType.PUSH_INT,
+    OpType.PUSH_UINT8,
+]
+
+# Return types which can be pushed back to the stack as literals
+FOLDABLE_TYPES: List[TokenType] = [
+    TokenType.BOOL,
+    TokenType.CHAR,
+    TokenType.INT,
+    TokenType.UINT8,
+]
+
+
+class EvaluationAborted(Exception):
+    """Raised when a Function call cannot be evaluated at compile time"""
+
+
+@dataclass
+class EvaluationState:
+    """
+    Class for storing the state of a single compile-time evaluation.
+
+    steps_left: Store the number of Ops that can still be executed before giving up
+    jump_cache: Store the jump destinations of control flow Ops in each sub-program
+    """
+
+    steps_left: int
+    jump_cache: Dict[Tuple[str, int], int] = field(default_factory=dict)
+
+
+def evaluate_constant_calls(
+    sub_programs: Dict[str, Program],
+    signatures: Dict[str, Signature],
+    constants: List[Constant],
+    step_budget: int,
+    is_verbose: bool,
+) -> Dict[str, Program]:
+    """
+    Replace Function calls with constant arguments by the values they return.
+    Calls which reach a side effect or exceed the step budget are left to runtime.
+    """
+    constant_values: Dict[str, int] = {const.name: const.value for const in constants}
+    for name, program in sub_programs.items():
+        sub_programs[name] = fold_constant_calls(
+            program,
+            sub_programs,
+            signatures,
+            constant_values,
+            step_budget=step_budget,
+            is_verbose=is_verbose,
+        )
+    return sub_programs
+
+
+def fold_constant_calls(
+    program: Program,
+    sub_programs: Dict[str, Program],
+    signatures: Dict[str, Signature],
+    constant_values: Dict[str, int],
+    *,
+    step_budget: int,
+    is_verbose: bool,
+) -> Program:
+    # pylint: disable=too-many-arguments
+    """Fold the evaluable Function calls of a single sub-program. Return the sub-program."""
+    folded_program: Program = []
+    # Values of the constant pushes directly preceding the current Op
+    constant_window: List[int] = []
+    for op in program:
+        if op.type in CONSTANT_PUSH_TYPES:
+            folded_program.append(op)
+            constant_window.append(get_constant_push_value(op, constant_values))
+            continue
+
+        if op.type == OpType.FUNCTION_CALL:
+            param_types, return_types = signatures[op.token.value]
+            param_count: int = len(param_types)
+            results: Optional[List[int]] = None
+            if param_count <= len(constant_window) and all(
+                return_type in FOLDABLE_TYPES for return_type in return_types
+            ):
+                arguments: List[int] = constant_window[
+                    len(constant_window) - param_count :
+                ]
+                results = evaluate_function_call(
+                    op.token.value,
+                    arguments,
+                    sub_programs,
+                    constant_values,
+                    step_budget,
+                )
+            if results is not None and len(results) == len(return_types):
+                result_ops: Optional[Program] = get_result_push_ops(
+                    op, results, return_types
+                )
+                if result_ops is not None:
+                    print_if_verbose(
+                        f"Evaluated '{op.token.value}' at compile time in '{op.func.name}'",
+                        is_verbose,
+                    )
+                    # Replace the argument pushes and the call with the returned values
+                    del folded_program[len(folded_program) - param_count :]
+                    del constant_window[len(constant_window) - param_count :]
+                    folded_program += result_ops
+                    constant_window += results
+                    continue
+
+        folded_program.append(op)
+        constant_window = []
+    return renumber_program(folded_program)
+
+
+def get_constant_push_value(op: Op, constant_values: Dict[str, int]) -> int:
+    """Return the unsigned 64-bit value pushed to the stack by a constant push Op."""
+    value: str = op.token.value
+    if op.type == OpType.PUSH_BOOL:
+        return int(value.upper() == "TRUE")
+    if op.type == OpType.PUSH_CHAR:
+        return ord(value[1])
+    if value in constant_values:
+        return constant_values[value] % WORD_SIZE
+    return int(value) % WORD_SIZE
+
+
+def get_result_push_ops(
+    call_op: Op, results: List[int], return_types: List[TokenType]
+) -> Optional[Program]:
+    """Generate constant push Ops for the returned values. Return None if a value cannot be a literal."""
+    result_ops: Program = []
+    # The last return type is at the top of the stack
+    for result, return_type in zip(results, return_types):
+        if return_type == TokenType.BOOL:
+            if result > 1:
+                return None
+            token = Token(str(bool(result)), TokenType.BOOL, call_op.token.location)
+            op_type: OpType = OpType.PUSH_BOOL
+        elif return_type == TokenType.CHAR:
+            if result > 255:
+                return None
+            token = Token(f"'{chr(result)}'", TokenType.CHAR, call_op.token.location)
+            op_type = OpType.PUSH_CHAR
+        elif return_type == TokenType.UINT8:
+            if result > 255:
+                return None
+            token = Token(str(result), TokenType.UINT8, call_op.token.location)
+            op_type = OpType.PUSH_UINT8
+        else:
+            token = Token(str(to_signed(result)), TokenType.INT, call_op.token.location)
+            op_type = OpType.PUSH_INT
+        result_ops.append(Op(call_op.id, op_type, token, call_op.func))
+    return result_ops
+
+
+def evaluate_function_call(
+    function_name: str,
+    arguments: List[int],
+    sub_programs: Dict[str, Program],
+    constant_values: Dict[str, int],
+    step_budget: int,
+) -> Optional[List[int]]:
+    """
+    Execute a Function with the given arguments at compile time.
+    Return the stack after the call or None if the call cannot be evaluated.
+    """
+    stack: List[int] = copy(arguments)
+    state: EvaluationState = EvaluationState(step_budget)
+    try:
+        execute_program(function_name, stack, sub_programs, constant_values, state)
+    except (EvaluationAborted, RecursionError):
+        return None
+    return stack
+
+
+def execute_program(
+    function_name: str,
+    stack: List[int],
+    sub_programs: Dict[str, Program],
+    constant_values: Dict[str, int],
+    state: EvaluationState,
+) -> None:
+    # sourcery skip: low-code-quality
+    """Execute the sub-program of a Function with the stack shared with the caller."""
+    program: Program = sub_programs[function_name]
+    # Every call has its own bound values like the frames at runtime
+    bindings: Dict[str, int] = {}
+    peek_pointer: int = 0
+    pc: int = 0
+    while pc < len(program):
+        op: Op = program[pc]
+        state.steps_left -= 1
+        if state.steps_left < 0:
+            raise EvaluationAborted("Step budget exceeded")
+        pc += 1
+
+        if op.type in NO_OP_TYPES:
+            continue
+        if op.type in CONSTANT_PUSH_TYPES:
+            stack.append(get_constant_push_value(op, constant_values))
+        elif op.type == OpType.INTRINSIC:
+            execute_intrinsic(op.token.value.upper(), stack)
+        elif op.type == OpType.FUNCTION_CALL:
+            execute_program(op.token.value, stack, sub_programs, constant_values, state)
+        elif op.type == OpType.RETURN:
+            return
+        elif op.type == OpType.DO:
+            if pop_value(stack) == 0:
+                pc = get_jump_destination(op, program, state) + 1
+        elif op.type in (OpType.ELIF, OpType.ELSE):
+            pc = get_jump_destination(op, program, state) + 1
+        elif op.type in (OpType.CONTINUE, OpType.DONE):
+            pc = get_jump_destination(op, program, state)
+        elif op.type == OpType.BREAK:
+            pc = get_jump_destination(op, program, state) + 1
+        elif op.type == OpType.PEEK:
+            peek_pointer = len(stack)
+        elif op.type == OpType.PEEK_BIND:
+            peek_pointer -= 1
+            if peek_pointer < 0:
+                raise EvaluationAborted("PEEK beyond the evaluated stack")
+            bindings[op.token.value] = stack[peek_pointer]
+        elif op.type == OpType.POP_BIND:
+            bindings[op.token.value] = pop_value(stack)
+        elif op.type == OpType.PUSH_BIND:
+            try:
+                stack.append(bindings[op.token.value])
+            except KeyError as e:
+                raise EvaluationAborted("Binding used before assignment") from e
+        elif op.type == OpType.ASSIGN_BIND:
+            pop_value(stack)
+            bindings[program[op.id - 1].token.value] = pop_value(stack)
+        else:
+            # Pointers, strings and memories only exist at runtime
+            raise EvaluationAborted(f"{op.type.name} cannot be evaluated")
+
+
+def execute_intrinsic(intrinsic: str, stack: List[int]) -> None:
+    # sourcery skip: low-code-quality
+    """Execute a side effect free Intrinsic on the stack."""
+    if intrinsic in {"AND", "MINUS", "MUL", "OR", "PLUS"}:
+        b: int = pop_value(stack)
+        a: int = pop_value(stack)
+        if intrinsic == "AND":
+            stack.append(a & b)
+        elif intrinsic == "MINUS":
+            stack.append((a - b) % WORD_SIZE)
+        elif intrinsic == "MUL":
+            stack.append(a * b % WORD_SIZE)
+        elif intrinsic == "OR":
+            stack.append(a | b)
+        else:
+            stack.append((a + b) % WORD_SIZE)
+    elif intrinsic in {"EQ", "GE", "GT", "LE", "LT", "NE"}:
+        b = to_signed(pop_value(stack))
+        a = to_signed(pop_value(stack))
+        comparisons: Dict[str, bool] = {
+            "EQ": a == b,
+            "GE": a >= b,
+            "GT": a > b,
+            "LE": a <= b,
+            "LT": a < b,
+            "NE": a != b,
+        }
+        stack.append(int(comparisons[intrinsic]))
+    elif intrinsic == "DIVMOD":
+        b = pop_value(stack)
+        a = pop_value(stack)
+        if b == 0:
+            raise EvaluationAborted("Division by zero")
+        stack.append(a % b)
+        stack.append(a // b)
+    elif intrinsic == "DROP":
+        pop_value(stack)
+    elif intrinsic == "DUP":
+        stack.append(peek_value(stack, 1))
+    elif intrinsic == "NTH":
+        stack.append(peek_value(stack, to_signed(pop_value(stack))))
+    elif intrinsic == "OVER":
+        stack.append(peek_value(stack, 2))
+    elif intrinsic == "ROT":
+        if len(stack) < 3:
+            raise EvaluationAborted("Stack underflow")
+        stack.append(stack.pop(-3))
+    elif intrinsic == "SWAP":
+        b = pop_value(stack)
+        a = pop_value(stack)
+        stack += [b, a]
+    else:
+        # Syscalls, PRINT, memory access and program arguments have side effects
+        raise EvaluationAborted(f"{intrinsic} cannot be evaluated")
+
+
+def get_jump_destination(op: Op, program: Program, state: EvaluationState) -> int:
+    """Return the index of the Op where a control flow Op transfers the execution."""
+    cache_key: Tuple[str, int] = (op.func.name, op.id)
+    if cache_key not in state.jump_cache:
+        if op.type == OpType.DO:
+            destination: Op = get_do_jump_destination(op, program)
+        elif op.type in (OpType.ELIF, OpType.ELSE):
+            destination = get_related_endif(op, program)
+        elif op.type == OpType.BREAK:
+            destination = get_end_op_for_while(get_parent_while(op, program), program)
+        else:
+            destination = get_parent_while(op, program)
+        state.jump_cache[cache_key] = destination.id
+    return state.jump_cache[cache_key]
+
+
+def pop_value(stack: List[int]) -> int:
+    """Pop a value from the evaluated stack."""
+    if not stack:
+        raise EvaluationAborted("Stack underflow")
+    return stack.pop()
+
+
+def peek_value(stack: List[int], nth: int) -> int:
+    """Return the Nth value from the top of the evaluated stack without popping it."""
+    if not 0 < nth <= len(stack):
+        raise EvaluationAborted("Stack underflow")
+    return stack[-nth]
+
+
+def to_signed(value: int) -> int:
+    """Interpret an unsigned 64-bit value as a signed integer."""
+    return value - WORD_SIZE if value >= WORD_SIZE // 2 else value
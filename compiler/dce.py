@@ -0,0 +1,270 @@
+"""
+Elimination of unreachable Ops, constant condition branches and dropped computations
+"""
+from copy import copy
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.ctfe import CONSTANT_PUSH_TYPES, get_constant_push_value
+from compiler.defs import Constant, Op, OpType, Program, Token, TokenType
+from compiler.program import renumber_program
+from compiler.utils import print_if_verbose
+
+BLOCK_START_TYPES: Set[OpType] = {OpType.IF, OpType.WHILE}
+BLOCK_END_TYPES: Set[OpType] = {OpType.DONE, OpType.ENDIF}
+
+# Ops after which the execution continues elsewhere
+TERMINATOR_TYPES: Set[OpType] = {OpType.BREAK, OpType.CONTINUE, OpType.RETURN}
+
+# Ops which push one value without side effects
+PURE_PUSH_TYPES: Set[OpType] = set(CONSTANT_PUSH_TYPES) | {
+    OpType.PUSH_BIND,
+    OpType.PUSH_PTR,
+    OpType.PUSH_STR,
+}
+PURE_PUSH_INTRINSICS: Set[str] = {"ARGC", "ARGV", "DUP", "ENVP", "OVER"}
+
+# Intrinsics which pop two values and push one without side effects
+PURE_BINARY_INTRINSICS: Set[str] = {
+    "AND",
+    "EQ",
+    "GE",
+    "GT",
+    "LE",
+    "LT",
+    "MINUS",
+    "MUL",
+    "NE",
+    "OR",
+    "PLUS",
+}
+
+CAST_TYPES: Set[OpType] = {
+    OpType.CAST_BOOL,
+    OpType.CAST_CHAR,
+    OpType.CAST_INT,
+    OpType.CAST_PTR,
+    OpType.CAST_STR,
+    OpType.CAST_UINT8,
+}
+
+# Condition Ops, DO Op and body Ops of a single IF or ELIF branch
+Branch = Tuple[Op, Program, Op, Program]
+
+
+@dataclass
+class IfChain:
+    """IF and ELIF branches of an IF chain, its ELSE Op and body, and the index of its ENDIF"""
+
+    branches: List[Branch]
+    else_op: Optional[Op]
+    else_body: Optional[Program]
+    endif_id: int
+
+
+def eliminate_dead_code(
+    sub_programs: Dict[str, Program], constants: List[Constant], is_verbose: bool
+) -> Dict[str, Program]:
+    """
+    Remove the Ops which can never be executed, collapse the IF chains and WHILE loops with
+    constant conditions and remove computations whose results are dropped right away.
+    """
+    constant_values: Dict[str, int] = {const.name: const.value for const in constants}
+    for name, program in sub_programs.items():
+        op_count: int = len(program)
+        program = fold_constant_conditions(program, constant_values)
+        program = remove_unreachable_ops(program)
+        program = remove_dropped_computations(program)
+        if len(program) < op_count:
+            print_if_verbose(
+                f"Removed {op_count - len(program)} dead Ops from '{name}'", is_verbose
+            )
+        sub_programs[name] = renumber_program(program)
+    return sub_programs
+
+
+def remove_unreachable_ops(program: Program) -> Program:
+    """Remove the Ops between RETURN, BREAK or CONTINUE and the end of the enclosing block."""
+    reachable: Program = []
+    op_id: int = 0
+    while op_id < len(program):
+        op: Op = program[op_id]
+        reachable.append(op)
+        op_id += 1
+        if op.type in TERMINATOR_TYPES:
+            op_id = get_block_boundary(program, op_id)
+    return reachable
+
+
+def get_block_boundary(program: Program, op_id: int) -> int:
+    """
+    Return the index of the next ELIF, ELSE, ENDIF or DONE at the current nesting level,
+    or the length of the Program if the current block is the Function body.
+    """
+    depth: int = 0
+    while op_id < len(program):
+        op_type: OpType = program[op_id].type
+        if op_type in BLOCK_START_TYPES:
+            depth += 1
+        elif op_type in BLOCK_END_TYPES:
+            if depth == 0:
+                return op_id
+            depth -= 1
+        elif op_type in (OpType.ELIF, OpType.ELSE) and depth == 0:
+            return op_id
+        op_id += 1
+    return op_id
+
+
+def get_constant_condition(
+    condition: Program, constant_values: Dict[str, int]
+) -> Optional[bool]:
+    """Return the value of a condition consisting of a single constant push or None."""
+    if len(condition) != 1 or condition[0].type not in CONSTANT_PUSH_TYPES:
+        return None
+    try:
+        return get_constant_push_value(condition[0], constant_values) != 0
+    except ValueError:
+        return None
+
+
+def fold_constant_conditions(program: Program, constant_values: Dict[str, int]) -> Program:
+    """Collapse IF chains and remove WHILE loops whose conditions are known at compile time."""
+    op_id: int = 0
+    while op_id < len(program):
+        op: Op = program[op_id]
+        if op.type == OpType.IF:
+            end_id, replacement = fold_if_chain(program, op_id, constant_values)
+            if replacement is not None:
+                program = program[:op_id] + replacement + program[end_id + 1 :]
+                continue
+        elif op.type == OpType.WHILE:
+            do_id: int = get_block_boundary_op(program, op_id + 1, {OpType.DO})
+            condition: Program = program[op_id + 1 : do_id]
+            if get_constant_condition(condition, constant_values) is False:
+                done_id: int = get_block_boundary(program, do_id + 1)
+                program = program[:op_id] + program[done_id + 1 :]
+                continue
+        op_id += 1
+    return program
+
+
+def get_block_boundary_op(program: Program, op_id: int, op_types: Set[OpType]) -> int:
+    """Return the index of the next Op of the given types at the current nesting level."""
+    depth: int = 0
+    while op_id < len(program):
+        op_type: OpType = program[op_id].type
+        if depth == 0 and op_type in op_types:
+            return op_id
+        if op_type in BLOCK_START_TYPES:
+            depth += 1
+        elif op_type in BLOCK_END_TYPES:
+            depth -= 1
+        op_id += 1
+    return op_id
+
+
+def fold_if_chain(
+    program: Program, if_id: int, constant_values: Dict[str, int]
+) -> Tuple[int, Optional[Program]]:
+    """
+    Return the index of the ENDIF of the IF chain and the Ops replacing the chain,
+    or None if none of the conditions of the chain is constant.
+    """
+    chain: IfChain = get_if_chain(program, if_id)
+    conditions: List[Optional[bool]] = [
+        get_constant_condition(condition, constant_values) for _, condition, _, _ in chain.branches
+    ]
+    if all(condition is None for condition in conditions):
+        return chain.endif_id, None
+
+    kept: List[Branch] = []
+    for branch, condition in zip(chain.branches, conditions):
+        if condition is False:
+            continue
+        if condition is True:
+            # The rest of the chain is never reached
+            chain.else_op, chain.else_body = None, branch[3]
+            break
+        kept.append(branch)
+    if not kept:
+        return chain.endif_id, chain.else_body or []
+    return chain.endif_id, get_folded_chain(kept, chain, program[chain.endif_id])
+
+
+def get_if_chain(program: Program, if_id: int) -> IfChain:
+    """Collect the IF and ELIF branches and the ELSE part of the IF chain starting at if_id."""
+    chain: IfChain = IfChain([], None, None, if_id)
+    head_id: int = if_id
+    while True:
+        do_id: int = get_block_boundary_op(program, head_id + 1, {OpType.DO})
+        end_id: int = get_block_boundary(program, do_id + 1)
+        chain.branches.append(
+            (
+                program[head_id],
+                program[head_id + 1 : do_id],
+                program[do_id],
+                program[do_id + 1 : end_id],
+            )
+        )
+        if program[end_id].type == OpType.ELSE:
+            chain.else_op = program[end_id]
+            endif_id: int = get_block_boundary(program, end_id + 1)
+            chain.else_body = program[end_id + 1 : endif_id]
+            end_id = endif_id
+        if program[end_id].type != OpType.ELIF:
+            chain.endif_id = end_id
+            return chain
+        head_id = end_id
+
+
+def get_folded_chain(kept: List[Branch], chain: IfChain, endif_op: Op) -> Program:
+    """Return the Ops of the IF chain with only the kept branches, the first one starting with IF."""
+    folded: Program = []
+    for index, (head_op, condition_ops, do_op, body) in enumerate(kept):
+        head_type: OpType = OpType.IF if index == 0 else OpType.ELIF
+        if head_op.type != head_type:
+            head_op = get_keyword_op(head_op, head_type)
+        folded += [head_op] + condition_ops + [do_op] + body
+    if chain.else_body is not None:
+        folded += [chain.else_op or get_keyword_op(endif_op, OpType.ELSE)] + chain.else_body
+    return folded + [endif_op]
+
+
+def get_keyword_op(op: Op, op_type: OpType) -> Op:
+    """Return a new keyword Op like IF or ELSE at the location of the Op."""
+    token: Token = Token(op_type.name, TokenType.KEYWORD, op.token.location)
+    return Op(op.id, op_type, token, op.func)
+
+
+def is_intrinsic(op: Op, intrinsics: Set[str]) -> bool:
+    """Check if the Op is one of the Intrinsics."""
+    return op.type == OpType.INTRINSIC and op.token.value.upper() in intrinsics
+
+
+def remove_dropped_computations(program: Program) -> Program:
+    """Remove pure computations whose results are dropped right after them."""
+    optimized: Program = []
+    for op in program:
+        if is_intrinsic(op, {"DROP"}):
+            drop_value(optimized, op)
+        else:
+            optimized.append(op)
+    return optimized
+
+
+def drop_value(program: Program, drop_op: Op) -> None:
+    """Append DROP to the Program unless it cancels out the pure Op before it."""
+    previous: Optional[Op] = program[-1] if program else None
+    if previous is None:
+        program.append(drop_op)
+    elif previous.type in PURE_PUSH_TYPES or is_intrinsic(previous, PURE_PUSH_INTRINSICS):
+        program.pop()
+    elif previous.type in CAST_TYPES:
+        program.pop()
+        drop_value(program, drop_op)
+    elif is_intrinsic(previous, PURE_BINARY_INTRINSICS):
+        program.pop()
+        drop_value(program, drop_op)
+        drop_value(program, copy(drop_op))
+    else:
+        program.append(drop_op)
@@ -2,7 +2,7 @@
 Definitions for classes, constants, and types used by the Torth compiler
 """
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum, auto
 from typing import Dict, List, Optional, Tuple, Union
 
@@ -203,6 +203,150 @@ class TypeStack:
         return node_list
 
 
+class CallingConvention(Enum):
+    """Places where a Function keeps its return address while the Function is executed"""
+
+    RETURN_STACK = auto()  # return_stack, required by recursive Functions
+    STATIC = auto()  # Memory reserved for the Function, for non-recursive Functions
+    REGISTER = auto()  # rbp, for leaf Functions which do not call other Functions
+
+
+@dataclass
+class AssemblySections:
+    """
+    Buffers for the sections of the generated assembly file.
+    The pieces of assembly are appended to the buffers and joined once at the end.
+
+    header: Definitions before the first section
+    data:   Initialized variables
+    bss:    Reserved memory
+    text:   Code
+    rodata: Read-only data like the string literals
+    """
+
+    header: List[str] = field(default_factory=list)
+    data: List[str] = field(default_factory=list)
+    bss: List[str] = field(default_factory=list)
+    text: List[str] = field(default_factory=list)
+    rodata: List[str] = field(default_factory=list)
+
+    def join(self) -> str:
+        """Return the assembly file with each section in the order of the buffers."""
+        return self.join_code() + self.join_rodata()
+
+    def join_code(self) -> str:
+        """Return the assembly file until the end of the .text section."""
+        return "".join(
+            [
+                *self.header,
+                "section .data\n",
+                *self.data,
+                "\nsection .bss\n",
+                *self.bss,
+                "\nsection .text\n",
+                *self.text,
+            ]
+        )
+
+    def join_rodata(self) -> str:
+        """Return the .rodata section."""
+        return "".join(["section .rodata\n", *self.rodata])
+
+
+@dataclass
+class CodegenContext:
+    """
+    Facts about the whole Program shared by the code generation of each Function.
+
+    conventions:     Place of the return address of each Function
+    constants:       Value of each Constant by name
+    register_counts: Parameters and return values passed in the cache registers by Function
+    signatures:      Signature of each Function with Ops
+    """
+
+    conventions: Dict[str, CallingConvention]
+    constants: Dict[str, int] = field(default_factory=dict)
+    register_counts: Optional[Dict[str, Tuple[int, int]]] = None
+    signatures: Dict[str, Signature] = field(default_factory=dict)
+
+
+# Registers that are not used by any other generated code
+CACHE_REGISTERS: List[str] = ["r12", "r13", "r14"]
+
+
+class RegisterCache:
+    """Registers holding the topmost elements of the stack during code generation"""
+
+    def __init__(self) -> None:
+        # The last register holds the top element of the stack
+        self.registers: List[str] = []
+
+    def spill(self) -> str:
+        """Push every cached element to the stack. Return the assembly for spilling."""
+        spill_asm: str = "".join(f"  push {register}\n" for register in self.registers)
+        self.registers = []
+        return spill_asm
+
+    def fill(self, count: int) -> str:
+        """Make sure that at least count topmost elements are cached. Return the assembly for filling."""
+        fill_asm: str = ""
+        while len(self.registers) < count:
+            register: str = self.get_free_register()
+            fill_asm += f"  pop {register}\n"
+            self.registers.insert(0, register)
+        return fill_asm
+
+    def push(self) -> Tuple[str, str]:
+        """
+        Reserve a register for a new top element, spilling the bottom element if the cache is full.
+        Return the assembly for spilling and the reserved register.
+        """
+        spill_asm: str = ""
+        if len(self.registers) == len(CACHE_REGISTERS):
+            spill_asm = f"  push {self.registers.pop(0)}\n"
+        register: str = self.get_free_register()
+        self.registers.append(register)
+        return spill_asm, register
+
+    def pop(self) -> str:
+        """Remove the top element from the cache. Return the register holding the element."""
+        return self.registers.pop()
+
+    def top(self, nth: int = 1) -> str:
+        """Return the register holding the Nth element from the top of the stack"""
+        return self.registers[-nth]
+
+    def arrange(self, count: int) -> str:
+        """
+        Leave exactly count topmost elements cached, the bottom one in the first cache register
+        and the rest in order. Return the assembly for spilling, filling and moving the elements.
+        """
+        arrange_asm: str = ""
+        while len(self.registers) > count:
+            arrange_asm += f"  push {self.registers.pop(0)}\n"
+        arrange_asm += self.fill(count)
+        for index, register in enumerate(CACHE_REGISTERS[:count]):
+            current: str = self.registers[index]
+            if current == register:
+                continue
+            if register in self.registers:
+                # Swap the registers through rax
+                self.registers[self.registers.index(register)] = current
+                arrange_asm += f"  mov rax, {register}\n"
+                arrange_asm += f"  mov {register}, {current}\n"
+                arrange_asm += f"  mov {current}, rax\n"
+            else:
+                arrange_asm += f"  mov {register}, {current}\n"
+            self.registers[index] = register
+        return arrange_asm
+
+    def get_free_register(self) -> str:
+        """Return the first cache register which is not in use"""
+        return next(
+            register for register in CACHE_REGISTERS if register not in self.registers
+        )
+
+
 Location = Tuple[str, int, int]  # Source file name, row, column
 
 
@@ -224,6 +368,21 @@ class Memory:
     location: Location
 
 
+# Location of the Constants and memories defined by the compiler instead of the code
+RUNTIME_LOCATION: Location = ("<runtime>", -1, -1)
+
+# Size of the output buffer shared by the PRINT intrinsic and the standard library
+OUTPUT_BUFFER_SIZE: int = 65536
+
+# Constants and memories of the runtime routines, which the code can use like its own
+RUNTIME_CONSTANTS: List[Constant] = [
+    Constant("OUTPUT_BUFFER_SIZE", OUTPUT_BUFFER_SIZE, RUNTIME_LOCATION),
+]
+RUNTIME_MEMORIES: List[Memory] = [
+    Memory("output_buffer", OUTPUT_BUFFER_SIZE, RUNTIME_LOCATION),
+    Memory("output_buffer_length", 8, RUNTIME_LOCATION),
+]
+
 Binding = Dict[str, TokenType]
 
 
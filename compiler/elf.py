@@ -0,0 +1,166 @@
+"""
+Writer for statically linked x86-64 ELF executables
+"""
+import os
+import struct
+from typing import Dict, List, Tuple
+from compiler.utils import compiler_error
+from compiler.x86 import Fixup, ObjectCode, is_signed, is_unsigned, to_bytes
+
+BASE_ADDRESS: int = 0x400000
+PAGE_SIZE: int = 0x1000
+ENTRY_SYMBOL: str = "_start"
+
+ELF_HEADER_SIZE: int = 64
+PROGRAM_HEADER_SIZE: int = 56
+
+# Segment permission flags
+PF_X: int = 1
+PF_W: int = 2
+PF_R: int = 4
+
+# Sections in the order they are placed and the permissions of their segments
+SEGMENT_FLAGS: List[Tuple[str, int]] = [
+    (".text", PF_R | PF_X),
+    (".rodata", PF_R),
+    (".data", PF_R | PF_W),
+]
+
+
+def align_up(value: int, alignment: int) -> int:
+    """Round the value up to a multiple of the alignment."""
+    return value + -value % alignment
+
+
+def get_segment_layout(code: ObjectCode) -> Dict[str, Tuple[int, int]]:
+    """
+    Place every section to its own page aligned segment.
+    The .bss section follows the .data section in memory.
+    Return the file offset and the virtual address of each section.
+    """
+    layout: Dict[str, Tuple[int, int]] = {}
+    file_offset: int = PAGE_SIZE
+    for name, _flags in SEGMENT_FLAGS:
+        contents: bytearray = code.sections.get(name, bytearray())
+        if not contents and (name != ".data" or code.bss_size == 0):
+            continue
+        layout[name] = (file_offset, BASE_ADDRESS + file_offset)
+        file_offset = align_up(file_offset + len(contents), PAGE_SIZE)
+    if ".data" in layout:
+        data_offset, data_address = layout[".data"]
+        data_size: int = len(code.sections.get(".data", bytearray()))
+        bss_alignment: int = max(code.alignments.get(".bss", 1), 16)
+        layout[".bss"] = (
+            data_offset + data_size,
+            align_up(data_address + data_size, bss_alignment),
+        )
+    return layout
+
+
+def get_symbol_addresses(
+    code: ObjectCode, layout: Dict[str, Tuple[int, int]]
+) -> Dict[str, int]:
+    """Return the virtual address of every label."""
+    return {
+        name: layout[section][1] + offset
+        for name, (section, offset) in code.symbols.items()
+        if section in layout
+    }
+
+
+def apply_fixup(
+    fixup: Fixup,
+    code: ObjectCode,
+    layout: Dict[str, Tuple[int, int]],
+    addresses: Dict[str, int],
+) -> None:
+    """Patch the address of the referenced symbol to the section."""
+    if fixup.symbol not in addresses:
+        compiler_error("ASSEMBLER_ERROR", f"Undefined symbol '{fixup.symbol}'")
+    value: int = addresses[fixup.symbol] + fixup.addend
+    if fixup.end is not None:
+        value -= layout[fixup.section][1] + fixup.end
+    if fixup.size < 8 and not (
+        is_signed(value, fixup.size) or fixup.end is None and is_unsigned(value, fixup.size)
+    ):
+        compiler_error(
+            "ASSEMBLER_ERROR", f"Reference to '{fixup.symbol}' does not fit in {fixup.size * 8} bits"
+        )
+    contents: bytearray = code.sections[fixup.section]
+    contents[fixup.offset : fixup.offset + fixup.size] = to_bytes(value, fixup.size)
+
+
+def get_elf_header(entry: int, program_header_count: int) -> bytes:
+    """Return the ELF header of a 64-bit little-endian x86-64 executable without section headers."""
+    identification: bytes = b"\x7fELF" + bytes([2, 1, 1, 0]) + bytes(8)
+    return identification + struct.pack(
+        "<HHIQQQIHHHHHH",
+        2,  # ET_EXEC
+        0x3E,  # EM_X86_64
+        1,  # EV_CURRENT
+        entry,
+        ELF_HEADER_SIZE,
+        0,
+        0,
+        ELF_HEADER_SIZE,
+        PROGRAM_HEADER_SIZE,
+        program_header_count,
+        64,
+        0,
+        0,
+    )
+
+
+def get_program_header(
+    flags: int, file_offset: int, address: int, file_size: int, memory_size: int
+) -> bytes:
+    """Return the program header of a loadable segment."""
+    return struct.pack(
+        "<IIQQQQQQ",
+        1,  # PT_LOAD
+        flags,
+        file_offset,
+        address,
+        address,
+        file_size,
+        memory_size,
+        PAGE_SIZE,
+    )
+
+
+def get_executable(code: ObjectCode) -> bytes:
+    """Link the object code to the bytes of a static executable."""
+    layout: Dict[str, Tuple[int, int]] = get_segment_layout(code)
+    addresses: Dict[str, int] = get_symbol_addresses(code, layout)
+    if ENTRY_SYMBOL not in addresses:
+        compiler_error("ASSEMBLER_ERROR", f"Entry point '{ENTRY_SYMBOL}' is not defined")
+    for fixup in code.fixups:
+        apply_fixup(fixup, code, layout, addresses)
+
+    program_headers: bytes = b""
+    segments: bytes = b""
+    for name, flags in SEGMENT_FLAGS:
+        if name not in layout:
+            continue
+        file_offset, address = layout[name]
+        contents: bytearray = code.sections.get(name, bytearray())
+        memory_size: int = len(contents)
+        if name == ".data":
+            memory_size = layout[".bss"][1] + code.bss_size - address
+        program_headers += get_program_header(
+            flags, file_offset, address, len(contents), memory_size
+        )
+        segments += bytes(file_offset - PAGE_SIZE - len(segments)) + contents
+
+    headers: bytes = get_elf_header(
+        addresses[ENTRY_SYMBOL], len(program_headers) // PROGRAM_HEADER_SIZE
+    )
+    headers += program_headers
+    return headers + bytes(PAGE_SIZE - len(headers)) + segments
+
+
+def write_executable(code: ObjectCode, executable_file: str) -> None:
+    """Write the object code to an executable file."""
+    with open(executable_file, "wb") as executable:
+        executable.write(get_executable(code))
+    os.chmod(executable_file, 0o755)
@@ -15,6 +15,8 @@ from compiler.defs import (
     Keyword,
     Location,
     Memory,
+    RUNTIME_CONSTANTS,
+    RUNTIME_MEMORIES,
     Signature,
     SIGNATURE_MAP,
     Token,
@@ -111,7 +113,7 @@ def add_enums_to_constants(
     ENUM_REGEX = re.compile(
         r"ENUM\s+(\S+)\s+(\d+)\s+:\s+([\s\S]+?\s+)END", re.IGNORECASE | re.MULTILINE
     )
-    for file in included_files:
+    for file in sorted(included_files):
         code: str = get_file_contents(file)
         enum_matches = ENUM_REGEX.findall(code)
         for match in enum_matches:
@@ -137,7 +139,7 @@ def add_enums_to_constants(
 def get_functions_from_files(included_files: List[str]) -> Dict[str, Function]:
     """Parse declared functions from code file and included files. Return list of Function objects."""
     functions: Dict[str, Function] = {}
-    for file in included_files:
+    for file in sorted(included_files):
         included_code: str = get_file_contents(file)
         token_matches: list = get_token_matches(included_code)
         # Newlines are used to determine when a comment ends and when new line starts
@@ -266,18 +268,15 @@ def parse_function_bindings(
             elif token.value.upper() == "IN":
                 parsing_bind = False
             elif parsing_bind:
-                bound_memory: str = f"{func.name}_{token.value}"
-                if memory_exists(token.value, memories) or memory_exists(
-                    bound_memory, memories
-                ):
+                if memory_exists(token.value, memories):
                     compiler_error(
                         "VALUE_ERROR",
                         f"Cannot bind '{token.value}' over Memory with the same name",
                         token,
                     )
+                # Bound values are stored to the frame of each call of the Function
                 token.is_bound = True
                 binding[token.value] = token.type
-                memories.append(Memory(bound_memory, 8, token.location))
                 token.value = f"{token.value}_{bind_variant}"
             elif token.value in binding:
                 token.type = binding[token.value]
@@ -290,9 +289,12 @@ def parse_function_bindings(
 def get_memories_from_code(
     included_files: Set[str], constants: List[Constant]
 ) -> List[Memory]:
-    """Parse Memory objects from code file and included files. Return list of Memory objects."""
-    memories: List[Memory] = []
-    for file in included_files:
+    """
+    Parse Memory objects from code file and included files. Return list of Memory objects.
+    The list starts with the memories of the runtime routines.
+    """
+    memories: List[Memory] = list(RUNTIME_MEMORIES)
+    for file in sorted(included_files):
         included_code: str = get_file_contents(file)
         token_matches: list = get_token_matches(included_code)
         newline_indexes: List[int] = [
@@ -527,12 +529,15 @@ def get_token_location(
 
 
 def get_constants_from_files(included_files: List[str]) -> List[Constant]:
-    """Parse Constants from list of Function objects. Return the list of Constant objects"""
-    constants: List[Constant] = []
+    """
+    Parse Constants from list of Function objects. Return the list of Constant objects.
+    The list starts with the Constants of the runtime routines.
+    """
+    constants: List[Constant] = list(RUNTIME_CONSTANTS)
     CONST_REGEX = re.compile(
         r"CONST\s+(\S+)\s+(-?\d+|0x[0-9a-fA-F]+)\s+END", re.IGNORECASE | re.MULTILINE
     )
-    for file in included_files:
+    for file in sorted(included_files):
         code: str = get_file_contents(file)
         enum_matches = CONST_REGEX.findall(code)
         for match in enum_matches:
@@ -0,0 +1,369 @@
+"""
+Loop optimizations for the WHILE ... DO ... DONE blocks of the Programs
+"""
+from copy import copy
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from compiler.ctfe import get_constant_push_value, to_signed
+from compiler.defs import Constant, Op, OpType, Program, Token, TokenType
+from compiler.program import renumber_program
+
+# Ops which change the control flow or the bindings
+CONTROL_OP_TYPES: Set[OpType] = {
+    OpType.BREAK,
+    OpType.CONTINUE,
+    OpType.DO,
+    OpType.DONE,
+    OpType.ELIF,
+    OpType.ELSE,
+    OpType.END,
+    OpType.ENDIF,
+    OpType.IF,
+    OpType.IN,
+    OpType.PEEK,
+    OpType.RETURN,
+    OpType.TAKE,
+    OpType.WHILE,
+}
+
+INVARIANT_PUSH_TYPES: Set[OpType] = {
+    OpType.PUSH_BOOL,
+    OpType.PUSH_CHAR,
+    OpType.PUSH_INT,
+    OpType.PUSH_PTR,
+    OpType.PUSH_UINT8,
+}
+
+# Side effect free Intrinsics which cannot fault: (popped count, pushed count)
+INVARIANT_INTRINSICS: Dict[str, List[int]] = {
+    "AND": [2, 1],
+    "ARGV": [0, 1],
+    "DROP": [1, 0],
+    "DUP": [1, 2],
+    "ENVP": [0, 1],
+    "EQ": [2, 1],
+    "GE": [2, 1],
+    "GT": [2, 1],
+    "LE": [2, 1],
+    "LT": [2, 1],
+    "MINUS": [2, 1],
+    "MUL": [2, 1],
+    "NE": [2, 1],
+    "OR": [2, 1],
+    "OVER": [2, 3],
+    "PLUS": [2, 1],
+    "ROT": [3, 3],
+    "SWAP": [2, 2],
+}
+
+# Counted loops are unrolled if they iterate at most UNROLL_MAX_TRIPS times
+# and the unrolled body has at most UNROLL_MAX_OPS Ops
+UNROLL_MAX_TRIPS: int = 8
+UNROLL_MAX_OPS: int = 64
+
+
+@dataclass
+class Loop:
+    """
+    Class for the positions of a WHILE loop in a Program.
+
+    while_op: WHILE Op which starts the condition
+    do_op:    DO Op which ends the condition and starts the body
+    done_op:  DONE Op which ends the body
+    """
+
+    while_op: Op
+    do_op: Op
+    done_op: Op
+
+
+@dataclass
+class LoopReport:
+    """Transformations done to a single loop for the --report-loops output"""
+
+    function_name: str
+    token: Token
+    actions: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        file, row, col = self.token.location
+        return f"{file}:{row}:{col}: Loop in '{self.function_name}': {', '.join(self.actions)}"
+
+
+def optimize_loops(
+    sub_programs: Dict[str, Program],
+    constants: List[Constant],
+    unroll: bool,
+    report: bool,
+) -> Dict[str, Program]:
+    """
+    Hoist loop invariant computations out of the loops and rotate the loops so that
+    the condition is checked at the bottom. With unroll, small counted loops are unrolled.
+    With report, the transformed loops are listed.
+    """
+    constant_values: Dict[str, int] = {const.name: const.value for const in constants}
+    reports: List[LoopReport] = []
+    for name, program in sub_programs.items():
+        processed: Set[int] = set()
+        loop: Optional[Loop] = get_next_loop(program, processed)
+        while loop is not None:
+            processed.add(id(loop.while_op))
+            loop_report: LoopReport = LoopReport(name, loop.while_op.token)
+            if unroll and unroll_counted_loop(program, loop, constant_values):
+                loop_report.actions.append("unrolled")
+            else:
+                hoisted_count: int = hoist_invariants(program, loop)
+                if hoisted_count:
+                    loop_report.actions.append(f"hoisted {hoisted_count} invariant(s)")
+                if rotate_loop(program, loop):
+                    loop_report.actions.append("rotated")
+            if loop_report.actions:
+                reports.append(loop_report)
+            loop = get_next_loop(program, processed)
+        sub_programs[name] = program
+
+    if report:
+        for loop_report in reports:
+            print(loop_report)
+        print(f"Transformed {len(reports)} loop(s)")
+    return sub_programs
+
+
+def get_next_loop(program: Program, processed: Set[int]) -> Optional[Loop]:
+    """Return the innermost unprocessed loop of the Program or None if every loop is processed."""
+    for done_op in program:
+        if done_op.type != OpType.DONE:
+            continue
+        while_op: Op = get_loop_while(done_op, program)
+        if id(while_op) in processed:
+            continue
+        do_op: Optional[Op] = next(
+            (op for op in program[while_op.id + 1 :] if op.type in CONTROL_OP_TYPES),
+            None,
+        )
+        # Loops with control flow in the condition are left as is
+        if do_op is None or do_op.type != OpType.DO:
+            processed.add(id(while_op))
+            continue
+        return Loop(while_op, do_op, done_op)
+    return None
+
+
+def get_loop_while(done_op: Op, program: Program) -> Op:
+    """Return the WHILE Op of the loop which the DONE Op closes."""
+    done_count: int = 0
+    for op in reversed(program[: done_op.id]):
+        if op.type == OpType.DONE:
+            done_count += 1
+        elif op.type == OpType.WHILE:
+            if done_count == 0:
+                return op
+            done_count -= 1
+    return program[0]
+
+
+def get_written_bindings(program: Program, loop: Loop) -> Set[str]:
+    """Return the names of the bindings which the loop assigns to."""
+    written: Set[str] = set()
+    for op in program[loop.while_op.id : loop.done_op.id]:
+        if op.type in {OpType.PEEK_BIND, OpType.POP_BIND}:
+            written.add(op.token.value)
+        elif op.type == OpType.ASSIGN_BIND:
+            written.add(program[op.id - 1].token.value)
+    return written
+
+
+def is_invariant_op(op: Op, written: Set[str]) -> bool:
+    """Check if the Op computes the same value on every iteration of the loop."""
+    if op.type in INVARIANT_PUSH_TYPES:
+        return True
+    if op.type == OpType.PUSH_BIND:
+        return op.token.value not in written
+    return (
+        op.type == OpType.INTRINSIC
+        and op.token.value.upper() in INVARIANT_INTRINSICS
+    )
+
+
+def get_invariant_length(program: Program, start: int, written: Set[str]) -> int:
+    """
+    Return the length of the longest sequence of invariant Ops beginning from start
+    which pushes exactly one value without touching the values below it, or 0.
+    """
+    depth: int = 0
+    length: int = 0
+    for op_id in range(start, len(program)):
+        op: Op = program[op_id]
+        if not is_invariant_op(op, written):
+            break
+        if op.type == OpType.INTRINSIC:
+            popped, pushed = INVARIANT_INTRINSICS[op.token.value.upper()]
+        else:
+            popped, pushed = 0, 1
+        if depth < popped:
+            break
+        depth += pushed - popped
+        # The value to assign must be pushed right before ASSIGN_BIND
+        if depth == 1 and program[op_id + 1].type != OpType.ASSIGN_BIND:
+            length = op_id - start + 1
+    return length if length >= 2 else 0
+
+
+def hoist_invariants(program: Program, loop: Loop) -> int:
+    """
+    Compute the invariant sequences of the loop once before the loop to a new binding
+    and push the binding in the loop instead. Return the count of hoisted sequences.
+    """
+    written: Set[str] = get_written_bindings(program, loop)
+    hoisted_count: int = 0
+    op_id: int = loop.while_op.id + 1
+    while op_id < loop.done_op.id:
+        length: int = get_invariant_length(program, op_id, written)
+        if length == 0 or program[op_id + length - 1].id >= loop.done_op.id:
+            op_id += 1
+            continue
+
+        func = loop.while_op.func
+        binding_name: str = f"loop{loop.while_op.id}_invariant{hoisted_count}"
+        while binding_name in func.binding:
+            binding_name += "_"
+        func.binding[binding_name] = TokenType.ANY
+        token: Token = Token(
+            binding_name, TokenType.WORD, program[op_id].token.location, True
+        )
+        invariant_ops: Program = program[op_id : op_id + length]
+        program[op_id : op_id + length] = [
+            Op(op_id, OpType.PUSH_BIND, token, func)
+        ]
+        while_index: int = loop.while_op.id
+        program[while_index:while_index] = invariant_ops + [
+            Op(while_index, OpType.POP_BIND, token, func)
+        ]
+        renumber_program(program)
+        hoisted_count += 1
+        op_id = loop.while_op.id + 1
+    return hoisted_count
+
+
+def rotate_loop(program: Program, loop: Loop) -> bool:
+    """
+    Rotate 'WHILE c DO b DONE' to 'IF c DO WHILE b c DO DONE ENDIF' so that the condition
+    is checked at the bottom of the loop with a single conditional jump.
+    Return True if the loop was rotated.
+    """
+    condition: Program = program[loop.while_op.id + 1 : loop.do_op.id]
+    body: Program = program[loop.do_op.id + 1 : loop.done_op.id]
+    # CONTINUE jumps to WHILE and the parent of a DO after ELIF cannot be resolved
+    if not body or any(
+        op.type in {OpType.CONTINUE, OpType.ELIF} for op in body
+    ):
+        return False
+
+    location = loop.while_op.token.location
+    func = loop.while_op.func
+    guard_if: Op = Op(0, OpType.IF, Token("IF", TokenType.KEYWORD, location), func)
+    guard_do: Op = Op(0, OpType.DO, Token("DO", TokenType.KEYWORD, location), func)
+    guard_endif: Op = Op(
+        0, OpType.ENDIF, Token("ENDIF", TokenType.KEYWORD, location), func
+    )
+    rotated: Program = (
+        [guard_if]
+        + [copy(op) for op in condition]
+        + [guard_do, loop.while_op]
+        + body
+        + condition
+        + [loop.do_op, loop.done_op, guard_endif]
+    )
+    program[loop.while_op.id : loop.done_op.id + 1] = rotated
+    renumber_program(program)
+    return True
+
+
+def unroll_counted_loop(
+    program: Program, loop: Loop, constant_values: Dict[str, int]
+) -> bool:
+    """
+    Replace a loop like '0 i = WHILE i N < DO b i 1 + i = DONE' with N copies of the body,
+    if the counter starts from a constant and the loop iterates only a few times.
+    Return True if the loop was unrolled.
+    """
+    trip_count: Optional[int] = get_trip_count(program, loop, constant_values)
+    body: Program = program[loop.do_op.id + 1 : loop.done_op.id]
+    if (
+        trip_count is None
+        or trip_count > UNROLL_MAX_TRIPS
+        or trip_count * len(body) > UNROLL_MAX_OPS
+        or any(op.type in {OpType.BREAK, OpType.CONTINUE} for op in body)
+    ):
+        return False
+
+    unrolled: Program = [copy(op) for _ in range(trip_count) for op in body]
+    program[loop.while_op.id : loop.done_op.id + 1] = unrolled
+    renumber_program(program)
+    return True
+
+
+def get_trip_count(
+    program: Program, loop: Loop, constant_values: Dict[str, int]
+) -> Optional[int]:
+    """Return the iteration count of a counted loop or None if it is not known at compile time."""
+    condition: Program = program[loop.while_op.id + 1 : loop.do_op.id]
+    body: Program = program[loop.do_op.id + 1 : loop.done_op.id]
+    if (
+        len(condition) != 3
+        or condition[0].type != OpType.PUSH_BIND
+        or condition[1].type != OpType.PUSH_INT
+        or condition[2].type != OpType.INTRINSIC
+        or condition[2].token.value.upper() not in {"LE", "LT"}
+        or len(body) < 5
+    ):
+        return None
+    counter: str = condition[0].token.value
+
+    # The counter has to be incremented by one only at the end of the body
+    increment: Program = body[-5:]
+    if [op.type for op in increment] != [
+        OpType.PUSH_BIND,
+        OpType.PUSH_INT,
+        OpType.INTRINSIC,
+        OpType.PUSH_BIND,
+        OpType.ASSIGN_BIND,
+    ] or not (
+        increment[0].token.value == increment[3].token.value == counter
+        and increment[1].token.value == "1"
+        and increment[2].token.value.upper() == "PLUS"
+    ):
+        return None
+    body_loop: Loop = Loop(loop.do_op, loop.do_op, body[-5])
+    if counter in get_written_bindings(program, body_loop):
+        return None
+
+    start: Optional[int] = get_counter_start(program, loop.while_op.id, counter)
+    if start is None:
+        return None
+    try:
+        end: int = to_signed(get_constant_push_value(condition[1], constant_values))
+    except ValueError:
+        return None
+    if condition[2].token.value.upper() == "LE":
+        end += 1
+    return max(end - start, 0)
+
+
+def get_counter_start(program: Program, while_id: int, counter: str) -> Optional[int]:
+    """Return the constant assigned to the counter right before the loop or None."""
+    before: Program = program[max(while_id - 4, 0) : while_id]
+    types: List[OpType] = [op.type for op in before]
+    if types[-3:] == [OpType.PUSH_INT, OpType.PUSH_BIND, OpType.ASSIGN_BIND]:
+        push: Op = before[-3]
+        bound: Op = before[-2]
+    elif types == [OpType.PUSH_INT, OpType.TAKE, OpType.POP_BIND, OpType.IN]:
+        push, bound = before[0], before[2]
+    else:
+        return None
+    if bound.token.value != counter:
+        return None
+    try:
+        return to_signed(get_constant_push_value(push, {}))
+    except ValueError:
+        return None
@@ -0,0 +1,186 @@
+"""
+Pass manager for the optimizations selected with the optimization level
+"""
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+from compiler.ctfe import evaluate_constant_calls
+from compiler.dce import eliminate_dead_code
+from compiler.defs import Constant, Function, Program
+from compiler.loops import optimize_loops
+from compiler.strength import inline_arithmetic_calls
+from compiler.utils import compiler_error, print_if_verbose
+
+# The lowest optimization level which enables each optimization
+OPTIMIZATION_LEVELS: Dict[str, int] = {
+    "combine-shuffles": 1,
+    "ctfe": 2,
+    "dead-code": 1,
+    "fuse-branches": 1,
+    "native-calls": 2,
+    "optimize-loops": 1,
+    "peephole": 1,
+    "register-args": 2,
+    "strength-reduce": 1,
+    "tail-calls": 2,
+    "tos-cache": 1,
+    "unroll-loops": 2,
+}
+
+IrPass = Callable[
+    [Dict[str, Program], Dict[str, Function], List[Constant], argparse.Namespace],
+    Dict[str, Program],
+]
+
+
+@dataclass
+class PassMetrics:
+    """
+    Class for the measurements of a single IR pass.
+
+    name:       Name of the optimization the pass belongs to
+    seconds:    Wall time spent in the pass
+    ops_before: Count of Ops in every sub-program before the pass
+    ops_after:  Count of Ops in every sub-program after the pass
+    unit:       What is counted, lines of assembly for the passes after code generation
+    """
+
+    name: str
+    seconds: float
+    ops_before: int
+    ops_after: int
+    unit: str = "Ops"
+
+    def __str__(self) -> str:
+        delta: int = self.ops_after - self.ops_before
+        return (
+            f"{self.name:<16} {self.seconds * 1000:8.2f} ms"
+            f"  {self.ops_before:>7} -> {self.ops_after:>7} {self.unit} ({delta:+})"
+        )
+
+
+def select_optimizations(args: argparse.Namespace) -> argparse.Namespace:
+    """
+    Enable the optimizations of the optimization level in addition to the ones enabled
+    with their own flags or --enable-pass. The ones listed with --disable-pass are disabled.
+    """
+    enabled: List[str] = args.enable_pass or []
+    disabled: List[str] = args.disable_pass or []
+    for name in enabled + disabled:
+        if name not in OPTIMIZATION_LEVELS:
+            compiler_error(
+                "ARGUMENT_ERROR",
+                f"Unknown optimization '{name}'\n\nAvailable optimizations: {', '.join(OPTIMIZATION_LEVELS)}",
+            )
+
+    # Unrolling and the loop report are done by the loop optimization pass
+    if args.unroll_loops or args.report_loops:
+        args.optimize_loops = True
+    for name, level in OPTIMIZATION_LEVELS.items():
+        attribute: str = name.replace("-", "_")
+        is_enabled: bool = (
+            getattr(args, attribute)
+            or name in enabled
+            or args.optimization_level >= level
+        )
+        setattr(args, attribute, is_enabled and name not in disabled)
+    return args
+
+
+def get_enabled_optimizations(args: argparse.Namespace) -> List[str]:
+    """Return the names of the enabled optimizations."""
+    return [
+        name for name in OPTIMIZATION_LEVELS if getattr(args, name.replace("-", "_"))
+    ]
+
+
+def run_ir_passes(
+    sub_programs: Dict[str, Program],
+    functions: Dict[str, Function],
+    constants: List[Constant],
+    args: argparse.Namespace,
+) -> Dict[str, Program]:
+    """Run the enabled IR passes in order. Record the wall time and the size change of each pass."""
+    metrics: List[PassMetrics] = []
+    for name, ir_pass in IR_PASSES:
+        if not getattr(args, name.replace("-", "_")):
+            continue
+        ops_before: int = get_ir_size(sub_programs)
+        start_time: float = time.perf_counter()
+        sub_programs = ir_pass(sub_programs, functions, constants, args)
+        seconds: float = time.perf_counter() - start_time
+        metrics.append(PassMetrics(name, seconds, ops_before, get_ir_size(sub_programs)))
+
+    if args.report_passes:
+        print(f"Optimization level: {args.optimization_level}")
+        print(f"Enabled optimizations: {', '.join(get_enabled_optimizations(args)) or 'none'}")
+        for pass_metrics in metrics:
+            print(pass_metrics)
+    else:
+        for pass_metrics in metrics:
+            print_if_verbose(str(pass_metrics), args.verbose)
+    return sub_programs
+
+
+def get_ir_size(sub_programs: Dict[str, Program]) -> int:
+    """Return the count of Ops in every sub-program."""
+    return sum(len(program) for program in sub_programs.values())
+
+
+def run_ctfe(
+    sub_programs: Dict[str, Program],
+    functions: Dict[str, Function],
+    constants: List[Constant],
+    args: argparse.Namespace,
+) -> Dict[str, Program]:
+    """Replace pure Function calls with constant arguments by their return values"""
+    print_if_verbose("Evaluating constant Function calls", args.verbose)
+    return evaluate_constant_calls(
+        sub_programs,
+        {name: func.signature for name, func in functions.items()},
+        constants,
+        args.ctfe_budget,
+        args.verbose,
+    )
+
+
+def run_dead_code_elimination(
+    sub_programs: Dict[str, Program],
+    _functions: Dict[str, Function],
+    constants: List[Constant],
+    args: argparse.Namespace,
+) -> Dict[str, Program]:
+    """Remove unreachable Ops, constant condition branches and dropped computations"""
+    print_if_verbose("Eliminating dead code", args.verbose)
+    return eliminate_dead_code(sub_programs, constants, args.verbose)
+
+
+def run_arithmetic_inlining(
+    sub_programs: Dict[str, Program],
+    _functions: Dict[str, Function],
+    _constants: List[Constant],
+    args: argparse.Namespace,
+) -> Dict[str, Program]:
+    """Expose constant operands of arithmetic Functions like '%' to strength reduction"""
+    return inline_arithmetic_calls(sub_programs, args.verbose)
+
+
+def run_loop_optimizations(
+    sub_programs: Dict[str, Program],
+    _functions: Dict[str, Function],
+    constants: List[Constant],
+    args: argparse.Namespace,
+) -> Dict[str, Program]:
+    """Hoist loop invariants, rotate loops and unroll small counted loops"""
+    print_if_verbose("Optimizing loops", args.verbose)
+    return optimize_loops(sub_programs, constants, args.unroll_loops, args.report_loops)
+
+
+# IR passes in the order they are run, named after the optimization they belong to
+IR_PASSES: List[Tuple[str, IrPass]] = [
+    ("ctfe", run_ctfe),
+    ("dead-code", run_dead_code_elimination),
+    ("strength-reduce", run_arithmetic_inlining),
+    ("optimize-loops", run_loop_optimizations),
+]
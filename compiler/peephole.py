@@ -0,0 +1,444 @@
+"""
+Peephole optimizer for the generated x86-64 assembly
+"""
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+# Sub-registers are tracked as the 64-bit register they are part of
+REGISTERS: Dict[str, str] = {}
+for register_names in (
+    "rax eax ax al ah",
+    "rbx ebx bx bl bh",
+    "rcx ecx cx cl ch",
+    "rdx edx dx dl dh",
+    "rsi esi si sil",
+    "rdi edi di dil",
+    "rbp ebp bp bpl",
+    "rsp esp sp spl",
+):
+    full_register, *sub_registers = register_names.split()
+    for register_name in [full_register, *sub_registers]:
+        REGISTERS[register_name] = full_register
+for register_number in range(8, 16):
+    for suffix in ("", "d", "w", "b"):
+        REGISTERS[f"r{register_number}{suffix}"] = f"r{register_number}"
+
+# Writing to 8-bit or 16-bit sub-register keeps the rest of the register intact
+PARTIAL_REGISTERS: Set[str] = {
+    name
+    for name in REGISTERS
+    if re.fullmatch(r"[a-d][lhx]|[sd]il?|[bs]pl?|r\d+[wb]", name)
+}
+
+# Instructions which end a basic block
+CONTROL_TRANSFERS: Set[str] = {"call", "jmp", "ret", "syscall"}
+
+# Instructions that read both operands and write the result to the first operand
+READ_MODIFY_WRITE: Set[str] = {
+    "adc",
+    "add",
+    "and",
+    "imul",
+    "or",
+    "sar",
+    "sbb",
+    "shl",
+    "shr",
+    "sub",
+    "xor",
+}
+
+
+@dataclass
+class Instruction:
+    """Instruction is a single parsed line of assembly in the .text section"""
+
+    line: int
+    mnemonic: str
+    operands: List[str]
+    comment: str
+
+
+@dataclass
+class Effects:
+    """Registers and memory an Instruction uses, excluding the implicit stack pointer"""
+
+    reads: Set[str]
+    writes: Set[str]
+    writes_memory: bool
+    uses_stack: bool
+
+
+def optimize_assembly(
+    assembly: str, function_labels: Dict[str, str], is_text: bool = False
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Remove redundant push/pop pairs and dead movs from the Functions in the assembly.
+    With is_text the whole assembly is code from the .text section.
+    Return the optimized assembly and the count of eliminated instructions per Function.
+    """
+    lines: List[Optional[str]] = list(assembly.split("\n"))
+    eliminated: Dict[str, int] = {}
+    try:
+        text_start: int = 0 if is_text else lines.index("section .text") + 1
+    except ValueError:
+        return assembly, eliminated
+
+    current_function: Optional[str] = None
+    block: List[Instruction] = []
+    for line_number in range(text_start, len(lines)):
+        line: str = lines[line_number]  # type: ignore
+        label_match = re.match(r"^([^\s;]+):", line)
+        if label_match:
+            count_eliminated(lines, block, current_function, eliminated)
+            block = []
+            current_function = function_labels.get(
+                label_match.group(1), current_function
+            )
+            continue
+        instruction: Optional[Instruction] = parse_instruction(line, line_number)
+        if instruction is None:
+            continue
+        block.append(instruction)
+        if (
+            instruction.mnemonic in CONTROL_TRANSFERS
+            or instruction.mnemonic.startswith("j")
+        ):
+            count_eliminated(lines, block, current_function, eliminated)
+            block = []
+    count_eliminated(lines, block, current_function, eliminated)
+
+    optimized_lines: List[str] = [line for line in lines if line is not None]
+    return "\n".join(optimized_lines), eliminated
+
+
+def count_eliminated(
+    lines: List[Optional[str]],
+    block: List[Instruction],
+    current_function: Optional[str],
+    eliminated: Dict[str, int],
+) -> None:
+    """Optimize a basic block of a Function and add the count of eliminated instructions to the report."""
+    # Hand-written runtime routines before the first Function are left as is
+    if current_function is None or not block:
+        return
+    removed_count: int = optimize_block(lines, block)
+    if removed_count:
+        eliminated[current_function] = (
+            eliminated.get(current_function, 0) + removed_count
+        )
+
+
+def optimize_block(lines: List[Optional[str]], block: List[Instruction]) -> int:
+    """Apply the peephole rules to a basic block until it does not change. Return the removed count."""
+    original_count: int = len(block)
+    changed: bool = True
+    while changed:
+        changed = (
+            remove_push_pop_pairs(lines, block)
+            or remove_dropped_pushes(lines, block)
+            or remove_dead_movs(lines, block)
+            or propagate_copies(lines, block)
+        )
+    return original_count - len(block)
+
+
+def parse_instruction(line: str, line_number: int) -> Optional[Instruction]:
+    """Parse an instruction from a line of assembly. Return None for non-instruction lines."""
+    if not line.startswith(" "):
+        return None
+    code, _, comment = line.partition(";")
+    code = code.strip()
+    if not code:
+        return None
+    mnemonic, _, operand_string = code.partition(" ")
+    operands: List[str] = [
+        operand.strip() for operand in operand_string.split(",") if operand.strip()
+    ]
+    return Instruction(line_number, mnemonic.lower(), operands, comment.strip())
+
+
+def format_instruction(mnemonic: str, operands: List[str]) -> str:
+    """Return a line of assembly for an instruction"""
+    return f"  {mnemonic} {', '.join(operands)}"
+
+
+def get_register(operand: str) -> Optional[str]:
+    """Return the 64-bit register the operand refers to or None if it is not a register."""
+    return REGISTERS.get(operand.lower())
+
+
+def is_memory(operand: str) -> bool:
+    """Check if the operand is a memory reference"""
+    return "[" in operand
+
+
+def get_operand_reads(operand: str) -> Set[str]:
+    """Return the registers read when the operand is used as a source."""
+    register: Optional[str] = get_register(operand)
+    if register:
+        return {register}
+    return get_address_registers(operand)
+
+
+def get_address_registers(operand: str) -> Set[str]:
+    """Return the registers used in the address calculation of a memory operand."""
+    if not is_memory(operand):
+        return set()
+    address: str = operand[operand.index("[") + 1 : operand.rindex("]")]
+    return {
+        REGISTERS[word]
+        for word in re.findall(r"\w+", address.lower())
+        if word in REGISTERS
+    }
+
+
+def get_destination_effects(operand: str, is_read: bool) -> Tuple[Set[str], Set[str]]:
+    """Return the registers read and written when the operand is a destination."""
+    register: Optional[str] = get_register(operand)
+    if register is None:
+        return get_address_registers(operand), set()
+    # Partial writes keep the rest of the old value so they also read the register
+    if is_read or operand.lower() in PARTIAL_REGISTERS:
+        return {register}, {register}
+    return set(), {register}
+
+
+def get_effects(instruction: Instruction) -> Optional[Effects]:
+    # sourcery skip: low-code-quality
+    """Return the Effects of an instruction or None if the instruction is not understood."""
+    mnemonic: str = instruction.mnemonic
+    operands: List[str] = instruction.operands
+    uses_stack: bool = any("rsp" in operand.lower() for operand in operands) or (
+        mnemonic in {"call", "pop", "push", "ret"}
+    )
+    reads: Set[str] = set()
+    writes: Set[str] = set()
+
+    if mnemonic in {"push", "pop"} and len(operands) == 1:
+        if mnemonic == "push":
+            reads = get_operand_reads(operands[0])
+        else:
+            reads, writes = get_destination_effects(operands[0], is_read=False)
+        return Effects(
+            reads, writes, mnemonic == "pop" and is_memory(operands[0]), True
+        )
+    if mnemonic in {"mul", "div"} and len(operands) == 1:
+        reads = get_operand_reads(operands[0]) | {"rax"}
+        if mnemonic == "div":
+            reads.add("rdx")
+        return Effects(reads, {"rax", "rdx"}, False, uses_stack)
+    if mnemonic in {"cmp", "test"} and len(operands) == 2:
+        reads = get_operand_reads(operands[0]) | get_operand_reads(operands[1])
+        return Effects(reads, writes, False, uses_stack)
+    if len(operands) == 1 and (
+        mnemonic in {"dec", "inc", "neg", "not"} or mnemonic.startswith("set")
+    ):
+        reads, writes = get_destination_effects(
+            operands[0], is_read=not mnemonic.startswith("set")
+        )
+        return Effects(reads, writes, is_memory(operands[0]), uses_stack)
+    if len(operands) == 2 and (
+        mnemonic in {"lea", "mov", "movsx", "movzx"}
+        or mnemonic in READ_MODIFY_WRITE
+        or mnemonic.startswith("cmov")
+    ):
+        destination, source = operands
+        # xor reg, reg only zeroes the register
+        is_read: bool = mnemonic in READ_MODIFY_WRITE or mnemonic.startswith("cmov")
+        if mnemonic in {"sub", "xor"} and destination.lower() == source.lower():
+            is_read = False
+            source = ""
+        reads, writes = get_destination_effects(destination, is_read)
+        if mnemonic == "lea":
+            reads |= get_address_registers(source)
+        elif source:
+            reads |= get_operand_reads(source)
+        return Effects(reads, writes, is_memory(destination), uses_stack)
+    if mnemonic == "imul" and len(operands) == 3:
+        reads, writes = get_destination_effects(operands[0], is_read=False)
+        return Effects(
+            reads | get_operand_reads(operands[1]), writes, False, uses_stack
+        )
+    return None
+
+
+def remove_instruction(
+    lines: List[Optional[str]], block: List[Instruction], index: int
+) -> None:
+    """Remove an instruction from the assembly lines and the basic block"""
+    lines[block[index].line] = None
+    del block[index]
+
+
+def replace_instruction(
+    lines: List[Optional[str]],
+    block: List[Instruction],
+    index: int,
+    mnemonic: str,
+    operands: List[str],
+) -> None:
+    """Replace an instruction in the assembly lines and the basic block"""
+    instruction: Instruction = block[index]
+    instruction.mnemonic = mnemonic
+    instruction.operands = operands
+    lines[instruction.line] = format_instruction(mnemonic, operands)
+
+
+def find_next_stack_op(block: List[Instruction], push_index: int) -> Optional[int]:
+    """Return the index of the next instruction touching the stack after a push."""
+    for index in range(push_index + 1, len(block)):
+        effects: Optional[Effects] = get_effects(block[index])
+        if effects is None:
+            return None
+        if effects.uses_stack:
+            return index
+    return None
+
+
+def is_value_intact(
+    block: List[Instruction], start: int, end: int, operand: str
+) -> bool:
+    """Check if the value of a source operand stays the same between two instructions."""
+    operand_registers: Set[str] = get_operand_reads(operand)
+    for instruction in block[start + 1 : end]:
+        effects: Effects = get_effects(instruction)  # type: ignore
+        if effects.writes & operand_registers or (
+            effects.writes_memory and is_memory(operand)
+        ):
+            return False
+    return True
+
+
+def is_register_unused(
+    block: List[Instruction], start: int, end: int, register: str
+) -> bool:
+    """Check if a register is neither read nor written between two instructions."""
+    for instruction in block[start + 1 : end]:
+        effects: Effects = get_effects(instruction)  # type: ignore
+        if register in effects.reads | effects.writes:
+            return False
+    return True
+
+
+def remove_push_pop_pairs(lines: List[Optional[str]], block: List[Instruction]) -> bool:
+    """
+    Turn a push followed by a pop into a register move or remove the pair if the value is popped back
+    to the same register. Return True if the block was modified.
+    """
+    for push_index, push in enumerate(block):
+        if push.mnemonic != "push" or len(push.operands) != 1:
+            continue
+        pop_index: Optional[int] = find_next_stack_op(block, push_index)
+        if pop_index is None or block[pop_index].mnemonic != "pop":
+            continue
+        pushed: str = push.operands[0]
+        popped: str = block[pop_index].operands[0]
+        # x86-64 does not have memory-to-memory moves or sizeless immediate stores
+        if "rsp" in f"{pushed} {popped}".lower() or (
+            is_memory(popped) and not get_register(pushed)
+        ):
+            continue
+
+        # Move the value when it is popped if the pushed value is still intact
+        if is_value_intact(block, push_index, pop_index, pushed):
+            if get_register(pushed) and pushed.lower() == popped.lower():
+                remove_instruction(lines, block, pop_index)
+            else:
+                replace_instruction(
+                    lines,
+                    block,
+                    pop_index,
+                    "mov",
+                    [popped.replace("qword ", ""), pushed],
+                )
+            remove_instruction(lines, block, push_index)
+            return True
+
+        # Otherwise move the value when it is pushed if the popped register is free until the pop
+        popped_register: Optional[str] = get_register(popped)
+        if (
+            popped_register
+            and popped.lower() not in PARTIAL_REGISTERS
+            and is_register_unused(block, push_index, pop_index, popped_register)
+        ):
+            remove_instruction(lines, block, pop_index)
+            replace_instruction(lines, block, push_index, "mov", [popped, pushed])
+            return True
+    return False
+
+
+def remove_dropped_pushes(lines: List[Optional[str]], block: List[Instruction]) -> bool:
+    """Remove a push and the following stack pointer adjustment dropping the pushed value."""
+    for push_index, push in enumerate(block):
+        if push.mnemonic != "push" or len(push.operands) != 1:
+            continue
+        add_index: Optional[int] = find_next_stack_op(block, push_index)
+        if add_index is None or block[add_index].operands != ["rsp", "8"]:
+            continue
+        if block[add_index].mnemonic != "add":
+            continue
+        remove_instruction(lines, block, add_index)
+        remove_instruction(lines, block, push_index)
+        return True
+    return False
+
+
+def remove_dead_movs(lines: List[Optional[str]], block: List[Instruction]) -> bool:
+    """Remove register moves whose value is overwritten before it is read in the same block."""
+    for mov_index, mov in enumerate(block):
+        if mov.mnemonic != "mov" or len(mov.operands) != 2:
+            continue
+        destination: str = mov.operands[0].lower()
+        register: Optional[str] = get_register(destination)
+        if register is None or destination in PARTIAL_REGISTERS or register == "rsp":
+            continue
+        if destination == mov.operands[1].lower() or is_dead_register(
+            block, mov_index, register
+        ):
+            remove_instruction(lines, block, mov_index)
+            return True
+    return False
+
+
+def is_dead_register(block: List[Instruction], index: int, register: str) -> bool:
+    """Check if the register is overwritten before it is read after the instruction at index."""
+    for instruction in block[index + 1 :]:
+        effects: Optional[Effects] = get_effects(instruction)
+        if effects is None or register in effects.reads:
+            return False
+        if register in effects.writes:
+            return True
+    # The register might be used after the end of the block
+    return False
+
+
+def propagate_copies(lines: List[Optional[str]], block: List[Instruction]) -> bool:
+    """Replace a register copy with the original source of the copied register."""
+    for index, mov in enumerate(block[:-1]):
+        copy_mov: Instruction = block[index + 1]
+        if (
+            mov.mnemonic != "mov"
+            or copy_mov.mnemonic != "mov"
+            or len(copy_mov.operands) != 2
+        ):
+            continue
+        destination, source = mov.operands
+        register: Optional[str] = get_register(destination)
+        copy_register: Optional[str] = get_register(copy_mov.operands[0])
+        if (
+            register is None
+            or copy_register is None
+            or copy_mov.operands[1].lower() != destination.lower()
+            or destination.lower() in PARTIAL_REGISTERS
+            or copy_mov.operands[0].lower() in PARTIAL_REGISTERS
+            or {register, copy_register} & get_operand_reads(source)
+            or copy_register in (register, "rsp")
+        ):
+            continue
+        replace_instruction(
+            lines, block, index + 1, "mov", [copy_mov.operands[0], source]
+        )
+        return True
+    return False
@@ -177,6 +177,13 @@ def get_sub_programs(
     return sub_programs
 
 
+def renumber_program(program: Program) -> Program:
+    """Update the id of every Op to match its index after the Program has been modified"""
+    for op_id, op in enumerate(program):
+        op.id = op_id
+    return program
+
+
 def get_tokens_function(token: Token, functions: Dict[str, Function]) -> Function:
     """Determine the corresponding function for a Token"""
     for func in functions.values():
@@ -0,0 +1,91 @@
+"""
+Splitting of the generated assembly to shards of Functions which are assembled separately
+"""
+import re
+import zlib
+from typing import Dict, List, Set
+from compiler.x86 import strip_comment
+
+IDENTIFIER_REGEX = re.compile(r"[A-Za-z_.$#@~?][\w.$#@~?]*")
+STRING_REGEX = re.compile(r"\"[^\"]*\"|'[^']*'|`[^`]*`")
+LABEL_DEFINITION_REGEX = re.compile(
+    r"^\s*([A-Za-z_$#@~?][\w.$#@~?]*)(?::|\s+(?:db|dw|dd|dq|resb|resw|resd|resq)\b)",
+    re.IGNORECASE,
+)
+
+
+def split_assembly(assembly: str, function_labels: Set[str], shard_count: int) -> List[str]:
+    """
+    Split the assembly to a shard with the data, the reserved memory, the read-only data and the code
+    before the first Function, and shard_count shards of Functions. A Function is placed to a shard
+    by the hash of its label, so editing one Function leaves the other shards unchanged.
+    Every shard has the header of the assembly and declares the labels shared with other shards.
+    """
+    header: List[str] = []
+    sections: Dict[str, List[str]] = {}
+    function_shards: List[List[str]] = [[] for _ in range(shard_count)]
+    current: List[str] = header
+    section: str = ""
+    for line in assembly.split("\n"):
+        words: List[str] = line.split()
+        if len(words) == 2 and words[0] == "section":
+            section = words[1]
+            current = sections.setdefault(section, [])
+            continue
+        if section == ".text" and is_function_start(line, function_labels):
+            label: str = "_start" if line == "global _start" else line[:-1]
+            current = function_shards[zlib.crc32(label.encode()) % shard_count]
+        current.append(line)
+
+    data_shard: str = "\n".join(
+        f"section {name}\n" + "\n".join(lines) for name, lines in sections.items()
+    )
+    shards: List[str] = [data_shard] + [
+        "section .text\n" + "\n".join(lines) for lines in function_shards if lines
+    ]
+    return add_symbol_declarations("\n".join(header), shards)
+
+
+def is_function_start(line: str, function_labels: Set[str]) -> bool:
+    """Check if the line begins the assembly of a Function."""
+    return line == "global _start" or line.endswith(":") and line[:-1] in function_labels
+
+
+def add_symbol_declarations(header: str, shards: List[str]) -> List[str]:
+    """
+    Add the header to the shards and declare the labels referred to from other shards as global
+    and the labels defined in other shards as external.
+    """
+    defined: List[Set[str]] = [get_defined_labels(shard) for shard in shards]
+    referenced: List[Set[str]] = [get_referenced_identifiers(shard) for shard in shards]
+    all_defined: Set[str] = set().union(*defined)
+    declared_shards: List[str] = []
+    for index, shard in enumerate(shards):
+        referenced_elsewhere: Set[str] = set().union(
+            *(identifiers for other, identifiers in enumerate(referenced) if other != index)
+        )
+        globals_: List[str] = sorted(defined[index] & referenced_elsewhere)
+        externs: List[str] = sorted((referenced[index] & all_defined) - defined[index])
+        declarations: str = "".join(f"global {label}\n" for label in globals_)
+        declarations += "".join(f"extern {label}\n" for label in externs)
+        declared_shards.append(f"{header}\n{declarations}{shard}\n")
+    return declared_shards
+
+
+def get_defined_labels(assembly: str) -> Set[str]:
+    """Return the non-local labels defined in the assembly."""
+    labels: Set[str] = set()
+    for line in assembly.split("\n"):
+        match = LABEL_DEFINITION_REGEX.match(strip_comment(line))
+        if match:
+            labels.add(match.group(1))
+    return labels
+
+
+def get_referenced_identifiers(assembly: str) -> Set[str]:
+    """Return the identifiers used in the assembly outside of comments and strings."""
+    identifiers: Set[str] = set()
+    for line in assembly.split("\n"):
+        code: str = STRING_REGEX.sub("", strip_comment(line))
+        identifiers.update(IDENTIFIER_REGEX.findall(code))
+    return identifiers
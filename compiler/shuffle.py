@@ -0,0 +1,204 @@
+"""
+Composition of stack shuffling Intrinsics into a single permutation of the stack
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from compiler.ctfe import get_constant_push_value
+from compiler.defs import CACHE_REGISTERS, Op, OpType, Program, RegisterCache
+
+MAX_CONSTANT_NTH: int = 2**28
+
+# Registers free to hold the shuffled elements between the loads and the stores
+SCRATCH_REGISTERS: List[str] = [
+    "rax",
+    "rbx",
+    "rcx",
+    "rdx",
+    "rsi",
+    "rdi",
+    "r8",
+    "r9",
+    "r10",
+    "r11",
+]
+
+
+@dataclass
+class StackShuffle:
+    """
+    Class for a run of stack shuffling Ops composed into one permutation.
+    The elements are referred to by their depth from the top of the stack before the run.
+
+    last_id:  Index of the last Op of the run
+    consumed: Count of the topmost elements replaced by the run
+    sources:  Depths of the elements which replace the consumed ones, the topmost last
+    """
+
+    last_id: int
+    consumed: int
+    sources: List[int]
+
+
+def get_constant_nth(
+    op: Op, program: Program, constant_values: Dict[str, int]
+) -> Optional[int]:
+    """Return the index of the NTH Intrinsic after a constant push Op or None."""
+    if (
+        op.type != OpType.PUSH_INT
+        or op.id + 1 >= len(program)
+        or not is_shuffle_intrinsic(program[op.id + 1], ["NTH"])
+    ):
+        return None
+    try:
+        nth: int = get_constant_push_value(op, constant_values)
+    except ValueError:
+        return None
+    # The displacement of the addressed load has to fit in 32 bits
+    return nth if 0 < nth < MAX_CONSTANT_NTH else None
+
+
+def is_shuffle_intrinsic(op: Op, intrinsics: List[str]) -> bool:
+    """Check if the Op is one of the Intrinsics."""
+    return op.type == OpType.INTRINSIC and op.token.value.upper() in intrinsics
+
+
+def get_stack_shuffles(
+    program: Program, constant_values: Dict[str, int]
+) -> Dict[int, StackShuffle]:
+    """
+    Compose every run of DUP, DROP, OVER, ROT, SWAP and NTH with a constant index
+    to a single permutation. Return the permutations by the index of the first Op of the run.
+    """
+    shuffles: Dict[int, StackShuffle] = {}
+    op_id: int = 0
+    while op_id < len(program):
+        stack: List[int] = []
+        depth: int = 0
+        first_id: int = op_id
+        while op_id < len(program):
+            op: Op = program[op_id]
+            nth: Optional[int] = get_constant_nth(op, program, constant_values)
+            if nth is not None:
+                op_id += 1
+            elif is_shuffle_intrinsic(op, ["DUP", "DROP"]):
+                nth = 1
+            elif is_shuffle_intrinsic(op, ["OVER", "SWAP"]):
+                nth = 2
+            elif is_shuffle_intrinsic(op, ["ROT"]):
+                nth = 3
+            else:
+                break
+
+            # Elements below the ones already shuffled come from the original stack
+            while len(stack) < nth:
+                stack.insert(0, depth)
+                depth += 1
+            intrinsic: str = op.token.value.upper()
+            if intrinsic == "DROP":
+                stack.pop()
+            elif intrinsic == "ROT":
+                stack.append(stack.pop(-3))
+            elif intrinsic == "SWAP":
+                stack[-2:] = stack[:-3:-1]
+            else:
+                stack.append(stack[-nth])
+            op_id += 1
+
+        # Elements at the bottom of the run which stay in place are not consumed
+        while stack and stack[0] == depth - 1:
+            stack.pop(0)
+            depth -= 1
+        if op_id > first_id:
+            shuffles[first_id] = StackShuffle(op_id - 1, depth, stack)
+        else:
+            op_id += 1
+    return shuffles
+
+
+def get_stack_address(depth: int) -> str:
+    """Return the memory operand of the element at the depth from the top of the stack."""
+    return f"[rsp+{depth * 8}]" if depth > 0 else "[rsp]"
+
+
+def get_shuffle_asm(shuffle: StackShuffle) -> Optional[str]:
+    """
+    Generate assembly for the stack permutation with the stack in memory.
+    Only the elements which change their place are moved.
+    Return None if the permutation moves more elements than there are scratch registers.
+    """
+    # The element at index i from the bottom of the result ends up at the depth of
+    # consumed - 1 - i from the top of the stack before the permutation
+    moves: Dict[int, int] = {
+        shuffle.consumed - 1 - index: source
+        for index, source in enumerate(shuffle.sources)
+        if source != shuffle.consumed - 1 - index
+    }
+    pushed: int = len(shuffle.sources) - shuffle.consumed
+    if len(moves) == 1 and pushed == 1 and -1 in moves:
+        return f"  push qword {get_stack_address(moves[-1])}\n"
+
+    loaded: Dict[int, str] = {}
+    for source in moves.values():
+        if source not in loaded:
+            if len(loaded) == len(SCRATCH_REGISTERS):
+                return None
+            loaded[source] = SCRATCH_REGISTERS[len(loaded)]
+    op_asm: str = "".join(
+        f"  mov {register}, {get_stack_address(source)}\n" for source, register in loaded.items()
+    )
+    if pushed > 0:
+        op_asm += f"  sub rsp, {pushed * 8}\n"
+    elif pushed < 0:
+        op_asm += f"  add rsp, {-pushed * 8}\n"
+    for target, source in sorted(moves.items()):
+        op_asm += f"  mov {get_stack_address(target + pushed)}, {loaded[source]}\n"
+    return op_asm
+
+
+def get_cached_shuffle_asm(shuffle: StackShuffle, cache: RegisterCache) -> Optional[str]:
+    """
+    Generate assembly for the stack permutation with the topmost elements in the cache registers.
+    The consumed elements in registers are renamed and the rest of the elements are copied.
+    Return None if the result of the permutation does not fit in the cache registers.
+    """
+    result_count: int = len(shuffle.sources)
+    if result_count > len(CACHE_REGISTERS):
+        return None
+    cached_count: int = len(cache.registers)
+    kept_count: int = max(cached_count - shuffle.consumed, 0)
+    op_asm: str = ""
+    while kept_count + result_count > len(CACHE_REGISTERS):
+        op_asm += f"  push {cache.registers.pop(0)}\n"
+        kept_count -= 1
+        cached_count -= 1
+
+    def get_location(depth: int) -> str:
+        if depth < cached_count:
+            return cache.top(depth + 1)
+        return get_stack_address(depth - cached_count)
+
+    # The first use of a consumed register keeps the register
+    kept: List[str] = cache.registers[:kept_count]
+    renamed: Dict[int, str] = {}
+    for source in shuffle.sources:
+        if source < min(shuffle.consumed, cached_count) and source not in renamed:
+            renamed[source] = get_location(source)
+    free: List[str] = [
+        register
+        for register in CACHE_REGISTERS
+        if register not in kept and register not in renamed.values()
+    ]
+    results: List[str] = []
+    for source in shuffle.sources:
+        if source in renamed and renamed[source] not in results:
+            results.append(renamed[source])
+            continue
+        register: str = free.pop(0)
+        op_asm += f"  mov {register}, {get_location(source)}\n"
+        results.append(register)
+
+    # The consumed elements in memory are dropped after they are read
+    if shuffle.consumed > cached_count:
+        op_asm += f"  add rsp, {(shuffle.consumed - cached_count) * 8}\n"
+    cache.registers = kept + results
+    return op_asm
@@ -0,0 +1,483 @@
+"""
+Lowering of the stack based sub-programs to an SSA form, three-address IR with basic blocks
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.defs import Op, OpType, Program, Signature
+
+# Intrinsics lowered to a single instruction: opcode and count of popped and pushed values
+INTRINSIC_INSTRUCTIONS: Dict[str, Tuple[str, int, int]] = {
+    "AND": ("and", 2, 1),
+    "ARGC": ("argc", 0, 1),
+    "ARGV": ("argv", 0, 1),
+    "DIVMOD": ("divmod", 2, 2),
+    "ENVP": ("envp", 0, 1),
+    "EQ": ("eq", 2, 1),
+    "GE": ("ge", 2, 1),
+    "GT": ("gt", 2, 1),
+    "LE": ("le", 2, 1),
+    "LOAD_BYTE": ("load_byte", 1, 1),
+    "LOAD_DWORD": ("load_dword", 1, 1),
+    "LOAD_QWORD": ("load_qword", 1, 1),
+    "LOAD_WORD": ("load_word", 1, 1),
+    "LT": ("lt", 2, 1),
+    "MINUS": ("sub", 2, 1),
+    "MUL": ("imul", 2, 1),
+    "NE": ("ne", 2, 1),
+    "OR": ("or", 2, 1),
+    "PLUS": ("add", 2, 1),
+    "PRINT": ("print", 1, 0),
+    "STORE_BYTE": ("store_byte", 2, 0),
+    "STORE_DWORD": ("store_dword", 2, 0),
+    "STORE_QWORD": ("store_qword", 2, 0),
+    "STORE_WORD": ("store_word", 2, 0),
+    "SYSCALL0": ("syscall", 1, 1),
+    "SYSCALL1": ("syscall", 2, 1),
+    "SYSCALL2": ("syscall", 3, 1),
+    "SYSCALL3": ("syscall", 4, 1),
+    "SYSCALL4": ("syscall", 5, 1),
+    "SYSCALL5": ("syscall", 6, 1),
+    "SYSCALL6": ("syscall", 7, 1),
+}
+
+# Instructions after which no register keeps its value
+CLOBBERING_OPCODES: Set[str] = {"call", "print", "syscall"}
+
+NO_OP_TYPES: Set[OpType] = {
+    OpType.CAST_BOOL,
+    OpType.CAST_CHAR,
+    OpType.CAST_INT,
+    OpType.CAST_PTR,
+    OpType.CAST_STR,
+    OpType.CAST_UINT8,
+    OpType.IN,
+    OpType.PEEK,
+    OpType.TAKE,
+}
+
+
+class SsaLoweringError(Exception):
+    """Raised when a sub-program cannot be lowered to the SSA form"""
+
+
+@dataclass
+class Instruction:
+    """
+    Three-address instruction of the SSA form.
+
+    opcode:    Operation like 'add', 'const' or 'call'
+    results:   Values defined by the instruction
+    operands:  Values used by the instruction, the topmost stack element is the last
+    immediate: Constant, label or the name of the called Function
+    """
+
+    opcode: str
+    results: List[int]
+    operands: List[int]
+    immediate: str = ""
+
+    def __str__(self) -> str:
+        results: str = ", ".join(f"v{value}" for value in self.results)
+        operands: str = ", ".join(
+            [f"v{value}" for value in self.operands] + ([self.immediate] if self.immediate else [])
+        )
+        return f"{results + ' = ' if results else ''}{self.opcode} {operands}".rstrip()
+
+
+@dataclass
+class StackState:
+    """Values on the stack and the values of the bindings at a point of the sub-program"""
+
+    stack: List[int]
+    bindings: Dict[str, int]
+
+    def copy(self) -> StackState:
+        """Return a copy of the state which can be modified independently"""
+        return StackState(list(self.stack), dict(self.bindings))
+
+
+@dataclass
+class Edge:
+    """Control flow edge to a block with the state which is passed to the parameters of the block"""
+
+    target: BasicBlock
+    state: StackState
+
+    def get_arguments(self) -> List[int]:
+        """Return the values passed to the parameters of the target block."""
+        return self.state.stack + [
+            self.state.bindings[name] for name in self.target.binding_params
+        ]
+
+
+@dataclass
+class Terminator:
+    """
+    Last instruction of a basic block.
+
+    kind:     'jump', 'branch' or 'return'
+    operands: Condition of a branch or the returned values
+    edges:    Jump target, or the targets of a branch when the condition is true and false
+    """
+
+    kind: str
+    operands: List[int]
+    edges: List[Edge] = field(default_factory=list)
+
+
+@dataclass
+class BasicBlock:
+    """
+    Straight-line sequence of instructions.
+    The values of the parameters are passed by the edges to the block like phi functions.
+    """
+
+    index: int
+    stack_params: List[int] = field(default_factory=list)
+    binding_params: Dict[str, int] = field(default_factory=dict)
+    instructions: List[Instruction] = field(default_factory=list)
+    terminator: Optional[Terminator] = None
+
+    def get_params(self) -> List[int]:
+        """Return the values defined at the beginning of the block."""
+        return self.stack_params + list(self.binding_params.values())
+
+    def get_successors(self) -> List[BasicBlock]:
+        """Return the blocks the control flow continues to."""
+        return [] if self.terminator is None else [edge.target for edge in self.terminator.edges]
+
+
+@dataclass
+class SsaFunction:
+    """Function lowered to the SSA form. The first block is the entry block."""
+
+    name: str
+    blocks: List[BasicBlock]
+    value_count: int
+
+    def __str__(self) -> str:
+        lines: List[str] = [f"function {self.name}:"]
+        for block in self.blocks:
+            params: str = ", ".join(f"v{value}" for value in block.get_params())
+            lines.append(f"  b{block.index}({params}):")
+            lines += [f"    {instruction}" for instruction in block.instructions]
+            if block.terminator is not None:
+                targets: List[str] = [
+                    f"b{edge.target.index}({', '.join(f'v{value}' for value in edge.get_arguments())})"
+                    for edge in block.terminator.edges
+                ]
+                operands: List[str] = [f"v{value}" for value in block.terminator.operands]
+                lines.append(f"    {block.terminator.kind} {', '.join(operands + targets)}")
+        return "\n".join(lines)
+
+
+class SsaBuilder:
+    """
+    Lower a sub-program by tracking which value each stack slot holds, like the type checker
+    tracks the type and the origin of each slot. Control flow joins get block parameters.
+    The origins of the type checker cannot be reused: they are Token locations which are the same
+    for every value pushed by an Op in a loop, and they describe the sub-program before the IR passes.
+    """
+
+    def __init__(self, program: Program, signatures: Dict[str, Signature]) -> None:
+        self.program: Program = program
+        self.signatures: Dict[str, Signature] = signatures
+        self.blocks: List[BasicBlock] = []
+        self.value_count: int = 0
+        self.block: BasicBlock = self.new_block()
+        self.state: Optional[StackState] = StackState([], {})
+        # Loop headers and exits for CONTINUE and BREAK
+        self.loops: List[Tuple[BasicBlock, BasicBlock]] = []
+
+    def new_value(self) -> int:
+        """Return a new SSA value."""
+        self.value_count += 1
+        return self.value_count - 1
+
+    def new_block(self) -> BasicBlock:
+        """Create an empty basic block."""
+        block: BasicBlock = BasicBlock(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def new_join_block(self, state: Optional[StackState]) -> Tuple[BasicBlock, Optional[StackState]]:
+        """Create a block with a parameter for each stack slot and binding of the state."""
+        block: BasicBlock = self.new_block()
+        if state is None:
+            return block, None
+        block.stack_params = [self.new_value() for _ in state.stack]
+        block.binding_params = {name: self.new_value() for name in state.bindings}
+        return block, StackState(list(block.stack_params), dict(block.binding_params))
+
+    def jump(self, target: BasicBlock) -> None:
+        """End the current block with a jump to the target block."""
+        if self.state is None:
+            return
+        self.check_edge(target, self.state)
+        self.block.terminator = Terminator("jump", [], [Edge(target, self.state.copy())])
+
+    def emit(self, opcode: str, popped: int, pushed: int, immediate: str = "") -> List[int]:
+        """Append an instruction which pops its operands from and pushes its results to the stack."""
+        operands: List[int] = self.pop(popped)
+        results: List[int] = [self.new_value() for _ in range(pushed)]
+        self.block.instructions.append(Instruction(opcode, results, operands, immediate))
+        self.push(results)
+        return results
+
+    def pop(self, count: int) -> List[int]:
+        """Pop values from the stack, the topmost value is the last."""
+        assert self.state is not None
+        if count > len(self.state.stack):
+            raise SsaLoweringError("Stack underflow")
+        if count == 0:
+            return []
+        values: List[int] = self.state.stack[-count:]
+        del self.state.stack[-count:]
+        return values
+
+    def push(self, values: List[int]) -> None:
+        """Push values to the stack, the last value ends up on top."""
+        assert self.state is not None
+        self.state.stack += values
+
+    @staticmethod
+    def check_edge(target: BasicBlock, state: StackState) -> None:
+        """Check that the state has a value for every parameter of the target block."""
+        if len(state.stack) != len(target.stack_params) or any(
+            name not in state.bindings for name in target.binding_params
+        ):
+            raise SsaLoweringError("Stack layouts differ at a control flow join")
+
+    def lower(self, param_count: int) -> SsaFunction:
+        """Lower the whole sub-program."""
+        # Parameters are popped from the stack with the topmost first
+        params: List[int] = [self.new_value() for _ in range(param_count)]
+        self.block.instructions = [
+            Instruction("param", [value], [], str(index)) for index, value in enumerate(params)
+        ]
+        self.push(list(reversed(params)))
+
+        self.lower_sequence(0, set())
+        if self.state is not None:
+            self.block.terminator = Terminator("return", list(self.state.stack))
+        return SsaFunction(self.program[0].func.name, self.get_reachable_blocks(), self.value_count)
+
+    def get_reachable_blocks(self) -> List[BasicBlock]:
+        """Return the blocks reachable from the entry block in the order of creation."""
+        reachable: Set[int] = set()
+        unvisited: List[BasicBlock] = [self.blocks[0]]
+        while unvisited:
+            block: BasicBlock = unvisited.pop()
+            if block.index not in reachable:
+                reachable.add(block.index)
+                unvisited += block.get_successors()
+        return [block for block in self.blocks if block.index in reachable]
+
+    def lower_sequence(self, op_id: int, end_types: Set[OpType]) -> int:
+        """Lower Ops until one of the end types at the current nesting level. Return the index of it."""
+        while op_id < len(self.program):
+            op: Op = self.program[op_id]
+            if op.type in end_types:
+                return op_id
+            if op.type == OpType.IF:
+                op_id = self.lower_if(op_id)
+            elif op.type == OpType.WHILE:
+                op_id = self.lower_while(op_id)
+            else:
+                self.lower_op(op)
+                op_id += 1
+        if end_types:
+            raise SsaLoweringError("Unterminated block")
+        return op_id
+
+    def lower_if(self, op_id: int) -> int:
+        """Lower IF ... DO ... [ELIF ... DO ...] [ELSE ...] ENDIF. Return the index after ENDIF."""
+        incoming: List[Tuple[BasicBlock, StackState]] = []
+        op_id = self.lower_sequence(op_id + 1, {OpType.DO})
+        while True:
+            then_block: BasicBlock = self.new_block()
+            else_block: BasicBlock = self.new_block()
+            else_state: Optional[StackState] = None
+            if self.state is not None:
+                condition: List[int] = self.pop(1)
+                else_state = self.state.copy()
+                self.block.terminator = Terminator(
+                    "branch",
+                    condition,
+                    [Edge(then_block, StackState([], {})), Edge(else_block, StackState([], {}))],
+                )
+            self.block = then_block
+            op_id = self.lower_sequence(op_id + 1, {OpType.ELIF, OpType.ELSE, OpType.ENDIF})
+            if self.state is not None:
+                incoming.append((self.block, self.state))
+            self.block, self.state = else_block, else_state
+
+            if self.program[op_id].type == OpType.ELIF:
+                op_id = self.lower_sequence(op_id + 1, {OpType.DO})
+                continue
+            if self.program[op_id].type == OpType.ELSE:
+                op_id = self.lower_sequence(op_id + 1, {OpType.ENDIF})
+            if self.state is not None:
+                incoming.append((self.block, self.state))
+            break
+
+        # Join the branches which did not return, break or continue
+        if len(incoming) == 1:
+            self.block, self.state = incoming[0]
+            return op_id + 1
+        if not incoming:
+            self.block, self.state = self.new_block(), None
+            return op_id + 1
+        first_state: StackState = incoming[0][1]
+        join_state: StackState = StackState(
+            first_state.stack,
+            {
+                name: value
+                for name, value in first_state.bindings.items()
+                if all(name in state.bindings for _, state in incoming)
+            },
+        )
+        join_block, self.state = self.new_join_block(join_state)
+        for block, state in incoming:
+            self.check_edge(join_block, state)
+            block.terminator = Terminator("jump", [], [Edge(join_block, state)])
+        self.block = join_block
+        return op_id + 1
+
+    def lower_while(self, op_id: int) -> int:
+        """Lower WHILE ... DO ... DONE. Return the index after DONE."""
+        header, header_state = self.new_join_block(self.state)
+        self.jump(header)
+        self.block, self.state = header, header_state
+        op_id = self.lower_sequence(op_id + 1, {OpType.DO})
+
+        body: BasicBlock = self.new_block()
+        condition: List[int] = self.pop(1) if self.state is not None else []
+        exit_block, exit_state = self.new_join_block(self.state)
+        if self.state is not None:
+            self.block.terminator = Terminator(
+                "branch",
+                condition,
+                [Edge(body, StackState([], {})), Edge(exit_block, self.state.copy())],
+            )
+        self.block = body
+        self.loops.append((header, exit_block))
+        op_id = self.lower_sequence(op_id + 1, {OpType.DONE})
+        self.jump(header)
+        self.loops.pop()
+        self.block, self.state = exit_block, exit_state
+        return op_id + 1
+
+    def lower_op(self, op: Op) -> None:
+        # sourcery skip: low-code-quality
+        """Lower a single Op which does not start a block."""
+        if self.state is None or op.type in NO_OP_TYPES:
+            return
+        if op.type in (OpType.PUSH_BOOL, OpType.PUSH_CHAR, OpType.PUSH_INT, OpType.PUSH_UINT8):
+            self.emit("const", 0, 1, get_constant_immediate(op))
+        elif op.type == OpType.PUSH_PTR:
+            self.emit("address", 0, 1, op.token.value)
+        elif op.type == OpType.PUSH_STR:
+            self.emit("string", 0, 1, op.token.value)
+        elif op.type == OpType.PUSH_BIND:
+            if op.token.value not in self.state.bindings:
+                raise SsaLoweringError(f"Binding '{op.token.value}' is not defined in every path")
+            self.push([self.state.bindings[op.token.value]])
+        elif op.type == OpType.POP_BIND:
+            self.state.bindings[op.token.value] = self.pop(1)[0]
+        elif op.type == OpType.PEEK_BIND:
+            depth: int = get_peek_depth(op, self.program)
+            if depth > len(self.state.stack):
+                raise SsaLoweringError("PEEK beyond the stack")
+            self.state.bindings[op.token.value] = self.state.stack[-depth]
+        elif op.type == OpType.ASSIGN_BIND:
+            new_value, _old_value = self.pop(2)
+            self.state.bindings[self.program[op.id - 1].token.value] = new_value
+        elif op.type == OpType.INTRINSIC:
+            self.lower_intrinsic(op)
+        elif op.type == OpType.FUNCTION_CALL:
+            if op.token.value not in self.signatures:
+                raise SsaLoweringError(f"Signature of '{op.token.value}' is unknown")
+            param_types, return_types = self.signatures[op.token.value]
+            self.emit("call", len(param_types), len(return_types), op.token.value)
+        elif op.type == OpType.RETURN:
+            values: List[int] = list(self.state.stack)
+            if op.func.name.upper() == "MAIN":
+                # Exit code of the program
+                values = self.emit("const", 0, 1, "0")
+            self.block.terminator = Terminator("return", values)
+            self.state = None
+        elif op.type in (OpType.BREAK, OpType.CONTINUE):
+            if not self.loops:
+                raise SsaLoweringError(f"{op.type.name} outside of a loop")
+            header, exit_block = self.loops[-1]
+            self.jump(exit_block if op.type == OpType.BREAK else header)
+            self.state = None
+        else:
+            raise SsaLoweringError(f"{op.type.name} cannot be lowered")
+
+    def lower_intrinsic(self, op: Op) -> None:
+        """Lower an Intrinsic to stack shuffling or to an instruction."""
+        assert self.state is not None
+        intrinsic: str = op.token.value.upper()
+        if intrinsic == "DROP":
+            self.pop(1)
+        elif intrinsic == "DUP":
+            self.push(self.pop(1) * 2)
+        elif intrinsic == "SWAP":
+            self.push(list(reversed(self.pop(2))))
+        elif intrinsic == "OVER":
+            a, b = self.pop(2)
+            self.push([a, b, a])
+        elif intrinsic == "ROT":
+            a, b, c = self.pop(3)
+            self.push([b, c, a])
+        elif intrinsic == "NTH":
+            nth: Optional[int] = self.get_constant(self.pop(1)[0])
+            if nth is None or not 0 < nth <= len(self.state.stack):
+                raise SsaLoweringError("NTH with a runtime operand")
+            self.push([self.state.stack[-nth]])
+        elif intrinsic in INTRINSIC_INSTRUCTIONS:
+            opcode, popped, pushed = INTRINSIC_INSTRUCTIONS[intrinsic]
+            self.emit(opcode, popped, pushed)
+        else:
+            raise SsaLoweringError(f"Intrinsic '{intrinsic}' cannot be lowered")
+
+    def get_constant(self, value: int) -> Optional[int]:
+        """Return the integer a value is defined as in the current block or None."""
+        for instruction in self.block.instructions:
+            if instruction.opcode == "const" and instruction.results == [value]:
+                try:
+                    return int(instruction.immediate)
+                except ValueError:
+                    return None
+        return None
+
+
+def get_peek_depth(op: Op, program: Program) -> int:
+    """Return the position of the value bound by PEEK_BIND from the top, the first PEEK_BIND binds the topmost."""
+    depth: int = 1
+    while program[op.id - depth].type == OpType.PEEK_BIND:
+        depth += 1
+    return depth
+
+
+def get_constant_immediate(op: Op) -> str:
+    """Return the immediate value pushed to the stack by a constant push Op."""
+    if op.type == OpType.PUSH_BOOL:
+        return "1" if op.token.value.upper() == "TRUE" else "0"
+    if op.type == OpType.PUSH_CHAR:
+        return str(ord(op.token.value[1]))
+    return op.token.value
+
+
+def lower_to_ssa(program: Program, signatures: Dict[str, Signature]) -> Optional[SsaFunction]:
+    """Lower a sub-program to the SSA form. Return None if the sub-program uses unsupported Ops."""
+    if not program:
+        return None
+    param_count: int = len(program[0].func.signature[0])
+    try:
+        return SsaBuilder(program, signatures).lower(param_count)
+    except SsaLoweringError:
+        return None
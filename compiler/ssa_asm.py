@@ -0,0 +1,487 @@
+"""
+Linear scan register allocation and x86-64 code generation for the SSA form
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.asm import (
+    get_frame_enter_asm,
+    get_frame_leave_asm,
+    get_output_flush_asm,
+    get_valid_label_for_nasm,
+    is_tail_call,
+)
+from compiler.defs import Function, Program, Signature
+from compiler.ssa import (
+    CLOBBERING_OPCODES,
+    BasicBlock,
+    Edge,
+    Instruction,
+    SsaFunction,
+    lower_to_ssa,
+)
+from compiler.utils import get_string_label, print_if_verbose
+
+# Registers available for the SSA values. RAX and RDX are used by the instructions,
+# R15 is the frame pointer and RBP may hold the return address.
+ALLOCATABLE_REGISTERS: List[str] = [
+    "rbx",
+    "rcx",
+    "rsi",
+    "rdi",
+    "r8",
+    "r9",
+    "r10",
+    "r11",
+    "r12",
+    "r13",
+    "r14",
+]
+
+ARITHMETIC_INSTRUCTIONS: Dict[str, str] = {
+    "add": "add",
+    "and": "and",
+    "imul": "imul",
+    "or": "or",
+    "sub": "sub",
+}
+
+CONDITION_CODES: Dict[str, str] = {
+    "eq": "e",
+    "ge": "ge",
+    "gt": "g",
+    "le": "le",
+    "lt": "l",
+    "ne": "ne",
+}
+
+INVERTED_CONDITION_CODES: Dict[str, str] = {
+    "e": "ne",
+    "ge": "l",
+    "g": "le",
+    "le": "g",
+    "l": "ge",
+    "ne": "e",
+}
+
+LOAD_INSTRUCTIONS: Dict[str, str] = {
+    "load_byte": "  movzx eax, byte [rax]\n",
+    "load_dword": "  mov eax, dword [rax]\n",
+    "load_qword": "  mov rax, qword [rax]\n",
+    "load_word": "  movzx eax, word [rax]\n",
+}
+
+STORE_REGISTERS: Dict[str, str] = {
+    "store_byte": "dl",
+    "store_dword": "edx",
+    "store_qword": "rdx",
+    "store_word": "dx",
+}
+
+SYSCALL_REGISTERS: List[str] = ["rax", "rdi", "rsi", "rdx", "r10", "r8", "r9"]
+
+
+@dataclass
+class Interval:
+    """Positions from the definition of a value to its last use"""
+
+    value: int
+    start: int
+    end: int
+
+    def overlaps(self, other: "Interval") -> bool:
+        """Check if the intervals share a position."""
+        return self.start <= other.end and other.start <= self.end
+
+
+def generate_ssa_asm(
+    sub_programs: Dict[str, Program],
+    tail_calls: bool,
+    is_verbose: bool,
+    signatures: Optional[Dict[str, Signature]] = None,
+) -> Dict[str, str]:
+    """
+    Lower the sub-programs to the SSA form and generate the body of each Function from it.
+    Sub-programs which cannot be lowered are left to the stack based code generation.
+    The signatures of the called Functions are taken from the sub-programs by default.
+    """
+    if signatures is None:
+        signatures = {
+            name: program[0].func.signature
+            for name, program in sub_programs.items()
+            if program
+        }
+    ssa_bodies: Dict[str, str] = {}
+    for name, program in sub_programs.items():
+        # Tail calls keep the deep recursions from growing the stacks
+        if tail_calls and any(is_tail_call(op, program) for op in program):
+            continue
+        ssa_function: Optional[SsaFunction] = lower_to_ssa(program, signatures)
+        if ssa_function is None:
+            print_if_verbose(f"Generating '{name}' without SSA", is_verbose)
+            continue
+        print_if_verbose(
+            f"Lowered '{name}' to SSA with {len(ssa_function.blocks)} basic blocks",
+            is_verbose,
+        )
+        ssa_bodies[name] = get_ssa_function_asm(ssa_function, program)
+    return ssa_bodies
+
+
+def get_ssa_function_asm(ssa_function: SsaFunction, program: Program) -> str:
+    """Allocate the registers and generate the assembly of the Function body."""
+    locations, slot_count = allocate_registers(ssa_function)
+    label: str = get_valid_label_for_nasm(ssa_function.name)
+    func: Function = program[0].func
+    emitter: SsaEmitter = SsaEmitter(ssa_function, locations, label)
+    assembly: str = get_frame_enter_asm(func, slot_count)
+    assembly += emitter.get_asm()
+    assembly += f"{label}_ssa_end:\n"
+    assembly += get_frame_leave_asm(func, slot_count)
+    return assembly
+
+
+def get_intervals(ssa_function: SsaFunction) -> Tuple[List[Interval], List[int]]:
+    """
+    Number the instructions and compute the live interval of each value with the liveness
+    of the blocks. Return the intervals and the positions of the clobbering instructions.
+    """
+    live_in: Dict[int, Set[int]] = get_live_in_sets(ssa_function)
+    starts: Dict[int, int] = {}
+    ends: Dict[int, int] = {}
+    clobbers: List[int] = []
+
+    def extend(value: int, position: int) -> None:
+        starts[value] = min(starts.get(value, position), position)
+        ends[value] = max(ends.get(value, position), position)
+
+    position: int = 0
+    for block in ssa_function.blocks:
+        block_start: int = position
+        for value in block.get_params() + list(live_in[block.index]):
+            extend(value, block_start)
+        for instruction in block.instructions:
+            position += 1
+            if instruction.opcode in CLOBBERING_OPCODES:
+                clobbers.append(position)
+            for value in instruction.operands + instruction.results:
+                extend(value, position)
+        position += 1
+        assert block.terminator is not None
+        for value in block.terminator.operands + get_edge_arguments(block):
+            extend(value, position)
+        for successor in block.get_successors():
+            for value in live_in[successor.index]:
+                extend(value, position)
+        position += 1
+
+    intervals: List[Interval] = [
+        Interval(value, start, ends[value]) for value, start in starts.items()
+    ]
+    return sorted(intervals, key=lambda interval: interval.start), clobbers
+
+
+def get_edge_arguments(block: BasicBlock) -> List[int]:
+    """Return the values the block passes to the parameters of its successors."""
+    if block.terminator is None:
+        return []
+    return [value for edge in block.terminator.edges for value in edge.get_arguments()]
+
+
+def get_live_in_sets(ssa_function: SsaFunction) -> Dict[int, Set[int]]:
+    """Return the values live at the beginning of each block, excluding the block parameters."""
+    uses: Dict[int, Set[int]] = {}
+    definitions: Dict[int, Set[int]] = {}
+    for block in ssa_function.blocks:
+        defined: Set[int] = set(block.get_params())
+        used: Set[int] = set()
+        for instruction in block.instructions:
+            used |= set(instruction.operands) - defined
+            defined |= set(instruction.results)
+        assert block.terminator is not None
+        used |= set(block.terminator.operands + get_edge_arguments(block)) - defined
+        uses[block.index] = used
+        definitions[block.index] = defined
+
+    live_in: Dict[int, Set[int]] = {block.index: set() for block in ssa_function.blocks}
+    is_changed: bool = True
+    while is_changed:
+        is_changed = False
+        for block in reversed(ssa_function.blocks):
+            live_out: Set[int] = set()
+            for successor in block.get_successors():
+                live_out |= live_in[successor.index]
+            block_live_in: Set[int] = uses[block.index] | (live_out - definitions[block.index])
+            if block_live_in != live_in[block.index]:
+                live_in[block.index] = block_live_in
+                is_changed = True
+    return live_in
+
+
+def allocate_registers(ssa_function: SsaFunction) -> Tuple[Dict[int, str], int]:
+    """
+    Assign a register or a spill slot in the frame to each value with linear scan.
+    Values live across calls and syscalls are always spilled.
+    Return the locations of the values and the count of spill slots.
+    """
+    intervals, clobbers = get_intervals(ssa_function)
+    locations: Dict[int, str] = {}
+    slots: List[List[Interval]] = []
+    active: List[Interval] = []
+    free_registers: List[str] = list(ALLOCATABLE_REGISTERS)
+
+    def spill(interval: Interval) -> None:
+        for slot_index, occupants in enumerate(slots):
+            if not any(interval.overlaps(occupant) for occupant in occupants):
+                occupants.append(interval)
+                break
+        else:
+            slot_index = len(slots)
+            slots.append([interval])
+        locations[interval.value] = f"qword [r15+{8 * slot_index}]"
+
+    for interval in intervals:
+        for expired in [other for other in active if other.end < interval.start]:
+            active.remove(expired)
+            free_registers.append(locations[expired.value])
+
+        if any(interval.start < clobber < interval.end for clobber in clobbers):
+            spill(interval)
+        elif free_registers:
+            locations[interval.value] = free_registers.pop(0)
+            active.append(interval)
+        else:
+            # Spill the value which is used furthest in the future
+            furthest: Interval = max(active, key=lambda other: other.end)
+            if furthest.end > interval.end:
+                locations[interval.value] = locations[furthest.value]
+                active.remove(furthest)
+                active.append(interval)
+                spill(furthest)
+            else:
+                spill(interval)
+    return locations, len(slots)
+
+
+def is_register(location: str) -> bool:
+    """Check if the location is a register instead of a spill slot."""
+    return not location.startswith("qword")
+
+
+def get_move_asm(destination: str, source: str) -> str:
+    """Move a value between two locations. RDX is used for moves between spill slots."""
+    if destination == source:
+        return ""
+    if not is_register(destination) and not is_register(source):
+        return f"  mov rdx, {source}\n  mov {destination}, rdx\n"
+    return f"  mov {destination}, {source}\n"
+
+
+def get_parallel_move_asm(moves: List[Tuple[str, str]]) -> str:
+    """Move the sources to the destinations at once. Cycles are broken with RAX."""
+    pending: List[Tuple[str, str]] = [
+        (destination, source) for destination, source in moves if destination != source
+    ]
+    assembly: str = ""
+    while pending:
+        sources: List[str] = [source for _, source in pending]
+        ready: Optional[Tuple[str, str]] = next(
+            (move for move in pending if move[0] not in sources), None
+        )
+        if ready is not None:
+            assembly += get_move_asm(*ready)
+            pending.remove(ready)
+            continue
+        # Every destination is still read by another move
+        cycle_destination: str = pending[0][0]
+        assembly += f"  mov rax, {cycle_destination}\n"
+        pending = [
+            (destination, "rax" if source == cycle_destination else source)
+            for destination, source in pending
+        ]
+    return assembly
+
+
+class SsaEmitter:
+    """Generate the assembly of a Function in the SSA form with allocated locations"""
+
+    def __init__(
+        self, ssa_function: SsaFunction, locations: Dict[int, str], label: str
+    ) -> None:
+        self.ssa_function: SsaFunction = ssa_function
+        self.locations: Dict[int, str] = locations
+        self.label: str = label
+        self.use_counts: Dict[int, int] = {}
+        for block in ssa_function.blocks:
+            for instruction in block.instructions:
+                for value in instruction.operands:
+                    self.use_counts[value] = self.use_counts.get(value, 0) + 1
+            assert block.terminator is not None
+            for value in block.terminator.operands + get_edge_arguments(block):
+                self.use_counts[value] = self.use_counts.get(value, 0) + 1
+
+    def get_block_label(self, block: BasicBlock) -> str:
+        """Return the label of a basic block."""
+        return f"{self.label}_ssa_b{block.index}"
+
+    def get_asm(self) -> str:
+        """Return the assembly of every block."""
+        assembly: str = ""
+        blocks: List[BasicBlock] = self.ssa_function.blocks
+        for block_index, block in enumerate(blocks):
+            next_block: Optional[BasicBlock] = (
+                blocks[block_index + 1] if block_index + 1 < len(blocks) else None
+            )
+            assembly += f"{self.get_block_label(block)}:\n"
+            instructions: List[Instruction] = block.instructions
+            fused: Optional[Instruction] = self.get_fused_comparison(block)
+            if fused is not None:
+                instructions = instructions[:-1]
+            for instruction in instructions:
+                assembly += self.get_instruction_asm(instruction)
+            assembly += self.get_terminator_asm(block, next_block, fused)
+        return assembly
+
+    def get_fused_comparison(self, block: BasicBlock) -> Optional[Instruction]:
+        """Return the comparison whose result is only used by the branch ending the block."""
+        assert block.terminator is not None
+        if block.terminator.kind != "branch" or not block.instructions:
+            return None
+        last: Instruction = block.instructions[-1]
+        condition: int = block.terminator.operands[0]
+        if (
+            last.opcode in CONDITION_CODES
+            and last.results == [condition]
+            and self.use_counts.get(condition) == 1
+        ):
+            return last
+        return None
+
+    def loc(self, value: int) -> str:
+        """Return the location of a value."""
+        return self.locations[value]
+
+    def get_instruction_asm(self, instruction: Instruction) -> str:
+        # sourcery skip: low-code-quality
+        """Generate the assembly of a single instruction."""
+        opcode: str = instruction.opcode
+        operands: List[str] = [self.loc(value) for value in instruction.operands]
+        results: List[str] = [self.loc(value) for value in instruction.results]
+        if opcode == "param":
+            return f"  pop {results[0]}\n"
+        if opcode in ("const", "address", "string"):
+            immediate: str = (
+                get_string_label(instruction.immediate)
+                if opcode == "string"
+                else instruction.immediate
+            )
+            if is_register(results[0]):
+                return f"  mov {results[0]}, {immediate}\n"
+            return f"  mov rax, {immediate}\n  mov {results[0]}, rax\n"
+        if opcode in ARITHMETIC_INSTRUCTIONS:
+            left, right = operands
+            if is_register(results[0]) and results[0] != right:
+                assembly: str = get_move_asm(results[0], left)
+                return assembly + f"  {ARITHMETIC_INSTRUCTIONS[opcode]} {results[0]}, {right}\n"
+            assembly = f"  mov rax, {left}\n"
+            assembly += f"  {ARITHMETIC_INSTRUCTIONS[opcode]} rax, {right}\n"
+            return assembly + f"  mov {results[0]}, rax\n"
+        if opcode in CONDITION_CODES:
+            assembly = self.get_compare_asm(instruction)
+            assembly += f"  set{CONDITION_CODES[opcode]} al\n"
+            assembly += "  movzx eax, al\n"
+            return assembly + f"  mov {results[0]}, rax\n"
+        if opcode == "divmod":
+            dividend, divisor = operands
+            assembly = f"  mov rax, {dividend}\n"
+            assembly += "  xor edx, edx\n"
+            assembly += f"  div {divisor}\n"
+            assembly += f"  mov {results[1]}, rax\n"
+            return assembly + f"  mov {results[0]}, rdx\n"
+        if opcode in LOAD_INSTRUCTIONS:
+            assembly = f"  mov rax, {operands[0]}\n"
+            assembly += LOAD_INSTRUCTIONS[opcode]
+            return assembly + f"  mov {results[0]}, rax\n"
+        if opcode in STORE_REGISTERS:
+            value, address = operands
+            assembly = f"  mov rax, {address}\n"
+            assembly += f"  mov rdx, {value}\n"
+            return assembly + f"  mov [rax], {STORE_REGISTERS[opcode]}\n"
+        if opcode in ("argc", "argv", "envp"):
+            assembly = "  mov rax, [args_ptr]\n"
+            assembly += {
+                "argc": "  mov rax, [rax]\n",
+                "argv": "  add rax, 8\n",
+                "envp": "  add rax, 24\n",
+            }[opcode]
+            return assembly + f"  mov {results[0]}, rax\n"
+        if opcode == "print":
+            return f"  mov rdi, {operands[0]}\n  call print\n"
+        if opcode == "syscall":
+            # The operands are pushed first as they might be in the argument registers
+            assembly = "".join(f"  push {operand}\n" for operand in operands)
+            assembly += "".join(
+                f"  pop {register}\n" for register in SYSCALL_REGISTERS[: len(operands)]
+            )
+            assembly += get_output_flush_asm()
+            assembly += "  syscall\n"
+            return assembly + f"  mov {results[0]}, rax\n"
+        if opcode == "call":
+            assembly = "".join(f"  push {operand}\n" for operand in operands)
+            assembly += f"  call {get_valid_label_for_nasm(instruction.immediate)}\n"
+            return assembly + "".join(f"  pop {result}\n" for result in reversed(results))
+        raise ValueError(f"Unknown SSA instruction '{opcode}'")
+
+    def get_compare_asm(self, instruction: Instruction) -> str:
+        """Compare the operands of a comparison instruction."""
+        left, right = [self.loc(value) for value in instruction.operands]
+        return f"  mov rax, {left}\n  cmp rax, {right}\n"
+
+    def get_edge_moves_asm(self, edge: Edge) -> str:
+        """Move the arguments of the edge to the parameters of its target. Unused parameters are skipped."""
+        moves: List[Tuple[str, str]] = [
+            (self.loc(param), self.loc(argument))
+            for param, argument in zip(edge.target.get_params(), edge.get_arguments())
+            if param in self.use_counts
+        ]
+        return get_parallel_move_asm(moves)
+
+    def get_jump_asm(self, edge: Edge, next_block: Optional[BasicBlock]) -> str:
+        """Move the arguments and jump to the target unless it is the next block."""
+        assembly: str = self.get_edge_moves_asm(edge)
+        if edge.target is not next_block:
+            assembly += f"  jmp {self.get_block_label(edge.target)}\n"
+        return assembly
+
+    def get_terminator_asm(
+        self,
+        block: BasicBlock,
+        next_block: Optional[BasicBlock],
+        fused: Optional[Instruction],
+    ) -> str:
+        """Generate the assembly of the jump, branch or return ending the block."""
+        terminator = block.terminator
+        assert terminator is not None
+        if terminator.kind == "return":
+            assembly: str = "".join(
+                f"  push {self.loc(value)}\n" for value in terminator.operands
+            )
+            return assembly + f"  jmp {self.label}_ssa_end\n"
+        if terminator.kind == "jump":
+            return self.get_jump_asm(terminator.edges[0], next_block)
+
+        if fused is not None:
+            assembly = self.get_compare_asm(fused)
+            condition_code: str = CONDITION_CODES[fused.opcode]
+        else:
+            assembly = f"  cmp {self.loc(terminator.operands[0])}, 0\n"
+            condition_code = "ne"
+        true_edge, false_edge = terminator.edges
+        true_moves: str = self.get_edge_moves_asm(true_edge)
+        if not true_moves:
+            assembly += f"  j{condition_code} {self.get_block_label(true_edge.target)}\n"
+            return assembly + self.get_jump_asm(false_edge, next_block)
+        false_label: str = f"{self.get_block_label(block)}_false"
+        assembly += f"  j{INVERTED_CONDITION_CODES[condition_code]} {false_label}\n"
+        assembly += self.get_jump_asm(true_edge, None)
+        assembly += f"{false_label}:\n"
+        return assembly + self.get_jump_asm(false_edge, next_block)
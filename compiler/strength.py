@@ -0,0 +1,204 @@
+"""
+Strength reduction of multiplications and divisions by constants
+"""
+from copy import copy
+from typing import Dict, List, Optional, Set, Tuple
+from compiler.ctfe import WORD_SIZE, get_constant_push_value
+from compiler.defs import Op, OpType, Program, RegisterCache
+from compiler.program import renumber_program
+from compiler.utils import print_if_verbose
+
+REDUCIBLE_INTRINSICS: List[str] = ["DIVMOD", "MUL"]
+
+# Multipliers which can be computed with a single LEA instruction
+LEA_MULTIPLIERS: List[int] = [3, 5, 9]
+
+
+def inline_arithmetic_calls(
+    sub_programs: Dict[str, Program], is_verbose: bool
+) -> Dict[str, Program]:
+    """
+    Inline calls to Functions like '%' and '*' when they directly follow a constant push,
+    so that the constant operand is visible for the reducible Intrinsic.
+    """
+    wrappers: Dict[str, Program] = {}
+    for name in sub_programs:
+        body: Optional[Program] = get_arithmetic_body(name, sub_programs, set())
+        if body and body[0].token.value.upper() in REDUCIBLE_INTRINSICS:
+            wrappers[name] = body
+
+    for name, program in sub_programs.items():
+        inlined_program: Program = []
+        for op in program:
+            if (
+                op.type == OpType.FUNCTION_CALL
+                and op.token.value in wrappers
+                and inlined_program
+                and inlined_program[-1].type == OpType.PUSH_INT
+            ):
+                print_if_verbose(
+                    f"Inlined '{op.token.value}' for strength reduction in '{name}'",
+                    is_verbose,
+                )
+                for wrapper_op in wrappers[op.token.value]:
+                    inlined_op: Op = copy(wrapper_op)
+                    inlined_op.func = op.func
+                    inlined_program.append(inlined_op)
+                continue
+            inlined_program.append(op)
+        sub_programs[name] = renumber_program(inlined_program)
+    return sub_programs
+
+
+def get_arithmetic_body(
+    name: str, sub_programs: Dict[str, Program], visited: Set[str]
+) -> Optional[Program]:
+    """
+    Return the Intrinsics a Function consists of with the nested calls expanded,
+    or None if the Function contains anything else than Intrinsics and calls.
+    """
+    if name in visited or name not in sub_programs:
+        return None
+    body: Program = []
+    for op in sub_programs[name]:
+        if op.type == OpType.INTRINSIC:
+            body.append(op)
+        elif op.type == OpType.FUNCTION_CALL:
+            nested_body: Optional[Program] = get_arithmetic_body(
+                op.token.value, sub_programs, visited | {name}
+            )
+            if nested_body is None:
+                return None
+            body += nested_body
+        else:
+            return None
+    return body
+
+
+def get_constant_operand(
+    op: Op, program: Program, constant_values: Dict[str, int]
+) -> Optional[int]:
+    """
+    Return the constant right operand of a reducible Intrinsic or None if the
+    operand is not known at compile time or the Intrinsic is not reducible.
+    """
+    if (
+        op.type != OpType.INTRINSIC
+        or op.token.value.upper() not in REDUCIBLE_INTRINSICS
+        or op.id == 0
+        or program[op.id - 1].type != OpType.PUSH_INT
+    ):
+        return None
+    try:
+        operand: int = get_constant_push_value(program[op.id - 1], constant_values)
+    except ValueError:
+        return None
+    # Division by zero is left to fail at runtime
+    if op.token.value.upper() == "DIVMOD" and operand == 0:
+        return None
+    return operand
+
+
+def is_reduced_operand(
+    op: Op, program: Program, constant_values: Dict[str, int]
+) -> bool:
+    """Check if the Op pushes a constant which is consumed by the strength reduced next Op."""
+    return (
+        op.id + 1 < len(program)
+        and get_constant_operand(program[op.id + 1], program, constant_values)
+        is not None
+    )
+
+
+def get_division_magic(divisor: int) -> Tuple[int, int, bool]:
+    """
+    Calculate the magic number for unsigned 64-bit division by a constant
+    (Granlund & Montgomery, "Division by Invariant Integers using Multiplication").
+    Return the 64-bit multiplier, the shift amount and whether the multiplier
+    has an implicit 65th bit which needs the add indicator sequence.
+    """
+    log2_ceil: int = (divisor - 1).bit_length()
+    for shift in range(log2_ceil + 1):
+        power: int = 2 ** (64 + shift)
+        multiplier: int = -(-power // divisor)
+        if multiplier < WORD_SIZE and multiplier * divisor - power <= 2**shift:
+            return multiplier, shift, False
+    multiplier = -(-(2 ** (64 + log2_ceil)) // divisor)
+    return multiplier - WORD_SIZE, log2_ceil - 1, True
+
+
+def get_reduced_mul_asm(multiplier: int, cache: Optional[RegisterCache]) -> str:
+    """Multiply the top element of the stack by a constant without the MUL instruction."""
+    op_asm: str = "" if cache is None else cache.fill(1)
+    register: str = "rax" if cache is None else cache.top()
+    if cache is None:
+        op_asm += "  pop rax\n"
+    if multiplier == 0:
+        op_asm += f"  xor {register}, {register}\n"
+    elif multiplier & (multiplier - 1) == 0:
+        shift: int = multiplier.bit_length() - 1
+        if shift > 0:
+            op_asm += f"  shl {register}, {shift}\n"
+    elif multiplier in LEA_MULTIPLIERS:
+        op_asm += f"  lea {register}, [{register}+{register}*{multiplier - 1}]\n"
+    elif multiplier < 2**31:
+        op_asm += f"  imul {register}, {register}, {multiplier}\n"
+    else:
+        op_asm += f"  mov rbx, {multiplier}\n"
+        op_asm += f"  imul {register}, rbx\n"
+    if cache is None:
+        op_asm += "  push rax  ; Product\n"
+    return op_asm
+
+
+def get_reduced_divmod_asm(divisor: int, cache: Optional[RegisterCache]) -> str:
+    """
+    Divide the top element of the stack by a constant without the DIV instruction.
+    Push the remainder and the quotient like DIVMOD.
+    """
+    if cache is None:
+        op_asm: str = "  pop rbx\n"
+        dividend: str = "rbx"
+    else:
+        op_asm = cache.fill(1)
+        dividend = cache.top()
+
+    # The quotient is calculated to rax and the remainder to the dividend register
+    if divisor & (divisor - 1) == 0:
+        op_asm += f"  mov rax, {dividend}\n"
+        if divisor > 1:
+            op_asm += f"  shr rax, {divisor.bit_length() - 1}\n"
+        op_asm += get_and_constant_asm(dividend, divisor - 1)
+    else:
+        multiplier, shift, add_indicator = get_division_magic(divisor)
+        op_asm += f"  mov rax, {multiplier}\n"
+        op_asm += f"  mul {dividend}\n"
+        if add_indicator:
+            op_asm += f"  mov rax, {dividend}\n"
+            op_asm += "  sub rax, rdx\n"
+            op_asm += "  shr rax, 1\n"
+            op_asm += "  add rax, rdx\n"
+        else:
+            op_asm += "  mov rax, rdx\n"
+        if shift > 0:
+            op_asm += f"  shr rax, {shift}\n"
+        if divisor < 2**31:
+            op_asm += f"  imul rdx, rax, {divisor}\n"
+        else:
+            op_asm += f"  mov rdx, {divisor}\n"
+            op_asm += "  imul rdx, rax\n"
+        op_asm += f"  sub {dividend}, rdx\n"
+
+    if cache is None:
+        op_asm += "  push rbx ; Remainder\n"
+        op_asm += "  push rax ; Quotient\n"
+        return op_asm
+    spill_asm, quotient = cache.push()
+    return op_asm + spill_asm + f"  mov {quotient}, rax\n"
+
+
+def get_and_constant_asm(register: str, mask: int) -> str:
+    """AND the register with a constant mask which might not fit to an immediate value."""
+    if mask < 2**31:
+        return f"  and {register}, {mask}\n"
+    return f"  mov rdx, {mask}\n" + f"  and {register}, rdx\n"
@@ -2,10 +2,12 @@
 Utility functions for Torth compiler
 """
 import argparse
+import hashlib
 import subprocess
 import pathlib
 import sys
 from typing import Dict, List, NoReturn, Optional
+from compiler.align import is_valid_alignment
 from compiler.defs import (
     COLORS,
     Function,
@@ -26,10 +28,112 @@ def usage() -> NoReturn:
     sys.exit(1)
 
 
-def get_command_line_arguments() -> argparse.Namespace:
-    """Initialize ArgumendParser with command-line arguments and return the parser's Namespace"""
+def get_command_line_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Initialize ArgumendParser with command-line arguments and return the parser's Namespace.
+    The arguments are read from sys.argv unless argv is given.
+    """
     parser = argparse.ArgumentParser(description="Compile Torth code")
+    parser.add_argument(
+        "--align-functions",
+        default=0,
+        type=int,
+        metavar="BYTES",
+        help="Align Function entries to BYTES, a power of two up to 4096 (default: 0, no alignment)",
+    )
+    parser.add_argument(
+        "--align-loops",
+        default=0,
+        type=int,
+        metavar="BYTES",
+        help="Align loop headers to BYTES, a power of two up to 4096 (default: 0, no alignment)",
+    )
+    parser.add_argument(
+        "--align-memories",
+        default=0,
+        type=int,
+        metavar="BYTES",
+        help="Align memories to BYTES and memories of at least 4096 bytes to 4096 bytes (default: 0, no alignment)",
+    )
+    parser.add_argument(
+        "--asm-comments",
+        action="store_true",
+        help="Annotate the generated assembly with the source location of every Op, implied by --save-asm",
+    )
+    parser.add_argument(
+        "--builtin-assembler",
+        action="store_true",
+        help="Assemble and link the executable in-process instead of running NASM and LD",
+    )
+    parser.add_argument(
+        "--combine-shuffles",
+        action="store_true",
+        help="Generate runs of DUP, DROP, OVER, ROT, SWAP and constant NTH as a single stack permutation",
+    )
+    parser.add_argument(
+        "--ctfe",
+        action="store_true",
+        help="Evaluate pure Function calls with constant arguments at compile time",
+    )
+    parser.add_argument(
+        "--ctfe-budget",
+        default=100000,
+        type=int,
+        metavar="STEPS",
+        help="Maximum amount of Ops executed when evaluating a call at compile time (default: 100000)",
+    )
+    parser.add_argument(
+        "--dead-code",
+        action="store_true",
+        help="Remove unreachable Ops, branches with constant conditions and computations whose results are dropped",
+    )
+    parser.add_argument(
+        "-g",
+        "--debug",
+        action="store_true",
+        help="Include DWARF line information mapping the executable to the Torth source lines, implies --asm-comments",
+    )
+    parser.add_argument(
+        "--disable-pass",
+        action="append",
+        metavar="PASS",
+        help="Disable an optimization even if the optimization level enables it, can be repeated",
+    )
+    parser.add_argument(
+        "--enable-pass",
+        action="append",
+        metavar="PASS",
+        help="Enable an optimization like 'tail-calls' regardless of the optimization level, can be repeated",
+    )
+    parser.add_argument(
+        "--fuse-branches",
+        action="store_true",
+        help="Lower a comparison directly before DO to a compare and a conditional jump",
+    )
+    parser.add_argument(
+        "--native-calls",
+        action="store_true",
+        help="Keep return addresses of non-recursive Functions outside of return_stack",
+    )
+    parser.add_argument(
+        "-O",
+        dest="optimization_level",
+        default=0,
+        type=int,
+        choices=[0, 1, 2],
+        help="Optimization level (default: 0)",
+    )
     parser.add_argument("-o", "--out", help="Output file", metavar="FILE")
+    parser.add_argument(
+        "--optimize-loops",
+        action="store_true",
+        help="Hoist loop invariant computations out of loops and rotate loops to check the condition at the bottom",
+    )
+    parser.add_argument(
+        "--peephole",
+        action="store_true",
+        help="Remove redundant push/pop pairs and dead movs from the generated assembly",
+    )
     parser.add_argument(
         "-p",
         "--path",
@@ -45,14 +149,88 @@ def get_command_line_arguments() -> argparse.Namespace:
         action="store_true",
         help="Save assembly file named after code_file with .asm extension",
     )
+    parser.add_argument(
+        "--register-args",
+        action="store_true",
+        help="Pass the topmost parameters and return values of Functions in registers, implies --tos-cache",
+    )
+    parser.add_argument(
+        "--report-loops",
+        action="store_true",
+        help="List the loops transformed by the loop optimizations, implies --optimize-loops",
+    )
+    parser.add_argument(
+        "--report-passes",
+        action="store_true",
+        help="List the enabled optimizations and the wall time and Op count change of each IR pass",
+    )
+    parser.add_argument(
+        "--shards",
+        default=1,
+        type=int,
+        metavar="COUNT",
+        help=(
+            "Split the Functions to COUNT shards compiled with concurrent NASM processes, "
+            "unchanged shards are reused (default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--ssa-backend",
+        action="store_true",
+        help="Generate Functions from an SSA form with linear scan register allocation, ignored with --register-args",
+    )
+    parser.add_argument(
+        "--source-map",
+        action="store_true",
+        help="Write the source locations of the Function and control flow labels to a .map file next to the executable",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Compile and write the assembly one Function at a time to bound the memory use, "
+            "disables whole-program optimizations"
+        ),
+    )
+    parser.add_argument(
+        "--strength-reduce",
+        action="store_true",
+        help="Replace multiplications and divisions by constants with cheaper instructions",
+    )
+    parser.add_argument(
+        "--tail-calls",
+        action="store_true",
+        help="Lower Function calls in tail position to jumps",
+    )
+    parser.add_argument(
+        "--tos-cache",
+        action="store_true",
+        help="Keep up to three topmost stack elements in registers in the generated code",
+    )
+    parser.add_argument(
+        "--unroll-loops",
+        action="store_true",
+        help="Unroll small loops with a constant iteration count, implies --optimize-loops",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Output compilation steps"
     )
     parser.add_argument("code_file", help="Input file")
 
-    args: argparse.Namespace = parser.parse_args(sys.argv[1:])
+    args: argparse.Namespace = parser.parse_args(sys.argv[1:] if argv is None else argv)
     if not pathlib.Path(args.code_file).exists:
         compiler_error("ARGUMENT_ERROR", f"Argument '{args.code_file}' is not a file")
+    for alignment in (args.align_functions, args.align_loops, args.align_memories):
+        if not is_valid_alignment(alignment):
+            compiler_error(
+                "ARGUMENT_ERROR",
+                f"Alignment {alignment} is not a power of two up to 4096 bytes",
+            )
+    if args.debug and args.builtin_assembler:
+        compiler_error(
+            "ARGUMENT_ERROR",
+            "The built-in assembler does not write debug information, use NASM with -g",
+        )
     return args
 
 
@@ -355,6 +533,61 @@ def get_parent_op_type_do(op: Op, program: Program) -> OpType:
     )
 
 
+def get_do_jump_destination(op: Op, program: Program) -> Op:
+    """Return the ELIF, ELSE, ENDIF or DONE Operand the current DO jumps to when the condition fails."""
+    parent_op_type: OpType = get_parent_op_type_do(op, program)
+
+    # Keeping the count of duplicate parent Ops allows for nested IF or WHILE blocks
+    parent_op_count: int = 0
+    for i in range(op.id + 1, len(program)):
+        op_type: OpType = program[i].type
+
+        # Keep count on the nested IF's or WHILE's
+        if (parent_op_type in [OpType.IF, OpType.ELIF] and op_type == OpType.IF) or (
+            parent_op_type == OpType.WHILE and op_type == OpType.WHILE
+        ):
+            parent_op_count += 1
+            continue
+
+        if parent_op_count == 0 and (
+            (
+                parent_op_type == OpType.IF
+                and op_type in (OpType.ELIF, OpType.ELSE, OpType.ENDIF)
+            )
+            or (
+                parent_op_type == OpType.ELIF
+                and op_type in (OpType.ELIF, OpType.ELSE, OpType.ENDIF)
+            )
+            or (parent_op_type == OpType.WHILE and op_type == OpType.DONE)
+        ):
+            return program[i]
+
+        # Decrement counter when passing another block's ENDIF / DONE
+        if (parent_op_type in [OpType.IF, OpType.ELIF] and op_type == OpType.ENDIF) or (
+            parent_op_type == OpType.WHILE and op_type == OpType.DONE
+        ):
+            parent_op_count -= 1
+
+    block_type: str = "WHILE" if parent_op_type == OpType.WHILE else "IF"
+    block_end: str = "DONE" if parent_op_type == OpType.WHILE else "ENDIF"
+    compiler_error(
+        "UNCLOSED_BLOCK",
+        f"The current {block_type} block is missing {block_end} keyword.",
+        op.token,
+    )
+
+
+def get_frame_address(func: Function, name: str) -> str:
+    """Return the address of a bound value in the frame of the Function"""
+    return f"[r15+{8 * list(func.binding).index(name)}]"
+
+
+def get_string_label(string: str) -> str:
+    """Return the label of a string literal in the string pool. Identical literals share the label."""
+    digest: str = hashlib.sha1(string.encode("utf-8")).hexdigest()[:16]
+    return f"string_{digest}"
+
+
 def get_main_function(functions: Dict[str, Function]) -> Function:
     """Get the main function from a list of Functions"""
     for func in functions.values():
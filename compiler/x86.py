@@ -0,0 +1,805 @@
+"""
+Built-in assembler for the subset of NASM syntax and x86-64 instructions the compiler generates
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+from compiler.utils import compiler_error
+
+REGISTER_NAMES: Dict[int, List[str]] = {
+    8: "rax rcx rdx rbx rsp rbp rsi rdi".split() + [f"r{number}" for number in range(8, 16)],
+    4: "eax ecx edx ebx esp ebp esi edi".split() + [f"r{number}d" for number in range(8, 16)],
+    2: "ax cx dx bx sp bp si di".split() + [f"r{number}w" for number in range(8, 16)],
+    1: "al cl dl bl spl bpl sil dil".split() + [f"r{number}b" for number in range(8, 16)],
+}
+
+# 8-bit registers which are only accessible with a REX prefix
+REX_BYTE_REGISTERS: List[str] = ["spl", "bpl", "sil", "dil"]
+
+SIZE_KEYWORDS: Dict[str, int] = {"byte": 1, "word": 2, "dword": 4, "qword": 8}
+DATA_SIZES: Dict[str, int] = {"db": 1, "dw": 2, "dd": 4, "dq": 8}
+RESERVE_SIZES: Dict[str, int] = {"resb": 1, "resw": 2, "resd": 4, "resq": 8}
+
+CONDITION_CODES: Dict[str, int] = {
+    "o": 0,
+    "no": 1,
+    "b": 2,
+    "c": 2,
+    "nae": 2,
+    "ae": 3,
+    "nb": 3,
+    "nc": 3,
+    "e": 4,
+    "z": 4,
+    "ne": 5,
+    "nz": 5,
+    "be": 6,
+    "na": 6,
+    "a": 7,
+    "nbe": 7,
+    "s": 8,
+    "ns": 9,
+    "p": 10,
+    "pe": 10,
+    "np": 11,
+    "po": 11,
+    "l": 12,
+    "nge": 12,
+    "ge": 13,
+    "nl": 13,
+    "le": 14,
+    "ng": 14,
+    "g": 15,
+    "nle": 15,
+}
+
+# Opcode extensions of the arithmetic instructions with the same encodings
+ARITHMETIC_EXTENSIONS: Dict[str, int] = {
+    "add": 0,
+    "or": 1,
+    "adc": 2,
+    "sbb": 3,
+    "and": 4,
+    "sub": 5,
+    "xor": 6,
+    "cmp": 7,
+}
+UNARY_EXTENSIONS: Dict[str, int] = {"not": 2, "neg": 3, "mul": 4, "imul": 5, "div": 6, "idiv": 7}
+SHIFT_EXTENSIONS: Dict[str, int] = {
+    "rol": 0,
+    "ror": 1,
+    "shl": 4,
+    "sal": 4,
+    "shr": 5,
+    "sar": 7,
+}
+NO_OPERAND_INSTRUCTIONS: Dict[str, bytes] = {
+    "cqo": b"\x48\x99",
+    "leave": b"\xc9",
+    "nop": b"\x90",
+    "ret": b"\xc3",
+    "syscall": b"\x0f\x05",
+}
+
+IDENTIFIER_REGEX = re.compile(r"[A-Za-z_.$#@~?][\w.$#@~?]*")
+TOKEN_REGEX = re.compile(r"\s*(0x[0-9a-fA-F]+|\d+|[A-Za-z_.$#@~?][\w.$#@~?]*|[-+*()])")
+
+
+@dataclass
+class Register:
+    """General purpose register operand"""
+
+    number: int
+    size: int
+    needs_rex: bool = False
+
+
+@dataclass
+class Memory:
+    """Memory operand [base + index * scale + symbol + displacement]"""
+
+    base: Optional[int]
+    index: Optional[int]
+    scale: int
+    displacement: int
+    symbol: Optional[str]
+    size: Optional[int]
+
+
+@dataclass
+class Immediate:
+    """Immediate operand which is a number or the address of a symbol plus a number"""
+
+    value: int
+    symbol: Optional[str] = None
+
+
+Operand = Union[Register, Memory, Immediate]
+
+
+@dataclass
+class Fixup:
+    """
+    Reference to a symbol whose address is patched to a section when the sections are placed.
+
+    section: Section the patched bytes are in
+    offset:  Offset of the patched bytes in the section
+    size:    Count of patched bytes
+    symbol:  Referenced symbol
+    addend:  Number added to the address of the symbol
+    end:     Offset of the end of the instruction for relative references, None for absolute ones
+    """
+
+    section: str
+    offset: int
+    size: int
+    symbol: str
+    addend: int
+    end: Optional[int] = None
+
+
+@dataclass
+class ObjectCode:
+    """
+    Assembled sections with the symbols defined in them and the unresolved references.
+
+    sections:   Contents of the sections by name, .bss is only reserved
+    bss_size:   Count of bytes reserved in the .bss section
+    alignments: Largest alignment in each section
+    symbols:    Section and offset of each label
+    fixups:     References to symbols which are patched when the sections are placed
+    """
+
+    sections: Dict[str, bytearray] = field(default_factory=dict)
+    bss_size: int = 0
+    alignments: Dict[str, int] = field(default_factory=dict)
+    symbols: Dict[str, Tuple[str, int]] = field(default_factory=dict)
+    fixups: List[Fixup] = field(default_factory=list)
+
+
+class Encoder:
+    """Encoder of the instructions and the data to the current section of the object code"""
+
+    def __init__(self) -> None:
+        self.code: ObjectCode = ObjectCode()
+        self.section: str = ".text"
+        self.is_rip_relative: bool = False
+        self.line: str = ""
+
+    def error(self, message: str) -> None:
+        """Exit with a compiler error for the current line."""
+        compiler_error("ASSEMBLER_ERROR", f"{message}\n\n{self.line.strip()}")
+
+    def get_contents(self) -> bytearray:
+        """Return the contents of the current section."""
+        if self.section == ".bss":
+            self.error("Only reservations are allowed in .bss")
+        return self.code.sections.setdefault(self.section, bytearray())
+
+    def emit(self, data: bytes) -> None:
+        """Append bytes to the current section."""
+        self.get_contents().extend(data)
+
+    def add_fixup(
+        self, offset: int, size: int, immediate: Immediate, end: Optional[int] = None
+    ) -> None:
+        """Record a reference to a symbol at the offset of the current section."""
+        assert immediate.symbol is not None
+        self.code.fixups.append(
+            Fixup(self.section, offset, size, immediate.symbol, immediate.value, end)
+        )
+
+    def encode_instruction(self, mnemonic: str, operands: List[Operand]) -> None:
+        # sourcery skip: low-code-quality
+        """Encode an instruction with its operands to the current section."""
+        count: int = len(operands)
+        first: Optional[Operand] = operands[0] if operands else None
+        second: Optional[Operand] = operands[1] if count > 1 else None
+        if mnemonic in NO_OPERAND_INSTRUCTIONS and count == 0:
+            self.emit(NO_OPERAND_INSTRUCTIONS[mnemonic])
+        elif mnemonic in ("call", "jmp") and isinstance(first, Immediate):
+            self.encode_branch(b"\xe8" if mnemonic == "call" else b"\xe9", first)
+        elif mnemonic in ("call", "jmp") and count == 1:
+            self.encode_modrm(b"\xff", 2 if mnemonic == "call" else 4, first, 4)
+        elif mnemonic.startswith("j") and mnemonic[1:] in CONDITION_CODES:
+            opcode: bytes = bytes([0x0F, 0x80 + CONDITION_CODES[mnemonic[1:]]])
+            self.encode_branch(opcode, self.expect_immediate(first))
+        elif mnemonic.startswith("set") and mnemonic[3:] in CONDITION_CODES:
+            opcode = bytes([0x0F, 0x90 + CONDITION_CODES[mnemonic[3:]]])
+            self.encode_modrm(opcode, 0, first, 1)
+        elif mnemonic.startswith("cmov") and mnemonic[4:] in CONDITION_CODES:
+            opcode = bytes([0x0F, 0x40 + CONDITION_CODES[mnemonic[4:]]])
+            register: Register = self.expect_register(first)
+            self.encode_modrm(opcode, register, second, register.size)
+        elif mnemonic in ("push", "pop") and isinstance(first, Register):
+            base_opcode: int = 0x50 if mnemonic == "push" else 0x58
+            prefix: bytes = b"\x41" if first.number > 7 else b""
+            self.emit(prefix + bytes([base_opcode + first.number % 8]))
+        elif mnemonic == "push" and isinstance(first, Immediate):
+            self.encode_immediate_push(first)
+        elif mnemonic in ("push", "pop") and isinstance(first, Memory):
+            opcode = b"\xff" if mnemonic == "push" else b"\x8f"
+            self.encode_modrm(opcode, 6 if mnemonic == "push" else 0, first, 4)
+        elif mnemonic == "mov" and count == 2:
+            self.encode_mov(first, second)
+        elif mnemonic in ("movzx", "movsx") and count == 2:
+            register = self.expect_register(first)
+            source_size: int = self.get_size(second, None)
+            opcode = bytes([0x0F, (0xB6 if mnemonic == "movzx" else 0xBE) + (source_size == 2)])
+            self.encode_modrm(opcode, register, second, register.size)
+        elif mnemonic == "lea" and isinstance(second, Memory):
+            register = self.expect_register(first)
+            self.encode_modrm(b"\x8d", register, second, register.size)
+        elif mnemonic in ARITHMETIC_EXTENSIONS and count == 2:
+            self.encode_arithmetic(ARITHMETIC_EXTENSIONS[mnemonic], first, second)
+        elif mnemonic == "test" and count == 2:
+            self.encode_test(first, second)
+        elif mnemonic == "imul" and count > 1:
+            self.encode_imul(operands)
+        elif mnemonic in UNARY_EXTENSIONS and count == 1:
+            size: int = self.get_size(first, None)
+            opcode = b"\xf6" if size == 1 else b"\xf7"
+            self.encode_modrm(opcode, UNARY_EXTENSIONS[mnemonic], first, size)
+        elif mnemonic in ("inc", "dec") and count == 1:
+            size = self.get_size(first, None)
+            opcode = b"\xfe" if size == 1 else b"\xff"
+            self.encode_modrm(opcode, int(mnemonic == "dec"), first, size)
+        elif mnemonic in SHIFT_EXTENSIONS and count == 2:
+            self.encode_shift(SHIFT_EXTENSIONS[mnemonic], first, second)
+        else:
+            self.error(f"Unsupported instruction '{mnemonic}'")
+
+    def expect_register(self, operand: Optional[Operand]) -> Register:
+        """Return the operand if it is a register."""
+        if not isinstance(operand, Register):
+            self.error("Expected a register operand")
+        return operand  # type: ignore
+
+    def expect_immediate(self, operand: Optional[Operand]) -> Immediate:
+        """Return the operand if it is an immediate value."""
+        if not isinstance(operand, Immediate):
+            self.error("Expected a label or an immediate operand")
+        return operand  # type: ignore
+
+    def get_size(self, operand: Optional[Operand], other: Optional[Operand]) -> int:
+        """Return the operand size in bytes from a register or an explicit size of memory."""
+        for sized in (operand, other):
+            if isinstance(sized, Register):
+                return sized.size
+        if isinstance(operand, Memory) and operand.size is not None:
+            return operand.size
+        self.error("Operation size not specified")
+        return 0
+
+    def encode_branch(self, opcode: bytes, target: Immediate) -> None:
+        """Encode a call or a jump relative to the next instruction."""
+        contents: bytearray = self.get_contents()
+        if target.symbol is None:
+            self.error("Branch target has to be a label")
+        self.emit(opcode + bytes(4))
+        self.add_fixup(len(contents) - 4, 4, target, len(contents))
+
+    def encode_immediate_push(self, immediate: Immediate) -> None:
+        """Encode a push of an immediate value, which is sign-extended to 64 bits."""
+        if immediate.symbol is None and is_signed(immediate.value, 1):
+            self.emit(b"\x6a" + to_bytes(immediate.value, 1))
+            return
+        self.emit(b"\x68")
+        if immediate.symbol is not None:
+            self.add_fixup(len(self.get_contents()), 4, immediate)
+        self.emit(to_bytes(self.get_signed_immediate(immediate, 4), 4))
+
+    def get_signed_immediate(self, immediate: Immediate, size: int) -> int:
+        """Return the value of an immediate which is sign-extended from the size."""
+        if immediate.symbol is not None:
+            return 0
+        value: int = immediate.value
+        if not is_signed(value, size) and not is_unsigned(value, size):
+            self.error(f"Immediate value {value} does not fit in {size * 8} bits")
+        return value
+
+    def encode_mov(self, destination: Optional[Operand], source: Optional[Operand]) -> None:
+        """Encode the variants of MOV."""
+        if isinstance(source, Immediate):
+            size: int = self.get_size(destination, None)
+            if isinstance(destination, Register):
+                self.encode_immediate_mov(destination, source)
+                return
+            opcode: bytes = b"\xc6" if size == 1 else b"\xc7"
+            self.encode_modrm(
+                opcode, 0, destination, size, immediate=source, immediate_size=min(size, 4)
+            )
+        elif isinstance(source, Register):
+            opcode = b"\x88" if source.size == 1 else b"\x89"
+            self.encode_modrm(opcode, source, destination, source.size)
+        else:
+            register: Register = self.expect_register(destination)
+            opcode = b"\x8a" if register.size == 1 else b"\x8b"
+            self.encode_modrm(opcode, register, source, register.size)
+
+    def encode_immediate_mov(self, register: Register, immediate: Immediate) -> None:
+        """Encode MOV of an immediate to a register with the shortest encoding for the value."""
+        value: int = immediate.value
+        if register.size == 8 and immediate.symbol is None and is_signed(value, 4):
+            self.encode_modrm(b"\xc7", 0, register, 8, immediate=immediate, immediate_size=4)
+            return
+        if register.size == 8 and immediate.symbol is None and is_unsigned(value, 4):
+            # Writing to the 32-bit register clears the upper half
+            register = Register(register.number, 4)
+        size: int = register.size
+        prefix: bytes = get_rex(size == 8, 0, 0, register.number >> 3, register.needs_rex)
+        if size == 2:
+            prefix = b"\x66" + prefix
+        opcode: int = (0xB0 if size == 1 else 0xB8) + register.number % 8
+        self.emit(prefix + bytes([opcode]))
+        if immediate.symbol is not None:
+            self.add_fixup(len(self.get_contents()), size, immediate)
+            value = 0
+        elif not is_signed(value, size) and not is_unsigned(value, size):
+            self.error(f"Immediate value {value} does not fit in {size * 8} bits")
+        self.emit(to_bytes(value, size))
+
+    def encode_arithmetic(
+        self, extension: int, destination: Optional[Operand], source: Optional[Operand]
+    ) -> None:
+        """Encode ADD, OR, ADC, SBB, AND, SUB, XOR and CMP."""
+        size: int = self.get_size(destination, source)
+        if isinstance(source, Immediate):
+            if size == 1:
+                self.encode_modrm(
+                    b"\x80", extension, destination, size, immediate=source, immediate_size=1
+                )
+            elif source.symbol is None and is_signed(source.value, 1):
+                self.encode_modrm(
+                    b"\x83", extension, destination, size, immediate=source, immediate_size=1
+                )
+            else:
+                self.encode_modrm(
+                    b"\x81",
+                    extension,
+                    destination,
+                    size,
+                    immediate=source,
+                    immediate_size=min(size, 4),
+                )
+        elif isinstance(source, Register):
+            opcode: int = extension * 8 + (0 if size == 1 else 1)
+            self.encode_modrm(bytes([opcode]), source, destination, size)
+        else:
+            register: Register = self.expect_register(destination)
+            opcode = extension * 8 + (2 if size == 1 else 3)
+            self.encode_modrm(bytes([opcode]), register, source, size)
+
+    def encode_test(self, destination: Optional[Operand], source: Optional[Operand]) -> None:
+        """Encode TEST of a register or an immediate."""
+        size: int = self.get_size(destination, source)
+        if isinstance(source, Immediate):
+            opcode: bytes = b"\xf6" if size == 1 else b"\xf7"
+            self.encode_modrm(
+                opcode, 0, destination, size, immediate=source, immediate_size=min(size, 4)
+            )
+            return
+        register: Register = self.expect_register(source)
+        self.encode_modrm(b"\x84" if size == 1 else b"\x85", register, destination, size)
+
+    def encode_imul(self, operands: List[Operand]) -> None:
+        """Encode the two and three operand forms of IMUL."""
+        register: Register = self.expect_register(operands[0])
+        if len(operands) == 2 and isinstance(operands[1], Immediate):
+            operands = [register, register, operands[1]]
+        if len(operands) == 2:
+            self.encode_modrm(b"\x0f\xaf", register, operands[1], register.size)
+            return
+        immediate: Immediate = self.expect_immediate(operands[2])
+        if immediate.symbol is None and is_signed(immediate.value, 1):
+            self.encode_modrm(
+                b"\x6b", register, operands[1], register.size, immediate=immediate, immediate_size=1
+            )
+        else:
+            self.encode_modrm(
+                b"\x69", register, operands[1], register.size, immediate=immediate, immediate_size=4
+            )
+
+    def encode_shift(
+        self, extension: int, destination: Optional[Operand], count: Optional[Operand]
+    ) -> None:
+        """Encode shifts and rotations by an immediate count or by CL."""
+        size: int = self.get_size(destination, None)
+        if isinstance(count, Register):
+            if count.number != 1 or count.size != 1:
+                self.error("Shift count register has to be cl")
+            self.encode_modrm(b"\xd2" if size == 1 else b"\xd3", extension, destination, size)
+        elif self.expect_immediate(count).value == 1:
+            self.encode_modrm(b"\xd0" if size == 1 else b"\xd1", extension, destination, size)
+        else:
+            opcode: bytes = b"\xc0" if size == 1 else b"\xc1"
+            self.encode_modrm(
+                opcode, extension, destination, size, immediate=count, immediate_size=1
+            )
+
+    def encode_modrm(
+        self,
+        opcode: bytes,
+        reg: Union[int, Register],
+        operand: Optional[Operand],
+        size: int,
+        *,
+        immediate: Optional[Operand] = None,
+        immediate_size: int = 0,
+    ) -> None:
+        # pylint: disable=too-many-arguments,too-many-locals
+        """
+        Encode an instruction with a ModR/M byte. The reg field is a register or an opcode extension
+        and the operand is a register or memory. The immediate is appended after the address.
+        """
+        reg_number: int = reg.number if isinstance(reg, Register) else reg
+        needs_rex: bool = isinstance(reg, Register) and reg.needs_rex
+        address: bytes = b""
+        fixup: Optional[Immediate] = None
+        index_number: int = 0
+        if isinstance(operand, Register):
+            rm_number: int = operand.number
+            needs_rex = needs_rex or operand.needs_rex
+            address = bytes([0xC0 | (reg_number & 7) << 3 | rm_number & 7])
+        elif isinstance(operand, Memory):
+            rm_number = operand.base or 0
+            index_number = operand.index or 0
+            address, fixup = self.get_memory_address(reg_number, operand)
+        else:
+            self.error("Expected a register or a memory operand")
+            return
+
+        rex: bytes = get_rex(size == 8, reg_number >> 3, index_number >> 3, rm_number >> 3, needs_rex)
+        prefix: bytes = b"\x66" if size == 2 else b""
+        contents: bytearray = self.get_contents()
+        start: int = len(contents)
+        self.emit(prefix + rex + opcode + address)
+        immediate_bytes: bytes = b""
+        if isinstance(immediate, Immediate):
+            if immediate.symbol is not None:
+                self.add_fixup(len(contents), immediate_size, immediate)
+            value: int = self.get_signed_immediate(immediate, immediate_size)
+            immediate_bytes = to_bytes(value, immediate_size)
+        self.emit(immediate_bytes)
+        if fixup is not None:
+            # The 32-bit displacement is the last part of the address
+            displacement_offset: int = start + len(prefix + rex + opcode + address) - 4
+            self.add_fixup(
+                displacement_offset,
+                4,
+                fixup,
+                len(contents) if self.is_rip_relative_memory(fixup, operand) else None,
+            )
+
+    def is_rip_relative_memory(self, fixup: Immediate, operand: Optional[Operand]) -> bool:
+        """Check if a symbol in a memory operand is addressed relative to the next instruction."""
+        return (
+            self.is_rip_relative
+            and fixup.symbol is not None
+            and isinstance(operand, Memory)
+            and operand.base is None
+            and operand.index is None
+        )
+
+    def get_memory_address(
+        self, reg_number: int, memory: Memory
+    ) -> Tuple[bytes, Optional[Immediate]]:
+        """Return the ModR/M, SIB and displacement bytes of a memory operand and the symbol reference."""
+        reg_bits: int = (reg_number & 7) << 3
+        displacement: int = memory.displacement
+        fixup: Optional[Immediate] = (
+            None if memory.symbol is None else Immediate(displacement, memory.symbol)
+        )
+        if memory.base is None and memory.index is None:
+            if fixup is not None and self.is_rip_relative:
+                return bytes([reg_bits | 0x05]) + bytes(4), fixup
+            value: int = 0 if fixup is not None else displacement
+            return bytes([reg_bits | 0x04, 0x25]) + to_bytes(value, 4), fixup
+        if fixup is not None:
+            displacement = 0
+
+        scale_bits: int = {1: 0, 2: 1, 4: 2, 8: 3}[memory.scale] << 6
+        if memory.base is None:
+            # Index without a base register always has a 32-bit displacement
+            sib: int = scale_bits | (memory.index or 0) % 8 << 3 | 0x05
+            return bytes([reg_bits | 0x04, sib]) + to_bytes(displacement, 4), fixup
+
+        if fixup is None and displacement == 0 and memory.base % 8 != 5:
+            mode, displacement_bytes = 0x00, b""
+        elif fixup is None and is_signed(displacement, 1):
+            mode, displacement_bytes = 0x40, to_bytes(displacement, 1)
+        else:
+            mode, displacement_bytes = 0x80, to_bytes(displacement, 4)
+        if memory.index is None and memory.base % 8 != 4:
+            return bytes([mode | reg_bits | memory.base % 8]) + displacement_bytes, fixup
+        index_bits: int = 0x20 if memory.index is None else memory.index % 8 << 3
+        sib = scale_bits | index_bits | memory.base % 8
+        return bytes([mode | reg_bits | 0x04, sib]) + displacement_bytes, fixup
+
+
+class Assembler(Encoder):
+    """Assembler for the assembly generated by the compiler"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.defines: Dict[str, str] = {}
+        self.global_label: str = ""
+
+    def assemble(self, assembly: str) -> ObjectCode:
+        """Assemble every line of the assembly. Return the object code."""
+        for line in assembly.split("\n"):
+            self.line = line
+            self.assemble_line(strip_comment(line).strip())
+        return self.code
+
+    def assemble_line(self, line: str) -> None:
+        """Assemble a single line without the comment."""
+        if not line:
+            return
+        words: List[str] = line.split(None, 2)
+        keyword: str = words[0].lower()
+        if keyword == "%define":
+            self.defines[words[1]] = words[2] if len(words) > 2 else ""
+        elif keyword == "default":
+            self.is_rip_relative = words[1].lower() == "rel"
+        elif keyword in ("global", "extern", "%line"):
+            return
+        elif keyword == "section":
+            self.section = words[1]
+            self.code.sections.setdefault(self.section, bytearray())
+        elif keyword in ("align", "alignb"):
+            self.align(self.evaluate_number(line.split(None, 1)[1]))
+        elif words[0].endswith(":"):
+            self.define_label(words[0][:-1])
+            self.assemble_line(line[len(words[0]) :].strip())
+        elif len(words) > 1 and (
+            words[1].lower() in DATA_SIZES or words[1].lower() in RESERVE_SIZES
+        ):
+            self.define_label(words[0])
+            self.assemble_line(line.split(None, 1)[1])
+        elif keyword in DATA_SIZES:
+            self.define_data(DATA_SIZES[keyword], split_operands(line.split(None, 1)[1]))
+        elif keyword in RESERVE_SIZES:
+            self.reserve(RESERVE_SIZES[keyword] * self.evaluate_number(words[1]))
+        else:
+            operands: List[Operand] = [
+                self.parse_operand(operand)
+                for operand in split_operands(line[len(words[0]) :])
+            ]
+            self.encode_instruction(keyword, operands)
+
+    def get_label_name(self, name: str) -> str:
+        """Return the full name of a label, local labels starting with a dot belong to the previous label."""
+        return self.global_label + name if name.startswith(".") else name
+
+    def define_label(self, name: str) -> None:
+        """Define a label at the current position of the current section."""
+        if not name.startswith("."):
+            self.global_label = name
+        name = self.get_label_name(name)
+        if name in self.code.symbols:
+            self.error(f"Label '{name}' is defined more than once")
+        offset: int = (
+            self.code.bss_size
+            if self.section == ".bss"
+            else len(self.code.sections.setdefault(self.section, bytearray()))
+        )
+        self.code.symbols[name] = (self.section, offset)
+
+    def align(self, alignment: int) -> None:
+        """Pad the current section to the alignment, code is padded with NOP instructions."""
+        self.code.alignments[self.section] = max(
+            alignment, self.code.alignments.get(self.section, 1)
+        )
+        if self.section == ".bss":
+            self.code.bss_size += -self.code.bss_size % alignment
+            return
+        contents: bytearray = self.code.sections.setdefault(self.section, bytearray())
+        padding: bytes = b"\x90" if self.section == ".text" else b"\x00"
+        contents += padding * (-len(contents) % alignment)
+
+    def reserve(self, size: int) -> None:
+        """Reserve uninitialized bytes, which are zeroed outside .bss."""
+        if self.section == ".bss":
+            self.code.bss_size += size
+        else:
+            self.emit(bytes(size))
+
+    def define_data(self, size: int, values: List[str]) -> None:
+        """Emit strings and numbers as data of the size."""
+        for value in values:
+            if value[0] in "\"'`":
+                self.emit(value[1:-1].encode("utf-8"))
+                continue
+            immediate: Immediate = self.parse_immediate(value)
+            if immediate.symbol is not None:
+                self.add_fixup(len(self.get_contents()), size, immediate)
+            self.emit(to_bytes(immediate.value, size))
+
+    def parse_operand(self, operand: str) -> Operand:
+        """Parse a register, memory or immediate operand."""
+        size: Optional[int] = None
+        words: List[str] = operand.split(None, 1)
+        if len(words) == 2 and words[0].lower() in SIZE_KEYWORDS:
+            size = SIZE_KEYWORDS[words[0].lower()]
+            operand = words[1].strip()
+        if operand.startswith("["):
+            return self.parse_memory(operand[1:-1], size)
+        register: Optional[Register] = get_register(operand)
+        if register is not None:
+            return register
+        return self.parse_immediate(operand)
+
+    def parse_memory(self, expression: str, size: Optional[int]) -> Memory:
+        """Parse the address expression of a memory operand."""
+        displacement, symbol, registers = self.evaluate(expression)
+        base: Optional[int] = None
+        index: Optional[int] = None
+        scale: int = 1
+        for number, factor in registers:
+            if factor == 1 and base is None:
+                base = number
+            elif index is None and factor in (1, 2, 4, 8):
+                index, scale = number, factor
+            else:
+                self.error("Invalid memory operand")
+        if index == 4:
+            if scale != 1 or base == 4:
+                self.error("rsp cannot be used as an index")
+            base, index = index, base
+        return Memory(base, index, scale, displacement, symbol, size)
+
+    def parse_immediate(self, expression: str) -> Immediate:
+        """Parse a numeric expression which may refer to one symbol."""
+        value, symbol, registers = self.evaluate(expression)
+        if registers:
+            self.error("Registers are not allowed in immediate values")
+        return Immediate(value, symbol)
+
+    def evaluate_number(self, expression: str) -> int:
+        """Evaluate an expression which has to be a number."""
+        immediate: Immediate = self.parse_immediate(expression)
+        if immediate.symbol is not None:
+            self.error("Expected a number")
+        return immediate.value
+
+    def evaluate(
+        self, expression: str, depth: int = 0
+    ) -> Tuple[int, Optional[str], List[Tuple[int, int]]]:
+        """
+        Evaluate a sum of products of numbers, registers and symbols.
+        Return the numeric value, the referenced symbol and the registers with their factors.
+        """
+        if depth > 16:
+            self.error(f"Recursive definition in '{expression}'")
+        tokens: List[str] = TOKEN_REGEX.findall(expression)
+        if "".join(tokens) != re.sub(r"\s+", "", expression):
+            self.error(f"Invalid expression '{expression}'")
+        value: int = 0
+        symbol: Optional[str] = None
+        registers: List[Tuple[int, int]] = []
+        for sign, factors in split_terms(tokens):
+            product, term_symbol, term_register = self.evaluate_term(factors, expression, depth)
+            product *= sign
+            if term_register is not None:
+                registers.append((term_register, product))
+            elif term_symbol is not None:
+                if symbol is not None or product != 1:
+                    self.error(f"Unsupported symbol reference in '{expression}'")
+                symbol = term_symbol
+            else:
+                value += product
+        return value, symbol, registers
+
+    def evaluate_term(
+        self, factors: List[str], expression: str, depth: int
+    ) -> Tuple[int, Optional[str], Optional[int]]:
+        """Return the product of the numeric factors of a term and the symbol and the register in it."""
+        product: int = 1
+        symbol: Optional[str] = None
+        register_number: Optional[int] = None
+        for factor in factors:
+            register: Optional[Register] = get_register(factor)
+            if factor[0].isdigit():
+                product *= int(factor, 0)
+            elif register is not None and register.size == 8:
+                register_number = register.number
+            elif factor in self.defines:
+                defined_value, defined_symbol, defined_registers = self.evaluate(
+                    self.defines[factor], depth + 1
+                )
+                if defined_symbol is not None or defined_registers:
+                    self.error(f"Definition '{factor}' is not a number")
+                product *= defined_value
+            elif IDENTIFIER_REGEX.fullmatch(factor):
+                symbol = self.get_label_name(factor)
+            else:
+                self.error(f"Invalid expression '{expression}'")
+        return product, symbol, register_number
+
+
+def assemble(assembly: str) -> ObjectCode:
+    """Assemble the generated assembly to object code."""
+    return Assembler().assemble(assembly)
+
+
+def strip_comment(line: str) -> str:
+    """Remove the comment starting with a semicolon outside of a string."""
+    quote: Optional[str] = None
+    for index, character in enumerate(line):
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in "\"'`":
+            quote = character
+        elif character == ";":
+            return line[:index]
+    return line
+
+
+def split_operands(operands: str) -> List[str]:
+    """Split the operands separated by commas outside of strings and brackets."""
+    parts: List[str] = []
+    current: str = ""
+    quote: Optional[str] = None
+    for character in operands:
+        if quote is not None:
+            quote = None if character == quote else quote
+        elif character in "\"'`":
+            quote = character
+        elif character == ",":
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += character
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def split_terms(tokens: List[str]) -> List[Tuple[int, List[str]]]:
+    """Split the tokens of an expression to signed terms of factors."""
+    terms: List[Tuple[int, List[str]]] = []
+    sign: int = 1
+    factors: List[str] = []
+    for token in tokens:
+        if token in "+-" and factors:
+            terms.append((sign, factors))
+            sign, factors = 1, []
+        if token == "-":
+            sign = -sign
+        elif token not in "+*()":
+            factors.append(token)
+    if factors:
+        terms.append((sign, factors))
+    return terms
+
+
+def get_register(name: str) -> Optional[Register]:
+    """Return the register with the name or None."""
+    name = name.lower()
+    for size, names in REGISTER_NAMES.items():
+        if name in names:
+            return Register(names.index(name), size, name in REX_BYTE_REGISTERS)
+    return None
+
+
+def get_rex(is_64_bit: bool, reg: int, index: int, base: int, is_required: bool) -> bytes:
+    """Return the REX prefix if the instruction needs one."""
+    rex: int = 0x40 | is_64_bit << 3 | reg << 2 | index << 1 | base
+    return bytes([rex]) if rex != 0x40 or is_required else b""
+
+
+def is_signed(value: int, size: int) -> bool:
+    """Check if the value fits in a signed integer of the size in bytes."""
+    return -(2 ** (size * 8 - 1)) <= value < 2 ** (size * 8 - 1)
+
+
+def is_unsigned(value: int, size: int) -> bool:
+    """Check if the value fits in an unsigned integer of the size in bytes."""
+    return 0 <= value < 2 ** (size * 8)
+
+
+def to_bytes(value: int, size: int) -> bytes:
+    """Return the little-endian bytes of the value truncated to the size."""
+    return (value % 2 ** (size * 8)).to_bytes(size, "little")
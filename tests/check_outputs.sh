@@ -1,10 +1,11 @@
 #!/bin/bash
+# Usage: check_outputs.sh [torth.py options]
 shopt -s globstar
 script_dir="$(dirname -- "$(realpath -- "${BASH_SOURCE[0]}")")"
 output_errors=0
 
 # Compile all examples
-$script_dir/compile_all.sh
+$script_dir/compile_all.sh "$@"
 
 for executable in $script_dir/../*.bin; do
   exe_basename=$(basename -s .bin "$executable")
@@ -0,0 +1,31 @@
+#!/bin/bash
+# Usage: compare_assemblers.sh [torth.py options]
+# Compiles every example with NASM and LD and with the built-in assembler and compares the outputs
+shopt -s globstar
+script_dir="$(dirname -- "$(realpath -- "${BASH_SOURCE[0]}")")"
+output_errors=0
+
+for example_file in $script_dir/../examples/**/*.torth $script_dir/*.torth; do
+  exe_basename=$(basename -s .torth "$example_file")
+  echo "[INFO] Comparing $example_file"
+  python3 $script_dir/../torth.py "$@" -o $exe_basename.nasm.bin $example_file &&
+    python3 $script_dir/../torth.py "$@" --builtin-assembler -o $exe_basename.builtin.bin $example_file
+  if [ $? -ne 0 ]; then
+    echo "[ERROR] Compiling $example_file failed"
+    ((output_errors+=1))
+    continue
+  fi
+
+  diff -u <(./$exe_basename.nasm.bin < /dev/null; echo "Exit code: $?") \
+    <(./$exe_basename.builtin.bin < /dev/null; echo "Exit code: $?")
+  if [ $? -ne 0 ]; then
+    echo "[ERROR] $exe_basename output differs between NASM and the built-in assembler"
+    ((output_errors+=1))
+  fi
+  rm -f $exe_basename.nasm.bin $exe_basename.builtin.bin
+done
+
+if [ $output_errors -ne 0 ]; then
+  echo "[ERROR] Outputs differed between the assemblers for $output_errors example(s)"
+  exit 1
+fi
@@ -1,10 +1,11 @@
 #!/bin/bash
+# Usage: compile_all.sh [torth.py options]
 shopt -s globstar
 script_dir="$(dirname -- "$(realpath -- "${BASH_SOURCE[0]}")")"
-for example_file in $script_dir/../examples/**/*.torth; do
+for example_file in $script_dir/../examples/**/*.torth $script_dir/*.torth; do
     echo "[INFO] Compiling $example_file"
-    python3 $script_dir/../torth.py $example_file
+    python3 $script_dir/../torth.py "$@" $example_file
     if [ $? -ne 0 ]; then
         echo "[ERROR] Compiling $example_file failed"
     fi
-done
\ No newline at end of file
+done
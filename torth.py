@@ -5,7 +5,13 @@ Driver code for the Torth compiler
 import argparse
 import pathlib
 from typing import Dict, List, Set
-from compiler.compile import compile_code, link_object_file, remove_compilation_files
+from compiler.compile import (
+    compile_code,
+    compile_code_streaming,
+    get_build_directory,
+    get_executable_file,
+    link_object_files,
+)
 from compiler.defs import Constant, Function, Memory, Program
 from compiler.program import get_sub_programs, type_check_program
 from compiler.lex import (
@@ -16,6 +22,7 @@ from compiler.lex import (
     get_memories_from_code,
     parse_function_bindings,
 )
+from compiler.passes import run_ir_passes, select_optimizations
 from compiler.utils import (
     get_command_line_arguments,
     get_file_contents,
@@ -26,7 +33,7 @@ from compiler.utils import (
 
 def main():
     """Program starts here"""
-    args: argparse.Namespace = get_command_line_arguments()
+    args: argparse.Namespace = select_optimizations(get_command_line_arguments())
     print_if_verbose(f"Parsing the code from {args.code_file}", args.verbose)
     code: str = get_file_contents(args.code_file)
     compiler_directory: str = pathlib.Path(__file__).parent
@@ -38,28 +45,52 @@ def main():
     constants = add_enums_to_constants(included_files, constants)
     memories: List[Memory] = get_memories_from_code(included_files, constants)
     functions = parse_function_bindings(functions, memories)
-    sub_programs: Dict[str, Program] = get_sub_programs(functions, constants, memories)
     code_file_basename: str = pathlib.Path(args.code_file).name
 
-    # Type check sub-programs
-    print_if_verbose("Type checking Functions", args.verbose)
-    for function_name, program in sub_programs.items():
-        type_check_program(functions[function_name], program, functions)
+    # Lower, type check and optimize every Function at once unless streaming
+    sub_programs: Dict[str, Program] = {}
+    if not args.stream:
+        sub_programs = get_sub_programs(functions, constants, memories)
+
+        # Type check sub-programs
+        print_if_verbose("Type checking Functions", args.verbose)
+        for function_name, program in sub_programs.items():
+            type_check_program(functions[function_name], program, functions)
 
-    # Compile code into object file
-    compile_code(code_file_basename, constants, sub_programs, memories, args.verbose)
+        # Optimize sub-programs
+        sub_programs = run_ir_passes(sub_programs, functions, constants, args)
 
-    # Link the object file to a binary and remove compilation files
-    executable_file: str = args.out or code_file_basename.replace(".torth", ".bin")
-    object_file: str = code_file_basename.replace(".torth", ".o")
-    print_if_verbose(
-        f"Linking {object_file} to executable file {executable_file} with LD",
-        args.verbose,
-    )
-    link_object_file(object_file, executable_file)
+    # Intermediate files are written to a private directory which is removed afterwards
+    executable_file: str = get_executable_file(code_file_basename, args)
+    with get_build_directory() as build_directory:
+        # Compile code into object files
+        if args.stream:
+            object_files: List[str] = compile_code_streaming(
+                code_file_basename,
+                functions,
+                constants,
+                memories,
+                build_directory=build_directory,
+                args=args,
+            )
+        else:
+            object_files = compile_code(
+                code_file_basename,
+                constants,
+                sub_programs,
+                memories,
+                build_directory=build_directory,
+                args=args,
+            )
 
-    print_if_verbose("Removing files generated during compilation", args.verbose)
-    remove_compilation_files(code_file_basename, args)
+        # Link the object files to a binary
+        if object_files:
+            print_if_verbose(
+                f"Linking {len(object_files)} object file(s) to executable file {executable_file} with LD",
+                args.verbose,
+            )
+            link_object_files(object_files, executable_file)
+        print_if_verbose(f"Removing build directory {build_directory}", args.verbose)
 
     # Handle special arguments --graph and --run
     handle_arguments(executable_file, args)